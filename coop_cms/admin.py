@@ -57,12 +57,6 @@ class NavTreeAdmin(admin.ModelAdmin):
     list_editable = ['name']
     list_filters = ['id']
 
-    def nodes_li(self, tree):
-        """display the tree nodes for jstree"""
-        root_nodes = tree.get_root_nodes()
-        nodes_li = ''.join([node.as_jstree() for node in root_nodes])
-        return nodes_li
-
     def navtypes_list(self, tree):
         """list of navigable types"""
         if tree.types.count() == 0:
@@ -81,7 +75,6 @@ class NavTreeAdmin(admin.ModelAdmin):
             raise Http404
         tree = models.get_navtree_class().objects.get(id=object_id)
         extra_context['navtree'] = tree
-        extra_context['navtree_nodes'] = self.nodes_li(tree)
         return super(NavTreeAdmin, self).change_view(
             request, str(object_id), extra_context=extra_context, *args, **kwargs
         )  # pylint: disable=E1002
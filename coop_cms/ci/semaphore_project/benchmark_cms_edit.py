@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+measure the rendering time of the cms_edit tag
+
+Renders a cms_edit block in view and edit modes and accesses a field of a FormWrapper.
+Prints the best time of each in microseconds: compare it before and after a change of coop_edition.
+
+usage: python benchmark_cms_edit.py [--number 2000] [--repeat 3]
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import os
+import timeit
+
+
+BENCHMARK_TEMPLATE = (
+    '{% load coop_edition %}{% cms_form_media %}'
+    '{% cms_edit obj %}<h1>{{ obj.title }}</h1><div>{{ obj.content }}</div>{% end_cms_edit %}'
+)
+
+
+class BenchmarkObject(object):
+    """the object being edited"""
+    title = "Hello"
+    content = "<p>World</p>"
+
+    def get_edit_url(self):
+        """url for editing"""
+        return "/edit/"
+
+
+def run_benchmarks(number, repeat):
+    """returns the best time in microseconds of each benchmark"""
+    from django import forms
+    from django.template import Context, Template
+    from django.test import RequestFactory
+
+    from coop_cms.templatetags.coop_edition import FormWrapper
+
+    class BenchmarkForm(forms.Form):
+        """an inline editable form"""
+        title = forms.CharField()
+        content = forms.CharField(widget=forms.Textarea)
+        is_inline_editable = True
+
+    request = RequestFactory().get('/')
+    template_ = Template(BENCHMARK_TEMPLATE)
+    form = BenchmarkForm()
+    obj = BenchmarkObject()
+
+    benchmarks = (
+        ('view mode', lambda: template_.render(Context({'obj': obj, 'request': request}))),
+        ('edit mode', lambda: template_.render(Context({'obj': obj, 'form': form, 'request': request}))),
+        ('form field', lambda: FormWrapper(form, obj)['title']),
+    )
+    return [
+        (name, min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1000000)
+        for name, function in benchmarks
+    ]
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+    parser = argparse.ArgumentParser(description="benchmark the edition tags")
+    parser.add_argument('--number', type=int, default=2000, help="number of renders by measure")
+    parser.add_argument('--repeat', type=int, default=3, help="number of measures: the best one is kept")
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+
+    for name, duration in run_benchmarks(args.number, args.repeat):
+        print('{0}: {1:.1f}us'.format(name, duration))
@@ -3,14 +3,20 @@
 
 from __future__ import unicode_literals
 
+from calendar import timegm
+
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.contrib.messages.api import success as success_message, error as error_message
+from django.contrib.messages.api import get_messages, success as success_message, error as error_message
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.forms.models import modelformset_factory
 from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.middleware.gzip import re_accepts_gzip
 from django.shortcuts import render, get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.text import compress_string
 from django.utils.translation import ugettext as _, get_language
 from django.views.generic import TemplateView
 from django.views.generic.base import View
@@ -21,7 +27,15 @@ from coop_html_editor import utils as html_editor_utils
 from coop_cms.exceptions import ArticleNotAllowed
 from coop_cms.logger import logger
 from coop_cms.moves import reverse, is_authenticated
-from coop_cms.settings import is_cache_enabled
+from coop_cms.models import Fragment, PieceOfHtml
+from coop_cms.settings import (
+    get_cache_stale_timeout, is_cache_enabled, is_cache_gzip_enabled, is_conditional_get_enabled
+)
+from coop_cms.utils import (
+    acquire_cache_lock, add_cache_dependency, get_cache_versions, get_model_cache_tag, get_object_cache_tag,
+    get_stale_tagged_cache, get_visitor_class, make_cache_key, release_cache_lock, set_tagged_cache,
+    start_cache_dependencies, stop_cache_dependencies
+)
 
 
 class ListView(DjangoListView):
@@ -137,12 +151,79 @@ class EditableObjectView(View):
         form_class = self.get_form_class()
         return form_class(*args, **kwargs)
 
-    def get_cache_key(self, obj):
+    def get_cache_key(self, obj, visitor_class=None):
         language = get_language()
         class_name = '{0}.{1}'.format(obj.__class__.__module__, obj.__class__.__name__)
-        cache_key = '{0}-{1}-{2}-{3}'.format(settings.SITE_ID, language, class_name, obj.id)
+        # The page may be different for anonymous and authenticated users: login_required, links for staff...
+        visitor_class = visitor_class or get_visitor_class(self.request)
+        cache_key = '{0}-{1}-{2}-{3}-{4}'.format(settings.SITE_ID, language, class_name, obj.id, visitor_class)
         return cache_key
 
+    def get_cached_response(self, value, validators=None):
+        """build the response from the cached value"""
+        if value['gzip'] is not None and re_accepts_gzip.search(self.request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response = HttpResponse(value['gzip'], status=value['status'])
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(value['content'], status=value['status'])
+        for (header, header_value) in value['headers']:
+            response[header] = header_value
+        if value['gzip'] is not None:
+            patch_vary_headers(response, ('Accept-Encoding', ))
+        if validators:
+            self.set_validators(response, validators)
+        return response
+
+    def get_cache_value(self, response, cache_tags=()):
+        """the response as stored in cache: status, headers, content and the tags recorded when rendering"""
+        return {
+            'status': response.status_code,
+            'headers': list(response.items()),
+            'content': response.content,
+            'gzip': compress_string(response.content) if is_cache_gzip_enabled() else None,
+            'tags': sorted(cache_tags),
+        }
+
+    def can_use_conditional_get(self):
+        """check if the page can be answered with 304 Not Modified"""
+        if self.edit_mode or not is_conditional_get_enabled():
+            return False
+        # The pending messages must be displayed
+        return len(get_messages(self.request)) == 0
+
+    def get_conditional_tags(self):
+        """the page is modified when the version of one of these tags changes"""
+        return [
+            get_object_cache_tag(self.object), 'navigation', get_model_cache_tag(Fragment),
+            get_model_cache_tag(PieceOfHtml),
+        ]
+
+    def get_validators(self, cached_value=None, cache_versions=None):
+        """
+        returns the etag and the last modified timestamp of the page
+        The tags recorded when rendering the page are used if known: from the cached page or the given versions
+        """
+        tags = set(self.get_conditional_tags())
+        if cached_value is not None:
+            tags.update(cached_value.get('tags', []))
+        versions = dict(cache_versions or {})
+        versions.update(get_cache_versions([tag for tag in tags if tag not in versions]))
+        last_modified = max(versions.values()) // 1000 if versions else 0
+        modified = getattr(self.object, 'modified', None)
+        if modified:
+            last_modified = max(last_modified, timegm(modified.utctimetuple()))
+        etag = make_cache_key(
+            'page', self.get_cache_key(self.object), self.request.user.pk, modified, sorted(versions.items())
+        )
+        return quote_etag(etag), last_modified
+
+    def set_validators(self, response, validators):
+        """add the ETag and Last-Modified headers to the response"""
+        etag, last_modified = validators
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Cookie', ))
+
     def get(self, request, *args, **kwargs):
         """handle http get -> view"""
 
@@ -162,21 +243,64 @@ class EditableObjectView(View):
             logger.warning("PermissionDenied")
             raise PermissionDenied
 
+        cache_key, cached_value, is_stale = None, None, True
         if self.can_cache():
-            response_content = cache.get(self.get_cache_key(self.object))
-            if response_content:
-                return HttpResponse(response_content)
-        
+            cache_key = self.get_cache_key(self.object)
+            cached_value, is_stale = get_stale_tagged_cache(cache_key)
+
+        validators = None
+        if self.can_use_conditional_get():
+            validators = self.get_validators(cached_value)
+            response = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+            if response is not None:
+                return response
+
+        if cache_key is None:
+            return self.render_object(request, validators)
+
+        if cached_value is not None and not is_stale:
+            return self.get_cached_response(cached_value, validators)
+
+        stale_timeout = get_cache_stale_timeout()
+        if cached_value is not None and stale_timeout:
+            # The stale page is sent while it is rendered again by the request which gets the lock
+            if not acquire_cache_lock(cache_key, stale_timeout):
+                return self.get_cached_response(cached_value, validators)
+            try:
+                return self.render_object(request, validators, cache_key)
+            finally:
+                release_cache_lock(cache_key)
+
+        return self.render_object(request, validators, cache_key)
+
+    def render_object(self, request, validators, cache_key=None):
+        """render the page and store it in cache if a cache_key is given"""
         self.form = self.get_form(instance=self.object)
-        
-        response = render(
-            request,
-            self.get_template(),
-            self.get_context_data()
-        )
 
-        if response.status_code == 200 and self.can_cache():
-            cache.set(self.get_cache_key(self.object), response.content)
+        # The objects used by the templates are recorded with their version when used:
+        # the page is invalidated if one of them is modified, even while rendering
+        start_cache_dependencies()
+        try:
+            add_cache_dependency(get_object_cache_tag(self.object))
+            response = render(
+                request,
+                self.get_template(),
+                self.get_context_data()
+            )
+        finally:
+            cache_versions = stop_cache_dependencies()
+
+        if response.status_code == 200 and cache_key:
+            set_tagged_cache(
+                cache_key, self.get_cache_value(response, cache_versions.keys()), cache_versions,
+                get_cache_stale_timeout()
+            )
+            if validators:
+                # The next requests get the validators from the tags stored with the cached page
+                validators = self.get_validators(cache_versions=cache_versions)
+
+        if response.status_code == 200 and validators:
+            self.set_validators(response, validators)
 
         return response
 
@@ -203,7 +327,10 @@ class EditableObjectView(View):
         if self.form.is_valid() and all([_form.is_valid() for _form in inline_html_forms]):
 
             if self.is_cache_enabled():
-                cache.delete(self.get_cache_key(self.object))
+                cache.delete_many([
+                    self.get_cache_key(self.object, visitor_class)
+                    for visitor_class in ('anonymous', 'authenticated', 'staff')
+                ])
 
             self.object = self.form.save()
             
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""create the articles referenced by the article_link templatetags"""
+
+from __future__ import unicode_literals
+
+import os
+import os.path
+
+from django.core.management.base import BaseCommand
+from django.template import Context, engines, TemplateDoesNotExist, TemplateSyntaxError, Variable
+from django.template.backends.django import DjangoTemplates
+from django.utils import translation
+
+from coop_cms.templatetags.coop_utils import ArticleLinkNode
+
+
+def get_template_names():
+    """returns the list of (engine, template name) of every template of the project"""
+    template_names = []
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates):
+            continue
+        for template_dir in engine.template_dirs:
+            for dir_path, dir_names, file_names in os.walk(template_dir):
+                for file_name in sorted(file_names):
+                    template_name = os.path.relpath(os.path.join(dir_path, file_name), template_dir)
+                    template_names.append((engine, template_name.replace(os.sep, '/')))
+    return template_names
+
+
+def get_article_links(engine, template_name):
+    """returns the article_link nodes of a template whose title is a string"""
+    try:
+        template = engine.get_template(template_name)
+    except (TemplateDoesNotExist, TemplateSyntaxError, UnicodeDecodeError):
+        return []
+    return [
+        node for node in template.template.nodelist.get_nodes_by_type(ArticleLinkNode)
+        if Variable(node.title).literal is not None
+    ]
+
+
+class Command(BaseCommand):
+    """create articles"""
+    help = (
+        "Create the articles referenced by the article_link templatetags of the templates. "
+        "Run it after a deploy with COOP_CMS_ARTICLE_LINK_AUTOCREATE = False: the pages never write when rendered."
+    )
+
+    def handle(self, *args, **options):
+        """command"""
+        verbosity = options.get('verbosity', 1)
+        created = 0
+        for engine, template_name in get_template_names():
+            for node in get_article_links(engine, template_name):
+                title = '{0}'.format(Variable(node.title).literal)
+                # the language of the tag rendered without request
+                current_lang = None if node.lang else node.get_language(Context())
+                with translation.override(node.lang or current_lang):
+                    if node.find_article(title, current_lang) is None:
+                        node.find_article(title, current_lang, create=True)
+                        created += 1
+                        if verbosity > 1:
+                            self.stdout.write('{0}: {1}'.format(template_name, title))
+        if verbosity:
+            self.stdout.write('{0} articles created'.format(created))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""create the navigation trees used by the navigation templatetags"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+
+from coop_cms.management.commands.create_article_links import get_template_names
+from coop_cms.settings import get_navtree_class
+from coop_cms.templatetags.coop_navigation import NavigationTemplateNode
+
+
+def get_navtree_names(engine, template_name):
+    """returns the names of the trees used by the navigation tags of a template"""
+    try:
+        template = engine.get_template(template_name)
+    except (TemplateDoesNotExist, TemplateSyntaxError, UnicodeDecodeError):
+        return []
+    names = []
+    for node in template.template.nodelist.get_nodes_by_type(NavigationTemplateNode):
+        tree_var = node._kwargs.get('tree')
+        if tree_var is None:
+            names.append('default')
+        else:
+            # an unresolved variable is used as the name when rendering
+            names.append('{0}'.format(tree_var.literal if tree_var.literal is not None else tree_var.var))
+    return names
+
+
+class Command(BaseCommand):
+    """create navigation trees"""
+    help = (
+        "Create the navigation trees used by the navigation templatetags of the templates. "
+        "The pages never create them when rendered: a missing tree is rendered as an empty navigation."
+    )
+
+    def handle(self, *args, **options):
+        """command"""
+        verbosity = options.get('verbosity', 1)
+        created = 0
+        for engine, template_name in get_template_names():
+            for name in get_navtree_names(engine, template_name):
+                if get_navtree_class().objects.get_or_create(name=name)[1]:
+                    created += 1
+                    if verbosity > 1:
+                        self.stdout.write('{0}: {1}'.format(template_name, name))
+        if verbosity:
+            self.stdout.write('{0} navigation trees created'.format(created))
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""render the public pages of the site as static html files"""
+
+from __future__ import unicode_literals
+
+import json
+from multiprocessing import cpu_count, Pool
+import os
+import os.path
+import tempfile
+
+from six.moves.urllib.parse import urlparse
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from coop_cms.site_urls import get_site_urls
+from coop_cms.utils import get_cache_versions, start_cache_dependencies, stop_cache_dependencies
+
+MANIFEST_NAME = '.coop_cms_freeze.json'
+
+
+def get_file_path(output_dir, url):
+    """the file of a page: /en/article/ is saved as en/article/index.html"""
+    path = urlparse(url).path.lstrip('/')
+    if not path or path.endswith('/'):
+        path += 'index.html'
+    elif '.' not in path.split('/')[-1]:
+        path += '/index.html'
+    return os.path.join(output_dir, *path.split('/'))
+
+
+def write_file(file_path, content):
+    """write the file atomically: a web server never sends a partial page"""
+    dir_name = os.path.dirname(file_path)
+    os.makedirs(dir_name, exist_ok=True)
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=dir_name, prefix='.tmp-')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as tmp_file:
+            tmp_file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def freeze_page(args):
+    """render a page with the views of the site and save it. Returns url, status and versions of its tags"""
+    language, url, output_dir, host = args
+    client = Client(HTTP_HOST=host)
+    # The page must be rendered: not taken from the cache
+    with override_settings(COOP_CMS_CACHE=False, COOP_CMS_CONDITIONAL_GET=False):
+        start_cache_dependencies()
+        try:
+            response = client.get(url, HTTP_ACCEPT_LANGUAGE=language)
+        except Exception as err:
+            return url, '{0}'.format(err), None
+        finally:
+            # the versions of the tags when they were used: a change made while rendering is seen next time
+            versions = stop_cache_dependencies()
+
+    if response.status_code != 200:
+        return url, response.status_code, None
+    write_file(get_file_path(output_dir, url), response.content)
+    return url, response.status_code, versions
+
+
+class Command(BaseCommand):
+    """freeze the site"""
+    help = (
+        "Render the homepage, published articles, categories, sitemap and COOP_CMS_SITE_EXTRA_URLS of the site "
+        "in every language as static html files. Run it with the settings of each site. "
+        "The incremental mode needs a cache shared by all processes: the versions of the dependencies of "
+        "the pages are stored in it."
+    )
+
+    def add_arguments(self, parser):
+        """command arguments"""
+        parser.add_argument('output_dir')
+        parser.add_argument(
+            '--processes', type=int, default=cpu_count(), help="number of processes rendering the pages"
+        )
+        parser.add_argument(
+            '--incremental', action='store_true', default=False,
+            help="only render the pages whose dependencies changed since the last run"
+        )
+        parser.add_argument('--host', default='', help="the host of the requests. The site domain by default")
+
+    def _load_manifest(self, output_dir):
+        """the pages of the last run"""
+        try:
+            with open(os.path.join(output_dir, MANIFEST_NAME)) as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _is_up_to_date(self, output_dir, url, page_info):
+        """True if the page exists and none of its dependencies changed"""
+        # The dependencies of some pages (sitemap...) are unknown: they are always rendered
+        if not page_info or not page_info['tags']:
+            return False
+        if not os.path.exists(get_file_path(output_dir, url)):
+            return False
+        return get_cache_versions(list(page_info['tags'].keys())) == page_info['tags']
+
+    def handle(self, *args, **options):
+        """command"""
+        verbosity = options.get('verbosity', 1)
+        output_dir = os.path.abspath(options['output_dir'])
+        host = options['host'] or Site.objects.get_current().domain
+        old_manifest = self._load_manifest(output_dir)
+        manifest = {}
+
+        tasks = []
+        for language, url in get_site_urls():
+            if options['incremental'] and self._is_up_to_date(output_dir, url, old_manifest.get(url)):
+                manifest[url] = old_manifest[url]
+            else:
+                tasks.append((language, url, output_dir, host))
+
+        if options['processes'] > 1 and len(tasks) > 1:
+            # every process must open its own database connection
+            connections.close_all()
+            pool = Pool(options['processes'])
+            try:
+                results = list(pool.imap_unordered(freeze_page, tasks))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [freeze_page(task) for task in tasks]
+
+        up_to_date = len(manifest)
+        errors = 0
+        for url, status, versions in results:
+            if versions is None:
+                errors += 1
+                if verbosity:
+                    self.stderr.write('{0}: {1}'.format(url, status))
+                if status not in (404, 410) and url in old_manifest:
+                    # the page of the last run is kept until it is rendered again
+                    manifest[url] = old_manifest[url]
+            else:
+                manifest[url] = {'tags': versions}
+
+        # remove the pages which are not published anymore or not found
+        for url in set(old_manifest.keys()) - set(manifest.keys()):
+            file_path = get_file_path(output_dir, url)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+        write_file(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest).encode('utf-8'))
+
+        if verbosity:
+            self.stdout.write('{0} pages rendered, {1} up to date, {2} errors'.format(
+                len(results) - errors, up_to_date, errors
+            ))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""render the public pages of the site so that they are in the cache"""
+
+from __future__ import unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+import math
+import time
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+
+from coop_cms.site_urls import get_site_urls
+
+
+def get_percentile(sorted_values, percent):
+    """the value below which percent % of the values are: nearest rank"""
+    if not sorted_values:
+        return 0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def warm_page(language, url, host):
+    """request the page as an anonymous visitor. Returns url, status and duration in seconds"""
+    client = Client(HTTP_HOST=host)
+    start_time = time.time()
+    try:
+        status = client.get(url, HTTP_ACCEPT_LANGUAGE=language).status_code
+    except Exception as err:
+        status = '{0}'.format(err)
+    return url, status, time.time() - start_time
+
+
+def warm_page_in_thread(args):
+    """request the page from a worker thread: its database connection is closed after"""
+    try:
+        return warm_page(*args)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    """warm the cache"""
+    help = (
+        "Request the homepage, published articles, categories and sitemap of the site in every language "
+        "so that they are cached. Run it after a deploy or a mass publication."
+    )
+
+    def add_arguments(self, parser):
+        """command arguments"""
+        parser.add_argument('--workers', type=int, default=4, help="number of pages rendered at the same time")
+        parser.add_argument('--host', default='', help="the host of the requests. The site domain by default")
+
+    def handle(self, *args, **options):
+        """command"""
+        verbosity = options.get('verbosity', 1)
+        host = options['host'] or Site.objects.get_current().domain
+        tasks = [(language, url, host) for (language, url) in get_site_urls()]
+
+        start_time = time.time()
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(warm_page_in_thread, tasks))
+        else:
+            results = [warm_page(*task) for task in tasks]
+        total_duration = time.time() - start_time
+
+        durations = sorted([duration for (url, status, duration) in results])
+        # redirections are not errors: the homepage may redirect to an article
+        errors = [
+            (url, status) for (url, status, duration) in results if not isinstance(status, int) or status >= 400
+        ]
+        if verbosity > 1:
+            for url, status in errors:
+                self.stderr.write('{0}: {1}'.format(url, status))
+        if verbosity:
+            self.stdout.write('{0} pages in {1:.1f}s, {2} errors'.format(len(results), total_duration, len(errors)))
+            self.stdout.write('p50: {0:.0f}ms p90: {1:.0f}ms p99: {2:.0f}ms max: {3:.0f}ms'.format(
+                *[get_percentile(durations, percent) * 1000 for percent in (50, 90, 99, 100)]
+            ))
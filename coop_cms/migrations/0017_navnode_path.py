@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_nodes_path(apps, schema_editor):
+    # Compute the path of every node from its ancestors
+    node_class = apps.get_model("coop_cms", "NavNode")
+
+    parents = dict(node_class.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def get_path(node_id, visited):
+        if node_id not in paths:
+            parent_id = parents.get(node_id)
+            if parent_id and parent_id in parents and parent_id not in visited:
+                paths[node_id] = '{0}{1}/'.format(get_path(parent_id, visited | {node_id}), parent_id)
+            else:
+                paths[node_id] = '/'
+        return paths[node_id]
+
+    for node_id in parents:
+        node_class.objects.filter(id=node_id).update(path=get_path(node_id, set()))
+
+
+def reset_nodes_path(apps, schema_editor):
+    # Nothing to do: the field is removed
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop_cms', '0016_auto_20190509_2158'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='navnode',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255, verbose_name='path'),
+        ),
+        migrations.RunPython(set_nodes_path, reset_nodes_path),
+    ]
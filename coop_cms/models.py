@@ -3,6 +3,7 @@
 
 from __future__ import unicode_literals
 
+from bisect import bisect_left, bisect_right
 from datetime import datetime
 import os
 import os.path
@@ -15,12 +16,14 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.contrib.staticfiles import finders
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files import File
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Q, Value, When
 from django.db.models.aggregates import Max
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import m2m_changed, pre_delete, post_delete, post_save
 from django.template.loader import get_template
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.html import escape
@@ -35,10 +38,14 @@ from coop_cms.optionals import build_localized_fieldname
 from coop_cms.settings import (
     get_article_class, get_article_logo_size, get_article_logo_crop, get_article_templates, get_default_logo,
     get_headline_image_size, get_headline_image_crop, get_img_folder, get_newsletter_item_classes,
-    get_navtree_class, get_max_image_width, is_localized, is_requestprovider_installed, COOP_CMS_NAVTREE_CLASS,
-    cms_no_homepage, homepage_no_redirection, has_localized_urls
+    get_navtree_class, get_max_image_width, is_localized, is_navigation_version_enabled,
+    is_cache_enabled, is_requestprovider_installed, COOP_CMS_NAVTREE_CLASS, cms_no_homepage, homepage_no_redirection,
+    has_localized_urls
+)
+from coop_cms.utils import (
+    bump_cache_version, dehtml, get_cache_version, get_model_cache_tag, get_object_cache_tag, RequestManager,
+    RequestNotFound, get_model_label, make_cache_key, make_locale_path, slugify
 )
-from coop_cms.utils import dehtml, RequestManager, RequestNotFound, get_model_label, make_locale_path, slugify
 
 ADMIN_THUMBS_SIZE = '60x60'
 
@@ -54,14 +61,15 @@ def validate_slug(value):
         raise ValidationError(_('The slug must only contains letters, numbers or hyphens'), code='invalid')
 
 
-def get_object_label(content_type, obj):
+def get_object_label(content_type, obj, nav_type=None):
     """
     returns the label used in navigation according to the configured rule
     """
     if not obj:
         return ugettext("Node")
     try:
-        nav_type = NavType.objects.get(content_type=content_type)
+        if nav_type is None:
+            nav_type = NavType.objects.get(content_type=content_type)
         if nav_type.label_rule == NavType.LABEL_USE_SEARCH_FIELD:
             label = getattr(obj, nav_type.search_field)
         elif nav_type.label_rule == NavType.LABEL_USE_GET_LABEL:
@@ -85,6 +93,22 @@ def set_node_ordering(node, tree, parent):
     node.ordering = max_ordering + 1
 
 
+def compact_nodes_ordering(tree, parent):
+    """renumber the siblings from 1 without gaps: a single UPDATE for the whole group"""
+    if parent:
+        sibling_nodes = NavNode.objects.filter(tree=tree, parent=parent)
+    else:
+        sibling_nodes = NavNode.objects.filter(tree=tree, parent__isnull=True)
+    nodes_ids = list(sibling_nodes.select_for_update().order_by('ordering', 'id').values_list('id', flat=True))
+    if nodes_ids:
+        NavNode.objects.filter(id__in=nodes_ids).update(
+            ordering=Case(
+                *[When(id=node_id, then=Value(index + 1)) for (index, node_id) in enumerate(nodes_ids)],
+                output_field=models.IntegerField()
+            )
+        )
+
+
 def create_navigation_node(content_type, obj, tree, parent):
     """create navigation node"""
     node = NavNode(tree=tree, label=get_object_label(content_type, obj))
@@ -97,6 +121,37 @@ def create_navigation_node(content_type, obj, tree, parent):
     return node
 
 
+def prefetch_content_objects(nodes):
+    """
+    Resolve the content_object of the given nodes with one query by model rather than one query by node.
+    The sites of the objects are loaded at the same time: is_accessible doesn't query the database anymore
+    """
+    object_ids_by_type = {}
+    for node in nodes:
+        if node.content_type_id and node.object_id is not None:
+            object_ids_by_type.setdefault(node.content_type_id, set()).add(node.object_id)
+
+    objects = {}
+    for (content_type_id, object_ids) in object_ids_by_type.items():
+        model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model_class is None:
+            # The model doesn't exist anymore
+            continue
+        queryset = model_class._default_manager.filter(id__in=object_ids)
+        has_sites = any(
+            field.name == 'sites' and field.many_to_many for field in model_class._meta.get_fields()
+        )
+        if has_sites:
+            queryset = queryset.prefetch_related('sites')
+        for obj in queryset:
+            objects[(content_type_id, obj.id)] = obj
+
+    for node in nodes:
+        obj = objects.get((node.content_type_id, node.object_id))
+        if obj is not None:
+            NavNode.content_object.set_cached_value(node, obj)
+
+
 def get_navigable_type_choices():
     """returns the list of choice of navigable types"""
     types = [('', '')]
@@ -175,6 +230,23 @@ class NavTree(BaseNavTree):
         return self.name
 
 
+# tree name -> tree id: cached by process and cleared when the navigation version changes
+_navtree_ids = {'version': None, 'ids': {}}
+
+
+def get_navtree_id(name):
+    """returns the id of the tree with the given name or None if it doesn't exist"""
+    version = get_cache_version('navigation')
+    if _navtree_ids['version'] != version:
+        # a tree has been saved or deleted
+        _navtree_ids['version'] = version
+        _navtree_ids['ids'] = {}
+    navtree_ids = _navtree_ids['ids']
+    if name not in navtree_ids:
+        navtree_ids[name] = get_navtree_class().objects.filter(name=name).values_list('id', flat=True).first()
+    return navtree_ids[name]
+
+
 @python_2_unicode_compatible
 class NavNode(models.Model):
     """
@@ -204,6 +276,54 @@ class NavNode(models.Model):
     object_id = models.PositiveIntegerField(verbose_name=_("object id"), blank=True, null=True)
     content_object = GenericForeignKey('content_type', 'object_id')
     in_navigation = models.BooleanField(_("in navigation"), default=True)
+    # ids of the ancestors separated by '/' : '/' for a root node, '/12/34/' for a child of node 34
+    path = models.CharField(_("path"), max_length=255, blank=True, default="", db_index=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """keep the path as loaded: the descendants must be updated if it changes"""
+        instance = super(NavNode, cls).from_db(db, field_names, values)
+        instance._loaded_path = instance.__dict__.get('path')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """save and update the path of the descendants if the node has moved"""
+        if self.parent_id:
+            self.path = '{0}{1}/'.format(self.parent.path, self.parent_id)
+        else:
+            self.path = '/'
+        old_path = getattr(self, '_loaded_path', None)
+        ret = super(NavNode, self).save(*args, **kwargs)
+        if old_path and old_path != self.path:
+            old_prefix = self.get_descendants_path(old_path)
+            new_prefix = self.get_descendants_path()
+            NavNode.objects.filter(path__startswith=old_prefix).update(
+                path=Concat(Value(new_prefix), Substr('path', len(old_prefix) + 1))
+            )
+        self._loaded_path = self.path
+        return ret
+
+    def get_descendants_path(self, path=None):
+        """the beginning of the path of every descendant"""
+        return '{0}{1}/'.format(self.path if path is None else path, self.id)
+
+    def get_ancestors_ids(self):
+        """ids of the ancestors from the root node to the parent"""
+        return [int(node_id) for node_id in self.path.split('/') if node_id]
+
+    def get_ancestors(self):
+        """ancestors from the root node to the parent: a single query"""
+        ancestors_ids = self.get_ancestors_ids()
+        ancestors = NavNode.objects.in_bulk(ancestors_ids) if ancestors_ids else {}
+        return [ancestors[node_id] for node_id in ancestors_ids if node_id in ancestors]
+
+    def get_descendants(self):
+        """children, grand-children ... as queryset: a single query"""
+        return NavNode.objects.filter(path__startswith=self.get_descendants_path())
+
+    def get_depth(self):
+        """0 for root nodes"""
+        return len(self.get_ancestors_ids())
 
     def get_absolute_url(self):
         """url"""
@@ -216,6 +336,10 @@ class NavNode(models.Model):
     
     def is_active_node(self):
         """true if link correspond to the current page"""
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is not None:
+            # The html depends on the current page: the navigation cache must take it into account
+            snapshot.uses_active_node = True
         url = self.get_absolute_url()
         if url and is_requestprovider_installed():
             try:
@@ -241,6 +365,13 @@ class NavNode(models.Model):
 
     def is_accessible(self):
         """returns True if the content can be accessed"""
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is not None:
+            return snapshot.is_accessible(self)
+        return self._check_accessibility()
+
+    def _check_accessibility(self):
+        """returns True if the content can be accessed: not cached"""
 
         # If I point to a content : returns True if content can be accesssed
         if self.content_object:
@@ -272,6 +403,10 @@ class NavNode(models.Model):
 
     def get_children(self, in_navigation=None, allow_all=False):
         """children of the node"""
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is not None:
+            return snapshot.get_children(self, in_navigation=in_navigation, allow_all=allow_all)
+
         nodes = NavNode.objects.filter(parent=self).order_by("ordering")
         # Be careful : in_navigation can be False
         if in_navigation is not None:
@@ -289,11 +424,11 @@ class NavNode(models.Model):
 
     def has_children(self):
         """True if has children"""
-        return self.get_children(True).count()
+        return len(self.get_children(True))
     
     def get_children_count(self):
         """number of children"""
-        return self.get_children(True).count()
+        return len(self.get_children(True))
     
     def get_children_navigation(self):
         """children"""
@@ -301,6 +436,10 @@ class NavNode(models.Model):
 
     def get_siblings(self, in_navigation=None):
         """other nodes at same level"""
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is not None:
+            return snapshot.get_children(self.parent_id, in_navigation=in_navigation)
+
         nodes = NavNode.objects.filter(parent=self.parent).order_by("ordering")
         if in_navigation is not None:
             nodes = nodes.filter(in_navigation=in_navigation)
@@ -316,10 +455,18 @@ class NavNode(models.Model):
 
     def get_progeny(self, level=0):
         """children, grand-children ..."""
-        progeny = [(self, level)]
-        for child in NavNode.objects.filter(parent=self).order_by("ordering"):
-            progeny.extend(child.get_progeny(level + 1))
-        return progeny
+        children_by_parent = {}
+        for node in self.get_descendants().order_by("ordering"):
+            children_by_parent.setdefault(node.parent_id, []).append(node)
+
+        def _get_progeny(node, node_level):
+            """walk through the tree in memory"""
+            progeny = [(node, node_level)]
+            for child in children_by_parent.get(node.id, []):
+                progeny.extend(_get_progeny(child, node_level + 1))
+            return progeny
+
+        return _get_progeny(self, level)
 
     def as_jstree(self):
         """formatted for jstree -> displayed as tree view in admin"""
@@ -338,6 +485,23 @@ class NavNode(models.Model):
             "in_nav" if self.in_navigation and self.is_accessible() else "out_nav"
         )
 
+    def as_json_dict(self, allow_all=False):
+        """
+        the node and its children in navigation as a dict : serialized by the navigation json view
+        The children which can not be accessed are only included if allow_all is True
+        """
+        return {
+            'id': self.id,
+            'label': self.label,
+            'url': self.get_absolute_url(),
+            'external': bool(self.is_external()),
+            'accessible': bool(self.is_accessible()),
+            'children': [
+                child.as_json_dict(allow_all)
+                for child in self.get_children(in_navigation=True, allow_all=allow_all)
+            ],
+        }
+
     def _get_li_content(self, li_template, node_pos=0, total_nodes=0):
         """content when displayed in li html tag"""
         try:
@@ -401,22 +565,23 @@ class NavNode(models.Model):
         node_pos = kwargs.get("node_pos", 0)
         total_nodes = kwargs.get("total_nodes", 0)
 
+        children = self.get_children(in_navigation=True)
         children_li = [
             child.as_navigation(
                 li_node=li_node,
                 li_template=li_template,
                 css_class=css_class,
                 node_pos=node_pos + 1,
-                total_nodes=self.get_children_count()
+                total_nodes=len(children)
             )
-            for child in self.get_children(in_navigation=True) if child.is_accessible()
+            for child in children if child.is_accessible()
         ]
         ul_format = self._get_ul_format(ul_template)
         children_html = ul_format.format(''.join(children_li)) if children_li else ""
 
         args = self._get_li_args(li_args)
         if args.find("class=") < 0:
-            css_class = 'class="{0} {1}"'.format(css_class, active_class if self.is_active_node() else "")
+            css_class = 'class="{0} {1}"'.format(css_class, self._get_active_class(active_class))
         else:
             css_class = ""
 
@@ -427,9 +592,27 @@ class NavNode(models.Model):
         else:
             return self._get_li_content(li_node, node_pos, total_nodes)
 
+    def _get_active_class(self, active_class):
+        """
+        css class of the node if active.
+        When rendering for the navigation cache, a placeholder is returned and replaced when serving the html
+        """
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is not None and snapshot.active_nodes is not None:
+            placeholder = '__coop_cms_active_node_{0}__'.format(self.id)
+            snapshot.active_nodes[placeholder] = (self.get_absolute_url(), active_class)
+            return placeholder
+        return active_class if self.is_active_node() else ""
+
     def as_breadcrumb(self, li_template=None, css_class=""):
         """iterate node by parents through root node"""
-        html = self.parent.as_breadcrumb(li_template) if self.parent else ""
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is not None:
+            ancestors = [snapshot.get_node(node_id) for node_id in self.get_ancestors_ids()]
+            ancestors = [node for node in ancestors if node is not None]
+        else:
+            ancestors = self.get_ancestors()
+        html = ''.join(['<li class="">{0}</li>'.format(node._get_li_content(li_template)) for node in ancestors])
         return html + '<li class="{0}">{1}</li>'.format(css_class, self._get_li_content(li_template))
 
     def children_as_navigation(self, li_template=None, css_class=""):
@@ -454,11 +637,80 @@ class NavNode(models.Model):
             raise ValidationError(_('A node can not be its own parent'))
 
         if parent_id:
-            cur_node = NavNode.objects.get(id=parent_id)
-            while cur_node:
-                if cur_node.id == self.id:
-                    raise ValidationError(_('A node can not be child of its own child'))
-                cur_node = cur_node.parent
+            parent = NavNode.objects.get(id=parent_id)
+            if self.id in parent.get_ancestors_ids():
+                raise ValidationError(_('A node can not be child of its own child'))
+
+
+class NavTreeSnapshot(object):
+    """
+    All the nodes of a navigation tree loaded with a single query and indexed by parent.
+    The nodes are bound to the snapshot: children, siblings and parents are then read from memory
+    """
+    # If a dict: the active node classes are rendered as placeholders {placeholder: (url, active_class)}
+    active_nodes = None
+    # True if the active node has been checked by a template: the html depends on the current page
+    uses_active_node = False
+
+    def __init__(self, tree):
+        self.tree = tree
+        self._nodes = {}
+        self._children = {}
+        self._nodes_by_object = {}
+        self._accessible = {}
+
+        # The children of a node are defined by the parent: include the ones attached from another tree
+        if isinstance(tree, models.Model):
+            queryset = NavNode.objects.filter(Q(tree=tree) | Q(parent__tree=tree))
+        else:
+            queryset = NavNode.objects.filter(Q(tree__name=tree) | Q(parent__tree__name=tree))
+
+        for node in queryset.order_by('ordering', 'id'):
+            node._snapshot = self
+            self._nodes[node.id] = node
+            self._children.setdefault(node.parent_id, []).append(node)
+            if node.content_type_id:
+                key = (node.content_type_id, node.object_id)
+                self._nodes_by_object.setdefault(key, []).append(node)
+
+        # parents are set from memory: as_breadcrumb doesn't query the database
+        parent_field = NavNode._meta.get_field('parent')
+        for node in self._nodes.values():
+            if node.parent_id:
+                parent_field.set_cached_value(node, self._nodes.get(node.parent_id))
+
+        prefetch_content_objects(self.get_nodes())
+
+    def get_nodes(self):
+        """all the nodes of the tree"""
+        return list(self._nodes.values())
+
+    def get_node(self, node_id):
+        """returns the node with given id or None"""
+        return self._nodes.get(node_id)
+
+    def get_nodes_for_object(self, obj):
+        """the nodes pointing to the given object"""
+        content_type = ContentType.objects.get_for_model(obj.__class__)
+        return self._nodes_by_object.get((content_type.id, obj.id), [])
+
+    def get_children(self, parent=None, in_navigation=None, allow_all=False):
+        """children of a node (root nodes if parent is None) as a list ordered like in the tree"""
+        parent_id = getattr(parent, 'id', parent)
+        parent_id = int(parent_id) if parent_id else None
+        nodes = self._children.get(parent_id, [])
+        # Be careful : in_navigation can be False
+        if in_navigation is not None:
+            nodes = [node for node in nodes if node.in_navigation == in_navigation]
+        if not allow_all:
+            nodes = [node for node in nodes if node.is_accessible()]
+        return list(nodes)
+
+    def is_accessible(self, node):
+        """returns True if the node can be accessed: computed once for every node"""
+        if node.id not in self._accessible:
+            self._accessible[node.id] = node._check_accessibility()
+        return self._accessible[node.id]
 
 
 @python_2_unicode_compatible
@@ -491,13 +743,29 @@ class ArticleCategory(models.Model):
     
     def get_articles_qs(self):
         """articles of category as queryset"""
+        # An article is linked only once to a site: no need for distinct
         return get_article_class().objects.filter(
             sites__id=settings.SITE_ID, category=self, publication=BaseArticle.PUBLISHED
-        ).distinct().order_by('publication_date')
+        ).order_by('publication_date')
 
     def get_headlines(self):
         return self.get_articles_qs().filter(headline=True).order_by('-publication_date')
 
+    def _query_articles_positions(self):
+        """(publication_date, id) of the published articles in order"""
+        return list(self.get_articles_qs().order_by('publication_date', 'id').values_list('publication_date', 'id'))
+
+    def get_articles_positions(self):
+        """(publication_date, id) of the published articles in order: cached until an article is modified"""
+        if not is_cache_enabled():
+            return self._query_articles_positions()
+        cache_key = make_cache_key('category-positions', get_cache_version('articles'), settings.SITE_ID, self.id)
+        positions = cache.get(cache_key)
+        if positions is None:
+            positions = self._query_articles_positions()
+            cache.set(cache_key, positions)
+        return positions
+
     class Meta:
         verbose_name = _('article category')
         verbose_name_plural = _('article categories')
@@ -631,7 +899,7 @@ class BaseArticle(BaseNavigable):
     @property
     def is_homepage(self):
         """True if is the homepage of the current site"""
-        site_settings = SiteSettings.objects.get_or_create(site=Site.objects.get_current())[0]
+        site_settings = get_site_settings()
         try:
             if homepage_no_redirection():
                 return site_settings.homepage_article == self.slug
@@ -642,7 +910,7 @@ class BaseArticle(BaseNavigable):
 
     @is_homepage.setter
     def set_is_homepage(self):
-        site_settings = SiteSettings.objects.get_or_create(site=Site.objects.get_current())[0]
+        site_settings = get_site_settings()
         if homepage_no_redirection():
             site_settings.homepage_article = self.slug
         else:
@@ -661,30 +929,47 @@ class BaseArticle(BaseNavigable):
         """True if published"""
         return self.publication == BaseArticle.PUBLISHED
     
+    def _query_category_neighbour_ids(self):
+        """ids of the previous and next articles of the category"""
+        positions = self.category.get_articles_positions()
+        # the articles published at the same date than this one are skipped
+        previous_index = bisect_left(positions, (self.publication_date, )) - 1
+        next_index = bisect_right(positions, (self.publication_date, float('inf')))
+        previous_id = positions[previous_index][1] if previous_index >= 0 else None
+        next_id = positions[next_index][1] if next_index < len(positions) else None
+        return previous_id, next_id
+
+    def _get_category_neighbour_ids(self):
+        """ids of the previous and next articles of the category: cached until an article is modified"""
+        if not is_cache_enabled():
+            return self._query_category_neighbour_ids()
+        cache_key = make_cache_key('category-neighbours', get_cache_version('articles'), settings.SITE_ID, self.id)
+        neighbour_ids = cache.get(cache_key)
+        if neighbour_ids is None:
+            neighbour_ids = self._query_category_neighbour_ids()
+            cache.set(cache_key, neighbour_ids)
+        return neighbour_ids
+
+    def _get_category_neighbours(self):
+        """previous and next articles of the category"""
+        if not hasattr(self, '_cache_category_neighbours'):
+            neighbours = (None, None)
+            if self.category_id:
+                previous_id, next_id = self._get_category_neighbour_ids()
+                articles = get_article_class().objects.in_bulk(
+                    [article_id for article_id in (previous_id, next_id) if article_id]
+                )
+                neighbours = (articles.get(previous_id), articles.get(next_id))
+            self._cache_category_neighbours = neighbours
+        return self._cache_category_neighbours
+
     def next_in_category(self):
         """iterate by category"""
-        if self.category:
-            try:
-                return get_article_class().objects.filter(
-                    sites__id=settings.SITE_ID,
-                    category=self.category,
-                    publication=BaseArticle.PUBLISHED,
-                    publication_date__gt=self.publication_date
-                ).order_by('publication_date')[0]
-            except IndexError:
-                pass
-        
+        return self._get_category_neighbours()[1]
+
     def previous_in_category(self):
         """iterate by category"""
-        if self.category:
-            try:
-                return get_article_class().objects.filter(
-                    sites__id=settings.SITE_ID, category=self.category,
-                    publication=BaseArticle.PUBLISHED,
-                    publication_date__lt=self.publication_date
-                ).order_by('-publication_date')[0]
-            except IndexError:
-                pass
+        return self._get_category_neighbours()[0]
 
     def logo_thumbnail(self, temp=False, logo_size=None, logo_crop=None):
         """logo as thumbnail"""
@@ -743,35 +1028,58 @@ class BaseArticle(BaseNavigable):
     def __str__(self):
         return "{0} {1}".format(dehtml(self.title), dehtml(self.subtitle)).strip()
 
-    def save(self, *args, **kwargs):
-        """save"""
-        if hasattr(self, "_cache_slug"):
-            delattr(self, "_cache_slug")
-        
-        # autoslug localized title for creating locale_slugs
-        if (not self.title) and (not self.slug):
-            raise InvalidArticleError("coop_cms.Article: slug can not be empty")
-            
+    def _set_slugs(self):
+        """generate the missing slugs from titles: returns the name of the slug fields which have been set"""
+        slug_fields = []
         if is_localized():
             from modeltranslation.utils import build_localized_fieldname  # pylint: disable=F0401
             for lang_code in [lang[0] for lang in settings.LANGUAGES]:
 
                 loc_title_var = build_localized_fieldname('title', lang_code)
                 locale_title = getattr(self, loc_title_var, '')
-            
+
                 loc_slug_var = build_localized_fieldname('slug', lang_code)
                 locale_slug = getattr(self, loc_slug_var, '')
 
                 if locale_title and not locale_slug:
                     slug = self.get_unique_slug('slug', locale_title, lang_code)
                     setattr(self, loc_slug_var, slug)
+                    slug_fields.append(loc_slug_var)
         else:
             if not self.slug:
                 self.slug = self.get_unique_slug('slug', self.title)
+                slug_fields.append('slug')
+        return slug_fields
+
+    def save(self, *args, **kwargs):
+        """save"""
+        if hasattr(self, "_cache_slug"):
+            delattr(self, "_cache_slug")
+        if hasattr(self, "_cache_category_neighbours"):
+            delattr(self, "_cache_category_neighbours")
         
+        # autoslug localized title for creating locale_slugs
+        if (not self.title) and (not self.slug):
+            raise InvalidArticleError("coop_cms.Article: slug can not be empty")
+
+        generated_slug_fields = self._set_slugs()
+
         is_new = not bool(self.id)
-        ret = super(BaseArticle, self).save(*args, **kwargs)
-        
+        retries = 3
+        while True:
+            try:
+                with transaction.atomic():
+                    ret = super(BaseArticle, self).save(*args, **kwargs)
+                break
+            except IntegrityError:
+                # The generated slug may have been used by another article saved at the same time
+                retries -= 1
+                if not (generated_slug_fields and retries):
+                    raise
+                for slug_field in generated_slug_fields:
+                    setattr(self, slug_field, None)
+                generated_slug_fields = self._set_slugs()
+
         if is_new:
             site = Site.objects.get(id=settings.SITE_ID)
             self.sites.add(site)
@@ -779,10 +1087,17 @@ class BaseArticle(BaseNavigable):
 
         return ret
 
-    def _does_slug_exist(self, slug_field, slug):
-        """generate slug"""
+    def _get_used_slugs(self, slug_field, origin_slug):
+        """the slug and its variants with a numeric suffix used in any language: a single query"""
         article_class = get_article_class()
 
+        # The origin slug is truncated when needed for keeping room for a suffix of up to 10 digits
+        variants = [re.escape(origin_slug)] + [
+            '{0}[0-9]{{{1}}}'.format(re.escape(origin_slug[:(100 - suffix_len)]), suffix_len)
+            for suffix_len in range(1, 11)
+        ]
+        slug_regex = '^({0})$'.format('|'.join(variants))
+
         if is_localized():
             from modeltranslation.utils import build_localized_fieldname  # pylint: disable=F0401
             slug_fields = []
@@ -790,23 +1105,19 @@ class BaseArticle(BaseNavigable):
                 loc_slug_var = build_localized_fieldname(slug_field, lang_code)
                 slug_fields.append(loc_slug_var)
         else:
-            slug_fields = (slug_field,)
+            slug_fields = [slug_field]
 
-        for slug_field in slug_fields:
-            try:
-                lookup = {slug_field: slug}
-                if self.id:
-                    article_class.objects.get(Q(**lookup) & ~Q(id=self.id))
-                else:
-                    article_class.objects.get(**lookup)
-                # the slug exists in one language: we can not use it, try another one
-                return True
+        lookup = Q()
+        for field_name in slug_fields:
+            lookup |= Q(**{field_name + '__regex': slug_regex})
+        queryset = article_class.objects.filter(lookup)
+        if self.id:
+            queryset = queryset.exclude(id=self.id)
 
-            except article_class.DoesNotExist:
-                # Ok this slug is not used: try next language
-                pass
-
-        return False
+        used_slugs = set()
+        for slugs in queryset.values_list(*slug_fields):
+            used_slugs.update(slugs)
+        return used_slugs
 
     def get_unique_slug(self, slug_field, title, lang=None):
         """unique slug"""
@@ -814,20 +1125,16 @@ class BaseArticle(BaseNavigable):
         title = dehtml(title)
         slug = slugify(title, lang)
         next_suffix, origin_slug = 2, slug
-        slug_exists = True
 
-        while slug_exists:
-            # Check that this slug doesn't already exist
-            # The slug must be unique for all sites
+        # The slug must be unique for all sites and languages: get the existing ones with a numeric suffix
+        used_slugs = self._get_used_slugs(slug_field, origin_slug)
 
-            slug_exists = self._does_slug_exist(slug_field, slug)
-            
-            if slug_exists:
-                # oups the slug is already used: change it and try again
-                next_suffix_len = len(str(next_suffix))
-                safe_slug = origin_slug[:(100 - next_suffix_len)]
-                slug = "{0}{1}".format(safe_slug, next_suffix)
-                next_suffix += 1
+        while slug in used_slugs:
+            # oups the slug is already used: change it and try again
+            next_suffix_len = len(str(next_suffix))
+            safe_slug = origin_slug[:(100 - next_suffix_len)]
+            slug = "{0}{1}".format(safe_slug, next_suffix)
+            next_suffix += 1
 
         return slug
         
@@ -1184,6 +1491,76 @@ def remove_from_navigation(sender, instance, **kwargs):
 pre_delete.connect(remove_from_navigation)
 
 
+def on_navigation_changed(sender, instance, **kwargs):
+    """change the navigation version when a node, a tree or a navigable type is modified"""
+    if kwargs.get('raw'):
+        return
+    bump_cache_version('navigation')
+
+for navigation_model in (NavNode, NavType, COOP_CMS_NAVTREE_CLASS):
+    post_save.connect(on_navigation_changed, sender=navigation_model)
+    post_delete.connect(on_navigation_changed, sender=navigation_model)
+
+
+# ids of the content types of the navigable types: cached by process and cleared when the navigation version changes
+_navigable_content_types = {'version': None, 'ids': set()}
+
+
+def get_navigable_content_type_ids():
+    """returns the ids of the content types which can be in the navigation"""
+    version = get_cache_version('navigation')
+    if _navigable_content_types['version'] != version:
+        _navigable_content_types['version'] = version
+        _navigable_content_types['ids'] = set(NavType.objects.values_list('content_type_id', flat=True))
+    return _navigable_content_types['ids']
+
+
+def on_navigable_object_changed(sender, instance, **kwargs):
+    """change the navigation version when an object of the navigation or its sites are modified"""
+    if kwargs.get('raw') or not is_navigation_version_enabled():
+        return
+    action = kwargs.get('action')
+    if action:
+        if not action.startswith('post_'):
+            return
+        if isinstance(instance, Site):
+            # site.xxx_set.add(...)
+            model, object_ids = kwargs.get('model'), kwargs.get('pk_set')
+        elif kwargs.get('model') is Site:
+            model, object_ids = instance.__class__, [instance.pk]
+        else:
+            return
+    else:
+        model, object_ids = instance.__class__, [instance.pk]
+
+    try:
+        content_type = ContentType.objects.get_for_model(model)
+    except ContentType.DoesNotExist:
+        return
+    if content_type.id not in get_navigable_content_type_ids():
+        return
+    nodes = NavNode.objects.filter(content_type=content_type)
+    if object_ids is not None:
+        # the objects are unknown when the sites of a site are cleared
+        nodes = nodes.filter(object_id__in=object_ids)
+    if nodes.exists():
+        bump_cache_version('navigation')
+
+post_save.connect(on_navigable_object_changed)
+post_delete.connect(on_navigable_object_changed)
+m2m_changed.connect(on_navigable_object_changed)
+
+
+def on_article_changed(sender, instance, **kwargs):
+    """the cached slugs of articles are invalidated when an article or its sites are modified"""
+    if isinstance(instance, BaseArticle) or issubclass(kwargs.get('model') or object, BaseArticle):
+        bump_cache_version('articles')
+
+post_save.connect(on_article_changed)
+post_delete.connect(on_article_changed)
+m2m_changed.connect(on_article_changed)
+
+
 @python_2_unicode_compatible
 class NewsletterItem(models.Model):
     """Something which is in a newsletter"""
@@ -1444,6 +1821,44 @@ class Fragment(models.Model):
         return "{0} {1} {2}".format(self.type, self.position, self.name)
 
 
+# ids of the fragment types and filters by name and extra_id: cached by process and cleared when the
+# 'fragment-ids' version changes
+_fragment_ids = {'version': None, 'types': {}, 'filters': {}}
+
+
+def _get_fragment_ids(kind):
+    """the cached ids of the fragment types or filters: forgotten if one of them is modified by any process"""
+    version = get_cache_version('fragment-ids')
+    if _fragment_ids['version'] != version:
+        _fragment_ids.update(version=version, types={}, filters={})
+    return _fragment_ids[kind]
+
+
+def get_fragment_type_id(name):
+    """returns the id of the fragment type: created the first time if it doesn't exist"""
+    fragment_type_ids = _get_fragment_ids('types')
+    if name not in fragment_type_ids:
+        fragment_type_ids[name] = FragmentType.objects.get_or_create(name=name)[0].id
+    return fragment_type_ids[name]
+
+
+def get_fragment_filter_id(extra_id):
+    """returns the id of the fragment filter: created the first time if it doesn't exist"""
+    fragment_filter_ids = _get_fragment_ids('filters')
+    if extra_id not in fragment_filter_ids:
+        fragment_filter_ids[extra_id] = FragmentFilter.objects.get_or_create(extra_id=extra_id)[0].id
+    return fragment_filter_ids[extra_id]
+
+
+def on_fragment_ids_changed(sender, instance, **kwargs):
+    """the ids of the fragment types and filters must be get again"""
+    bump_cache_version('fragment-ids')
+
+for fragment_model in (FragmentType, FragmentFilter):
+    post_save.connect(on_fragment_ids_changed, sender=fragment_model)
+    post_delete.connect(on_fragment_ids_changed, sender=fragment_model)
+
+
 @python_2_unicode_compatible
 class SiteSettings(models.Model):
     """site settings"""
@@ -1476,27 +1891,76 @@ class SiteSettings(models.Model):
         ordering = ("site__id",)
 
 
+def _get_current_request():
+    """the request being processed or None"""
+    if is_requestprovider_installed():
+        try:
+            return RequestManager().get_request()
+        except RequestNotFound:
+            pass
+    return None
+
+
+def get_site_settings():
+    """
+    returns the settings of the current site: loaded once by request
+    If not defined, an unsaved SiteSettings is returned
+    """
+    site = Site.objects.get_current()
+    request = _get_current_request()
+    request_settings = getattr(request, '_coop_cms_site_settings', None) if request is not None else None
+    if request_settings is not None and site.id in request_settings:
+        return request_settings[site.id]
+
+    try:
+        site_settings = SiteSettings.objects.get(site=site)
+    except SiteSettings.DoesNotExist:
+        site_settings = SiteSettings(site=site)
+
+    if request is not None:
+        if request_settings is None:
+            request_settings = request._coop_cms_site_settings = {}
+        request_settings[site.id] = site_settings
+    return site_settings
+
+
+def on_site_settings_changed(sender, instance, **kwargs):
+    """forget the site settings loaded by the current request"""
+    request = _get_current_request()
+    if request is not None and hasattr(request, '_coop_cms_site_settings'):
+        del request._coop_cms_site_settings
+
+post_save.connect(on_site_settings_changed, sender=SiteSettings)
+post_delete.connect(on_site_settings_changed, sender=SiteSettings)
+
+
+def on_cache_dependency_changed(sender, instance, **kwargs):
+    """invalidate the cached pages which have been rendered with this object"""
+    if kwargs.get('raw'):
+        return
+    action = kwargs.get('action')
+    if action and not action.startswith('post_'):
+        return
+    if isinstance(instance, (BaseArticle, Fragment, PieceOfHtml, Newsletter)):
+        bump_cache_version(get_object_cache_tag(instance))
+        bump_cache_version(get_model_cache_tag(instance))
+
+post_save.connect(on_cache_dependency_changed)
+post_delete.connect(on_cache_dependency_changed)
+m2m_changed.connect(on_cache_dependency_changed)
+
+
 def get_homepage_url():
     """returns the URL of the home page"""
     if not cms_no_homepage():
-        site = Site.objects.get_current()
-        # Try site settings
-        try:
-            site_settings = SiteSettings.objects.get(site=site)
-            if site_settings.homepage_url:
-                return site_settings.homepage_url
-        except SiteSettings.DoesNotExist:
-            pass
+        site_settings = get_site_settings()
+        if site_settings.homepage_url:
+            return site_settings.homepage_url
 
 
 def get_homepage_article():
     """returns the URL of the home page"""
     if not cms_no_homepage():
-        site = Site.objects.get_current()
-        # Try site settings
-        try:
-            site_settings = SiteSettings.objects.get(site=site)
-            if site_settings.homepage_article:
-                return site_settings.homepage_article
-        except SiteSettings.DoesNotExist:
-            pass
+        site_settings = get_site_settings()
+        if site_settings.homepage_article:
+            return site_settings.homepage_article
@@ -361,6 +361,16 @@ def get_img_folder(instance, filename):
     return '{0}/{1}'.format(img_root, filename)
 
 
+def get_site_extra_urls():
+    """the urls of the site which can not be listed by coop_cms: rss feeds..."""
+    return getattr(django_settings, 'COOP_CMS_SITE_EXTRA_URLS', [])
+
+
+def is_articles_category_keyset_pagination():
+    """True if the pages of a category are given by the last article of the previous one: no OFFSET"""
+    return getattr(django_settings, 'COOP_CMS_ARTICLES_CATEGORY_KEYSET_PAGINATION', False)
+
+
 def get_articles_category_page_size(article_category):
     """returns number of articles for pagination"""
     if article_category.pagination_size:
@@ -426,6 +436,47 @@ def is_cache_enabled():
     return getattr(django_settings, 'COOP_CMS_CACHE', False)
 
 
+def get_cache_stale_timeout():
+    """seconds during which an expired page is still sent while it is rendered again by another request"""
+    return getattr(django_settings, 'COOP_CMS_CACHE_STALE_TIMEOUT', 30)
+
+
+def is_cache_gzip_enabled():
+    """True if the cached pages are also stored compressed"""
+    return getattr(django_settings, 'COOP_CMS_CACHE_GZIP', False)
+
+
+def is_conditional_get_enabled():
+    """True if the editable content is answered with 304 Not Modified when it didn't change"""
+    return getattr(django_settings, 'COOP_CMS_CONDITIONAL_GET', False)
+
+
+def is_navigation_cache_enabled():
+    """True if the html of the navigation templatetags is cached"""
+    return getattr(django_settings, 'COOP_CMS_NAVIGATION_CACHE', False)
+
+
+def is_article_link_autocreate_enabled():
+    """True if the article_link templatetag creates the article when it doesn't exist"""
+    return getattr(django_settings, 'COOP_CMS_ARTICLE_LINK_AUTOCREATE', True)
+
+
+def is_navigation_version_enabled():
+    """
+    True if a cache depends on the labels and urls of the navigation: the navigation version is changed when an
+    object of the navigation is modified. Otherwise, only the changes of the nodes and trees are tracked
+    """
+    return is_navigation_cache_enabled() or is_cache_enabled() or is_conditional_get_enabled()
+
+
+def get_navigation_suggestions_limit():
+    """
+    max number of objects suggested by the navigation tree autocomplete for each type
+    The objects of a type whose label doesn't use the search field are filtered by python: all of them may be read
+    """
+    return getattr(django_settings, 'COOP_CMS_NAVIGATION_SUGGESTIONS_LIMIT', 20)
+
+
 def change_site_id():
     """Change SITE ID"""
     if django_settings.DEBUG and not getattr(django_settings, 'DISABLE_CHANGE_SITE', False)\
@@ -9,12 +9,16 @@ try:
 except ImportError:
     from django.core.urlresolvers import reverse
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.http import Http404, HttpResponsePermanentRedirect, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
+from django.utils.translation import get_language
 
 from coop_cms.models import BaseArticle, Alias
-from coop_cms.settings import get_article_class, is_localized
-from coop_cms.utils import strip_locale_path
+from coop_cms.settings import get_article_class, is_cache_enabled, is_localized
+from coop_cms.utils import (
+    add_cache_dependency, get_cache_version, get_model_cache_tag, make_cache_key, strip_locale_path
+)
 
 
 def get_article_slug(*args, **kwargs):
@@ -24,8 +28,32 @@ def get_article_slug(*args, **kwargs):
     return slug.strip('/')
 
 
-def get_article(slug, current_lang=None, force_lang=None, all_langs=False, **kwargs):
-    """get article"""
+def _get_fallback_languages(current_lang=None, force_lang=None):
+    """the languages to look for the slug if not found in the current language"""
+    from modeltranslation import settings as mt_settings
+
+    fallback_languages = []
+    if current_lang:
+        fallback_languages += [current_lang, ]
+    if force_lang:
+        fallback_languages += [force_lang, ]
+
+    mt_fallbacks = getattr(settings, 'MODELTRANSLATION_FALLBACK_LANGUAGES', None)
+    if mt_fallbacks is None:
+        fallback_languages += [mt_settings.DEFAULT_LANGUAGE, ]
+    else:
+        if isinstance(mt_fallbacks, dict):
+            if current_lang in mt_fallbacks:
+                fallback_languages += list(mt_fallbacks[current_lang])
+            else:
+                fallback_languages += list(mt_fallbacks.get('default', []))
+        else:
+            fallback_languages += list(mt_fallbacks)
+    return fallback_languages
+
+
+def _find_article(slug, current_lang=None, force_lang=None, **kwargs):
+    """get article from database"""
 
     article_class = get_article_class()
     try:
@@ -36,28 +64,9 @@ def get_article(slug, current_lang=None, force_lang=None, all_langs=False, **kwa
         # try to look for slug in default language
         if is_localized():
 
-            from modeltranslation import settings as mt_settings
             from modeltranslation.utils import build_localized_fieldname
 
-            fallback_languages = []
-            if current_lang:
-                fallback_languages += [current_lang, ]
-            if force_lang:
-                fallback_languages += [force_lang, ]
-
-            mt_fallbacks = getattr(settings, 'MODELTRANSLATION_FALLBACK_LANGUAGES', None)
-            if mt_fallbacks is None:
-                fallback_languages += [mt_settings.DEFAULT_LANGUAGE, ]
-            else:
-                if isinstance(mt_fallbacks, dict):
-                    if current_lang in mt_fallbacks:
-                        fallback_languages += list(mt_fallbacks[current_lang])
-                    else:
-                        fallback_languages += list(mt_fallbacks.get('default', []))
-                else:
-                    fallback_languages += list(mt_fallbacks)
-
-            for lang in fallback_languages:
+            for lang in _get_fallback_languages(current_lang, force_lang):
                 field_name = build_localized_fieldname('slug', lang)
                 try:
                     lookup = kwargs.copy()
@@ -70,6 +79,33 @@ def get_article(slug, current_lang=None, force_lang=None, all_langs=False, **kwa
         raise article_class.DoesNotExist()
 
 
+def get_article(slug, current_lang=None, force_lang=None, all_langs=False, **kwargs):
+    """get article"""
+    if not is_cache_enabled():
+        return _find_article(slug, current_lang=current_lang, force_lang=force_lang, **kwargs)
+
+    # The id of the article is cached: the article is get by its primary key
+    # The key includes the current language : the fallbacks languages depend on it
+    article_class = get_article_class()
+    cache_key = make_cache_key(
+        'article-slug', get_cache_version('articles'), slug, get_language(), settings.SITE_ID,
+        current_lang, force_lang, sorted(kwargs.items())
+    )
+    article_id = cache.get(cache_key)
+    if article_id is None:
+        try:
+            article = _find_article(slug, current_lang=current_lang, force_lang=force_lang, **kwargs)
+        except article_class.DoesNotExist:
+            cache.set(cache_key, 0)
+            raise
+        cache.set(cache_key, article.id)
+        return article
+
+    if not article_id:
+        raise article_class.DoesNotExist()
+    return article_class.objects.get(id=article_id)
+
+
 def get_article_or_404(slug, **kwargs):
     """get article or 404"""
     article_class = get_article_class()
@@ -83,6 +119,7 @@ def get_headlines(article=None, editable=False):
     """get articles to display on homepage"""
     article_class = get_article_class()
     if (article and article.is_homepage) or (article is None):
+        add_cache_dependency(get_model_cache_tag(article_class))
         queryset = article_class.objects.filter(headline=True)
         if editable:
             queryset = queryset.filter(publication__in=(BaseArticle.PUBLISHED, BaseArticle.DRAFT))
@@ -99,7 +136,7 @@ def redirect_if_alias(path):
 
     # look for an article corresponding to this path. For example if trailing slash is missing in the url
     try:
-        article = article_class.objects.get(slug=path, sites=site, publication=BaseArticle.PUBLISHED)
+        article = get_article(path, sites=site.id, publication=BaseArticle.PUBLISHED)
     except article_class.DoesNotExist:
         article = None
 
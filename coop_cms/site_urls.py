@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""the public pages of the site: used for freezing it or warming the cache"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.utils import translation
+
+from coop_cms.models import ArticleCategory, BaseArticle
+from coop_cms.moves import reverse, NoReverseMatch
+from coop_cms.settings import (
+    cms_no_homepage, get_article_class, get_site_extra_urls, has_localized_urls
+)
+
+
+def get_site_languages():
+    """the languages of the pages: only the default one if the language is not in the urls"""
+    if has_localized_urls():
+        return [code for (code, name) in settings.LANGUAGES]
+    return [settings.LANGUAGE_CODE]
+
+
+def _reverse_or_none(view_name, **kwargs):
+    """the url or None if the view is not installed"""
+    try:
+        return reverse(view_name, **kwargs)
+    except NoReverseMatch:
+        return None
+
+
+def get_site_urls(languages=None):
+    """
+    returns the list of (language, url) of the homepage, the published articles, the categories and the sitemap
+    of the current site. The COOP_CMS_SITE_EXTRA_URLS (rss feeds...) are added for the default language
+    """
+    articles = get_article_class().objects.filter(
+        sites__id=settings.SITE_ID, publication=BaseArticle.PUBLISHED, login_required=False
+    ).order_by('id')
+    categories = ArticleCategory.objects.filter(
+        sites__id=settings.SITE_ID, id__in=articles.values('category')
+    ).order_by('id')
+
+    urls = []
+    for language in languages or get_site_languages():
+        with translation.override(language):
+            language_urls = [
+                _reverse_or_none('coop_cms_homepage') if not cms_no_homepage() else None,
+                _reverse_or_none('coop_cms_sitemap'),
+            ]
+            language_urls.extend([article.get_absolute_url() for article in articles])
+            language_urls.extend([category.get_absolute_url() for category in categories])
+        urls.extend([(language, url) for url in language_urls if url])
+
+    urls.extend([(settings.LANGUAGE_CODE, url) for url in get_site_extra_urls()])
+    return urls
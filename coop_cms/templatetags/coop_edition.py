@@ -6,28 +6,47 @@ used for magic form
 
 from __future__ import unicode_literals
 
+from copy import copy
+
 from six import string_types
 
 from django import template
+from django.core.cache import cache
+from django.db.models import Q
 from django.forms.formsets import BaseFormSet
 from django.template import Context
 from django.template.base import TextNode, VariableNode, FilterExpression
 from django.template.context_processors import csrf
 from django.template.loader import get_template, TemplateDoesNotExist
 from django.template.loader_tags import IncludeNode
-from django.utils.translation import ugettext_lazy as _
+from django.utils.translation import get_language, ugettext_lazy as _
 from django.utils.safestring import mark_safe
 
 from coop_html_editor.templatetags.html_editor_utils import InlineHtmlEditNode, InlineHtmlMultipleEditNode
 
-from coop_cms.models import PieceOfHtml, BaseArticle, Fragment, FragmentType, FragmentFilter
+from coop_cms.models import (
+    PieceOfHtml, BaseArticle, Fragment, get_fragment_filter_id, get_fragment_type_id
+)
 from coop_cms.moves import make_context
-from coop_cms.settings import get_article_class
-from coop_cms.utils import get_text_from_template, slugify
+from coop_cms.settings import get_article_class, is_cache_enabled
+from coop_cms.utils import (
+    add_cache_dependency, get_cache_version, get_model_cache_tag, get_object_cache_tag, get_text_from_template,
+    make_cache_key, slugify
+)
 
 register = template.Library()
 
 
+_compiled_templates = {}
+
+
+def _get_template_from_string(source):
+    """the template is compiled once by process"""
+    if source not in _compiled_templates:
+        _compiled_templates[source] = template.Template(source)
+    return _compiled_templates[source]
+
+
 class DummyEngine(object):
     """Used for monkey patching Context"""
     debug = False
@@ -39,15 +58,94 @@ class DummyEditableForm(object):
     is_inline_editable = True
 
 
+def _get_literal(value):
+    """returns the value of a string or number template tag argument or None if it is a variable"""
+    try:
+        literal = template.Variable(value).literal
+    except template.TemplateSyntaxError:
+        return None
+    return None if literal is None else '{0}'.format(literal)
+
+
+class PiecesOfHtmlBatch(object):
+    """the pieces of html of a compiled template: loaded with a single query when it is rendered"""
+
+    def __init__(self):
+        self.lookups = set()
+
+    def _get_cache_key(self):
+        """the pieces are cached by language until one of them is modified"""
+        return make_cache_key(
+            'pieces-of-html', get_cache_version(get_model_cache_tag(PieceOfHtml)), get_language(),
+            sorted(self.lookups)
+        )
+
+    def _query_pieces(self):
+        """returns a dict (div_id, extra_id): content of the piece of html"""
+        pieces = {}
+        div_ids = set([div_id for (div_id, extra_id) in self.lookups])
+        queryset = PieceOfHtml.objects.filter(div_id__in=div_ids).order_by('id')
+        for (div_id, extra_id, content) in queryset.values_list('div_id', 'extra_id', 'content'):
+            lookup = (div_id, extra_id)
+            if lookup in self.lookups and lookup not in pieces:
+                pieces[lookup] = content
+        return pieces
+
+    def _load_pieces(self):
+        """returns a dict (div_id, extra_id): content of the piece of html. Cached if the cache is enabled"""
+        if not is_cache_enabled():
+            return self._query_pieces()
+        cache_key = self._get_cache_key()
+        pieces = cache.get(cache_key)
+        if pieces is None:
+            pieces = self._query_pieces()
+            cache.set(cache_key, pieces)
+        return pieces
+
+    def get_pieces(self, context):
+        """the pieces are loaded once by rendering of the template"""
+        pieces = context.render_context.get(self)
+        if pieces is None:
+            pieces = context.render_context[self] = self._load_pieces()
+        return pieces
+
+
 class PieceOfHtmlEditNode(InlineHtmlEditNode):
     """Template node for editing a PieceOfHtml"""
 
+    def __init__(self, *args, **kwargs):
+        super(PieceOfHtmlEditNode, self).__init__(*args, **kwargs)
+        self._batch = None
+        self._batch_lookup = None
+
+    def set_batch(self, batch):
+        """the piece of html is loaded with the others of the template if its identifiers are not variables"""
+        div_id = _get_literal(self._lookup_args['div_id'])
+        extra_id = _get_literal(self._lookup_args['extra_id']) if 'extra_id' in self._lookup_args else ''
+        if div_id is not None and extra_id is not None:
+            self._batch = batch
+            self._batch_lookup = (div_id, extra_id)
+            batch.lookups.add(self._batch_lookup)
+
+    def _render_piece(self, context):
+        """to html"""
+        pieces = self._batch.get_pieces(context) if self._batch else {}
+        if self._batch_lookup not in pieces:
+            # get or create it
+            html = super(PieceOfHtmlEditNode, self).render(context)
+            add_cache_dependency(get_object_cache_tag(self._object))
+            return html
+        self._resolve_lookup(self._lookup, context)
+        # the pieces of the batch are loaded together: they depend on any piece of html
+        add_cache_dependency(get_model_cache_tag(PieceOfHtml))
+        return self._render_value(context, self._lookup, pieces[self._batch_lookup])
+
     def render(self, context):
         """convert to html"""
         form = context.get('form', None) or context.get('formset', None)
         if form:
             context.dicts[0]['inline_html_edit'] = _is_inline_editable(form)
-        return super(PieceOfHtmlEditNode, self).render(context)
+        return self._render_piece(context)
 
 
 @register.tag
@@ -67,8 +165,47 @@ def coop_piece_of_html(parser, token):
     lookup_args = {'div_id': div_id}
     if extra_id:
         lookup_args.update({'extra_id': extra_id})
-    
-    return PieceOfHtmlEditNode(PieceOfHtml, lookup_args, 'content', read_only)
+
+    node = PieceOfHtmlEditNode(PieceOfHtml, lookup_args, 'content', read_only)
+    # all the pieces of html of the template are shared by its nodes
+    if not hasattr(parser, 'coop_pieces_of_html'):
+        parser.coop_pieces_of_html = PiecesOfHtmlBatch()
+    node.set_batch(parser.coop_pieces_of_html)
+    return node
+
+
+class FragmentsBatch(object):
+    """the fragments of a compiled template: loaded with a single query when it is rendered"""
+
+    def __init__(self):
+        self.lookups = set()
+
+    def _load_fragments(self):
+        """returns a dict (name, extra_id): list of fragments"""
+        ids = {}
+        for name, extra_id in self.lookups:
+            filter_id = get_fragment_filter_id(extra_id) if extra_id is not None else None
+            ids[(name, extra_id)] = (get_fragment_type_id(name), filter_id)
+        query = Q()
+        for type_id, filter_id in ids.values():
+            if filter_id is None:
+                query |= Q(type_id=type_id)
+            else:
+                query |= Q(type_id=type_id, filter_id=filter_id)
+
+        fragments = dict((lookup, []) for lookup in self.lookups)
+        for fragment in Fragment.objects.filter(query):
+            for lookup, (type_id, filter_id) in ids.items():
+                if fragment.type_id == type_id and (filter_id is None or fragment.filter_id == filter_id):
+                    fragments[lookup].append(fragment)
+        return fragments
+
+    def get_fragments(self, context, lookup):
+        """the fragments are loaded once by rendering of the template"""
+        fragments = context.render_context.get(self)
+        if fragments is None:
+            fragments = context.render_context[self] = self._load_fragments()
+        return fragments[lookup]
 
 
 class FragmentEditNode(InlineHtmlMultipleEditNode):
@@ -77,17 +214,30 @@ class FragmentEditNode(InlineHtmlMultipleEditNode):
     def __init__(self, lookup, kwargs=None):
         super(FragmentEditNode, self).__init__(Fragment, lookup, 'content')
         self._edit_mode = False
-        self.fragment_filter = None
+        self.fragment_filter_id = None
         self.kwargs = kwargs or {}
-        self.fragment_type = None
+        self.fragment_type_id = None
+        self._batch = None
+        self._batch_lookup = None
+
+    def set_batch(self, batch):
+        """the fragments are loaded with the others of the template if the lookup is not a variable"""
+        name = _get_literal(self._lookup_args['name'])
+        extra_id = None
+        if 'extra_id' in self._lookup_args:
+            extra_id = _get_literal(self._lookup_args['extra_id'])
+            if extra_id is None:
+                return
+        if name is not None:
+            self._batch = batch
+            self._batch_lookup = (name, extra_id)
+            batch.lookups.add(self._batch_lookup)
 
     def _get_objects(self, lookup):
         """get the fragment"""
-        self.fragment_type = FragmentType.objects.get_or_create(name=lookup['name'])[0]
-        queryset = Fragment.objects.filter(type=self.fragment_type)
-        if 'extra_id' in lookup:
-            self.fragment_filter = FragmentFilter.objects.get_or_create(extra_id=lookup['extra_id'])[0]
-            queryset = queryset.filter(filter=self.fragment_filter)
+        queryset = Fragment.objects.filter(type_id=self.fragment_type_id)
+        if self.fragment_filter_id is not None:
+            queryset = queryset.filter(filter_id=self.fragment_filter_id)
         return queryset
     
     def _get_object_lookup(self, obj):
@@ -130,21 +280,56 @@ class FragmentEditNode(InlineHtmlMultipleEditNode):
             object_content += self._render_value(context, self._get_object_lookup(obj), value)
             object_content += self._post_object_render(obj)
         return object_content
-    
+
+    def _get_cache_key(self, context):
+        """the html is cached by type, filter and language until a fragment is modified"""
+        template_name = self.kwargs.get('template_name', '')
+        return make_cache_key(
+            'fragments', get_cache_version(get_model_cache_tag(Fragment)), self.fragment_type_id,
+            self.fragment_filter_id, get_language(), self._resolve_arg(template_name, context) if template_name else ''
+        )
+
+    def _render_fragments(self, context):
+        """convert all to html"""
+        if self._batch:
+            self._objects_to_render = self._batch.get_fragments(context, self._batch_lookup)
+        else:
+            self._objects_to_render = list(self._get_objects(self._lookup))
+        return ''.join([
+            self._object_render(idx, obj, context) for (idx, obj) in enumerate(self._objects_to_render)
+        ])
+
     def render(self, context):
         """convert to html"""
         self._edit_mode = False
+        # a new fragment may be added to the list
+        add_cache_dependency(get_model_cache_tag(Fragment))
         form = context.get('form', None) or context.get('formset', None)
         if getattr(form, 'is_inline_editable', False):
             context.dicts[0]['inline_html_edit'] = True
             self._edit_mode = True
-        html = super(FragmentEditNode, self).render(context)
-        filter_id = self.fragment_filter.id if self.fragment_filter else ""
+
+        self._resolve_lookup(self._lookup, context)
+        self.fragment_type_id = get_fragment_type_id(self._lookup['name'])
+        if 'extra_id' in self._lookup:
+            self.fragment_filter_id = get_fragment_filter_id(self._lookup['extra_id'])
+        else:
+            self.fragment_filter_id = None
+
+        if is_cache_enabled() and not context.get('inline_html_edit'):
+            cache_key = self._get_cache_key(context)
+            html = cache.get(cache_key)
+            if html is None:
+                html = self._render_fragments(context)
+                cache.set(cache_key, html)
+        else:
+            html = self._render_fragments(context)
+
         if self._edit_mode:
             html_layout = '<div style="display: none; visibility: hidden;" class="coop-fragment-type" '
             html_layout += 'rel="{0}" data-filter="{2}">{1}</div>'
             pre_html = html_layout.format(
-                self.fragment_type.id, self.fragment_type.name, filter_id
+                self.fragment_type_id, self._lookup['name'], self.fragment_filter_id or ""
             )
         else:
             pre_html = ''
@@ -173,7 +358,12 @@ def coop_fragments(parser, token):
                 extra_id_found = True
             else:
                 kwargs[key] = value
-    return FragmentEditNode(lookup, kwargs)
+    node = FragmentEditNode(lookup, kwargs)
+    # all the fragments of the template are shared by its nodes
+    if not hasattr(parser, 'coop_fragments'):
+        parser.coop_fragments = FragmentsBatch()
+    node.set_batch(parser.coop_fragments)
+    return node
 
 
 class ArticleSummaryEditNode(InlineHtmlEditNode):
@@ -224,11 +414,10 @@ class CmsFormMediaNode(template.Node):
         formset = context.get('formset', None)
 
         if form or formset:
-            template_ = template.Template("{{form.media}}")
-            html = template_.render(template.Context({'form': form or formset}))
+            html = '{0}'.format(getattr(form or formset, 'media', ''))
             # django 1.5 fix : " are escaped as &quot; and cause script tag
             # for aloha to be broken
-            return html.replace("&quot;", '"') 
+            return html.replace("&quot;", '"')
         else:
             return ""
 
@@ -268,6 +457,7 @@ def _is_inline_editable(form):
 
 class IfCmsEditionNode(template.Node):
     """Do something if edition mode"""
+    child_nodelists = ('nodelist_true', 'nodelist_false')
 
     def __init__(self, nodelist_true, nodelist_false):
         self.nodelist_true = nodelist_true
@@ -320,6 +510,11 @@ CMS_FORM_TEMPLATE = """
     {{inner}} <input type="submit" style="display: none"> </form>
 """
 
+FORM_FIELD_TEMPLATE = """
+                    {% with field.errors as errs %}
+                    {% include "coop_cms/_form_error.html" %}{% endwith %}{{field}}
+                """
+
 
 class SafeWrapper(object):
     """This manages display of object in edit or non-edit context"""
@@ -372,18 +567,32 @@ class FormWrapper(object):
 
     def __getitem__(self, field, logo_size=None):
         """get attribute"""
-        if field in self._form.fields.keys():
-            template_ = template.Template("""
-                    {%% with form.%s.errors as errs %%}
-                    {%% include "coop_cms/_form_error.html" %%}{%% endwith %%}{{form.%s}}
-                """ % (field, field))
-            return template_.render(template.Context({'form': self._form}))
+        if field in self._form.fields:
+            template_ = _get_template_from_string(FORM_FIELD_TEMPLATE)
+            return template_.render(template.Context({'field': self._form[field]}))
         else:
             return getattr(self._obj, field)
 
 
 class CmsEditNode(template.Node):
     """cms_edit -> manages edition of object"""
+    child_nodelists = ('nodelist_content', )
+
+    # how the nested nodes are rendered
+    RENDER_SAFE = 'safe'
+    RENDER_ASSIGNMENT = 'assignment'
+    RENDER_INCLUDE = 'include'
+    RENDER_BLOCK = 'block'
+    RENDER_FILTERS = 'filters'
+    RENDER_INNER = 'inner'
+
+    MANAGED_NODE_TYPES = (
+        TextNode,
+        template.defaulttags.IfNode,
+        IfCmsEditionNode,
+        IfNotCmsEditionNode,
+        template.defaulttags.ForNode,
+    )
 
     def __init__(self, nodelist_content, var_name, logo_size=None, logo_crop=None):
         self.var_name = var_name
@@ -393,47 +602,49 @@ class CmsEditNode(template.Node):
         self._render_logo_size = self._logo_size and (self._logo_size == logo_size)
         self._render_logo_crop = self._logo_crop and (self._logo_crop == logo_crop)
         self.post_url = ""
+        # the dispatch is done once when the template is parsed
+        self._render_modes = [(node, self._get_render_mode(node)) for node in nodelist_content]
 
     def __iter__(self):
         for node in self.nodelist_content:
             yield node
 
+    def _get_render_mode(self, node):
+        """returns how a nested node is rendered and the name of the variable it defines"""
+        if isinstance(node, self.MANAGED_NODE_TYPES):
+            return self.RENDER_SAFE, None
+        elif node.__class__.__name__ == 'MediaListNode':
+            return self.RENDER_ASSIGNMENT, node.var_name
+        elif node.__class__.__name__ == 'AssignmentNode':
+            return self.RENDER_ASSIGNMENT, node.target_var
+        elif isinstance(node, IncludeNode):
+            return self.RENDER_INCLUDE, None
+        elif isinstance(node, template.loader_tags.BlockNode):
+            return self.RENDER_BLOCK, None
+        elif isinstance(node, VariableNode):
+            if node.filter_expression.filters:
+                return self.RENDER_FILTERS, None
+            return self.RENDER_SAFE, None
+        return self.RENDER_INNER, None
+
     def _render_nodes(self, context, inner_context, safe_context):
         """Replace nested nodes with proper content"""
-        managed_node_types = [
-            TextNode,
-            template.defaulttags.IfNode,
-            IfCmsEditionNode,
-            IfNotCmsEditionNode,
-            template.defaulttags.ForNode,
-        ]
-
-        nodes_content = ""
-        for node in self.nodelist_content:
-
-            if any([isinstance(node, node_type) for node_type in managed_node_types]):
-                local_context = Context(safe_context)
-                if hasattr(context, 'template'):
-                    local_context.template = context.template
-                content = node.render(local_context)
+        nodes_content = []
+        for node, (render_mode, var_name) in self._render_modes:
 
-            elif node.__class__.__name__ == 'MediaListNode':
-                content = node.render(context)
-                safe_context[node.var_name] = context.get(node.var_name)
-                inner_context[node.var_name] = context.get(node.var_name)
+            if render_mode == self.RENDER_SAFE:
+                content = node.render(safe_context)
 
-            elif node.__class__.__name__ == 'AssignmentNode':
+            elif render_mode == self.RENDER_ASSIGNMENT:
                 content = node.render(context)
-                safe_context[node.target_var] = context.get(node.target_var)
-                inner_context[node.target_var] = context.get(node.target_var)
+                inner_context[var_name] = safe_context[var_name] = context.get(var_name)
 
-            elif isinstance(node, IncludeNode):
+            elif render_mode == self.RENDER_INCLUDE:
                 # monkey patching for django 1.8
-
                 if isinstance(node.template, FilterExpression):
                     template_name = node.template.resolve(context)
                     node.template = get_template(template_name)
-                context_dict = inner_context.copy()
+                context_dict = inner_context.flatten()
                 if node.extra_context:
                     for filter_expression in node.extra_context:
                         value = node.extra_context[filter_expression].resolve(context)
@@ -442,54 +653,38 @@ class CmsEditNode(template.Node):
                 the_context = make_context(None, context_dict)
                 content = node.template.render(the_context)
 
-            elif isinstance(node, template.loader_tags.BlockNode):
-                safe_context_var = Context(safe_context)
-                safe_context_var.render_context['block_context'] = context.render_context.get('block_context', None)
-                safe_context_var.template = getattr(node, 'template', None) or template.Template("")
-                #safe_context_var.template.engine = DummyEngine()
-                content = node.render(safe_context_var)
-
-            elif isinstance(node, VariableNode):
-                if node.filter_expression.filters:
-                    content = node.render(Context(context))
-                else:
-                    the_context = Context(safe_context)
-                    the_context.template = getattr(node, 'template', None) or template.Template("")
-                    #the_context.template.engine = DummyEngine()
-                    content = node.render(the_context)
+            elif render_mode == self.RENDER_BLOCK:
+                # the block_context is in the render_context shared with the page
+                content = node.render(safe_context)
+
+            elif render_mode == self.RENDER_FILTERS:
+                content = node.render(context)
+
             else:
-                # monkey patching for django 1.8+
-                the_context = Context(inner_context)
-                the_context.template = getattr(node, 'template', None) or template.Template("")
-                #the_context.template.engine = DummyEngine()
-                content = node.render(the_context)
+                # the variables defined by the node are not kept
+                with inner_context.push():
+                    content = node.render(inner_context)
 
-            nodes_content += content
-        return nodes_content
+            nodes_content.append(content)
+        return ''.join(nodes_content)
 
     def _get_obj(self, context):
         """return the edited object if exists"""
         return context.get(self.var_name, None) if self.var_name else None
 
+    def _push_context(self, context, **values):
+        """returns a context made of the layers of context and a new one: the values are not copied"""
+        new_context = copy(context)
+        if new_context.template is None:
+            # monkey patching for django 1.8+
+            new_context.template = _get_template_from_string("")
+        new_context.push(**values)
+        return new_context
+
     def _make_inner_context(self, context):
         """the context used for rendering the templatetag content"""
-        inner_context = {}
-        for ctx_value in context.dicts:
-            inner_context.update(ctx_value)
-
-        obj = self._get_obj(context)
-        if self.var_name:
-            inner_context[self.var_name] = obj
-
-        formset = context.get('formset', None)
-        objects = context.get('objects', None)
-
-        if formset:
-            inner_context['formset'] = formset
-        if objects is not None:
-            inner_context['objects'] = objects
-
-        return inner_context
+        values = {self.var_name: self._get_obj(context)} if self.var_name else {}
+        return self._push_context(context, **values)
 
     def _make_outer_context(self, context):
         """the context used for rendering the whole page"""
@@ -514,8 +709,8 @@ class CmsEditNode(template.Node):
         # the context used for rendering the whole page
         outer_context = self._make_outer_context(context)
 
-        # copy of the inner_context to be modified
-        safe_context = inner_context.copy()
+        # the inner_context with a layer to be modified
+        safe_context = self._push_context(inner_context)
 
         form = context.get('form', None)
         obj = self._get_obj(context)
@@ -531,7 +726,7 @@ class CmsEditNode(template.Node):
             is_inline_editable = _is_inline_editable(formset)
 
         if is_inline_editable:
-            node_template = template.Template(CMS_FORM_TEMPLATE)
+            node_template = _get_template_from_string(CMS_FORM_TEMPLATE)
             if form:
                 safe_context[self.var_name] = FormWrapper(
                     form, obj, logo_size=self._logo_size, logo_crop=self._logo_crop
@@ -543,7 +738,7 @@ class CmsEditNode(template.Node):
                 ]
             outer_context.update(csrf(request))
         else:
-            node_template = template.Template("{{inner|safe}}")
+            node_template = None
             if obj:
                 safe_context[self.var_name] = SafeWrapper(
                     obj, logo_size=self._logo_size, logo_crop=self._logo_crop)
@@ -554,8 +749,11 @@ class CmsEditNode(template.Node):
 
         inner_value = self._render_nodes(context, inner_context, safe_context)
 
-        outer_context['inner'] = mark_safe(inner_value) if (form or formset) else inner_value
+        if node_template is None:
+            # same as rendering {{inner|safe}}
+            return mark_safe(inner_value)
 
+        outer_context['inner'] = mark_safe(inner_value) if (form or formset) else inner_value
         return node_template.render(Context(outer_context))
 
 
@@ -4,13 +4,20 @@
 from __future__ import unicode_literals
 
 from django import template
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.template import VariableDoesNotExist
 from django.template.loader import get_template
-from django.utils.translation import ugettext as _
+from django.utils.translation import get_language, ugettext as _
 
-from coop_cms.models import NavNode
-from coop_cms.settings import get_navtree_class
+from six import integer_types, string_types
+
+from coop_cms.models import get_navtree_id, NavNode, NavTreeSnapshot
+from coop_cms.settings import get_navtree_class, is_navigation_cache_enabled, is_requestprovider_installed
+from coop_cms.utils import (
+    add_cache_dependency, get_cache_version, get_visitor_class, make_cache_key, RequestManager, RequestNotFound
+)
 
 register = template.Library()
 
@@ -27,8 +34,20 @@ def extract_kwargs(args):
     return kwargs
 
 
+def get_current_request():
+    """the request being processed or None"""
+    if is_requestprovider_installed():
+        try:
+            return RequestManager().get_request()
+        except RequestNotFound:
+            pass
+    return None
+
+
 class NavigationTemplateNode(template.Node):
     """Navigation templatetag"""
+    object_var = None
+
     def __init__(self, *args, **kwargs):
         super(NavigationTemplateNode, self).__init__()
         self._kwargs = {}
@@ -47,14 +66,83 @@ class NavigationTemplateNode(template.Node):
         if not 'tree' in kwargs:
             kwargs['tree'] = 'default'
 
-        tree = get_navtree_class().objects.get_or_create(name=kwargs['tree'])[0]
-        if 'coop_cms_navtrees' in context.dicts[0]:
-            context.dicts[0]['coop_cms_navtrees'].append(tree)
+        # The trees are never created when rendering: a missing tree is rendered as an empty navigation
+        # They are created in admin or by the create_navtrees command
+        tree_name = '{0}'.format(kwargs['tree'])
+        tree_id = get_navtree_id(tree_name)
+        if tree_id is None:
+            kwargs['tree'] = None
         else:
-            context.dicts[0]['coop_cms_navtrees'] = [tree]
+            tree = kwargs['tree'] = get_navtree_class()(id=tree_id, name=tree_name)
+            if 'coop_cms_navtrees' in context.dicts[0]:
+                context.dicts[0]['coop_cms_navtrees'].append(tree)
+            else:
+                context.dicts[0]['coop_cms_navtrees'] = [tree]
 
         return kwargs
 
+    def get_snapshot(self, tree):
+        """all the nodes of the tree: loaded once for rendering the tag"""
+        return NavTreeSnapshot(tree)
+
+    def render(self, context):
+        """to html"""
+        add_cache_dependency('navigation')
+        obj = self.object_var.resolve(context) if self.object_var is not None else None
+        kwargs = self.resolve_kwargs(context)
+        tree = kwargs.pop('tree')
+        if tree is None:
+            return ''
+        if is_navigation_cache_enabled() and self._is_cacheable(kwargs):
+            return self._render_cached(tree, obj, kwargs)
+        return self.render_navigation(self.get_snapshot(tree), obj, kwargs)
+
+    def render_navigation(self, snapshot, obj, kwargs):
+        """to html: must be implemented by every navigation tag"""
+        raise NotImplementedError
+
+    def _is_cacheable(self, kwargs):
+        """the cache key can only be built from simple values"""
+        return all(
+            isinstance(value, string_types + integer_types) for value in kwargs.values()
+        )
+
+    def _get_cache_key(self, request, tree, obj, kwargs):
+        """the html depends on the tree, tag args, object, language, site and kind of visitor"""
+        key_args = [
+            get_cache_version('navigation'), self.__class__.__name__, tree.id, sorted(kwargs.items()),
+        ]
+        if obj is not None:
+            key_args += [ContentType.objects.get_for_model(obj.__class__).id, obj.pk]
+        key_args += [get_language(), settings.SITE_ID, get_visitor_class(request)]
+        return make_cache_key('navigation', *key_args)
+
+    def _render_cached(self, tree, obj, kwargs):
+        """get the html from the cache or render and store it"""
+        request = get_current_request()
+        path = request.path if request is not None else ''
+        cache_key = self._get_cache_key(request, tree, obj, kwargs)
+        value = cache.get(cache_key)
+        if value is not None and value.get('by_path'):
+            value = cache.get(make_cache_key('navigation', cache_key, path))
+
+        if value is None:
+            snapshot = self.get_snapshot(tree)
+            snapshot.active_nodes = {}
+            html = self.render_navigation(snapshot, obj, kwargs)
+            value = {'html': html, 'active_nodes': snapshot.active_nodes}
+            if snapshot.uses_active_node:
+                # A template checks the active node : the html can only be cached for the current page
+                cache.set(cache_key, {'by_path': True})
+                cache.set(make_cache_key('navigation', cache_key, path), value)
+            else:
+                cache.set(cache_key, value)
+
+        html = value['html']
+        for (placeholder, (url, active_class)) in value['active_nodes'].items():
+            html = html.replace(placeholder, active_class if url and url == path else '')
+        return html
+
 
 class NavigationAsNestedUlNode(NavigationTemplateNode):
     """Navigation as nested ul"""
@@ -62,18 +150,11 @@ class NavigationAsNestedUlNode(NavigationTemplateNode):
     def __init__(self, **kwargs):
         super(NavigationAsNestedUlNode, self).__init__(**kwargs)
 
-    def render(self, context):
+    def render_navigation(self, snapshot, obj, kwargs):
         """to html"""
-        kwargs = self.resolve_kwargs(context)
-        tree_name = kwargs.pop('tree', 'default')
-        root_nodes = NavNode.objects.filter(tree__name=tree_name)
         parent = kwargs.pop('parent', None)
-        if parent:
-            root_nodes = root_nodes.filter(parent=parent)
-        else:
-            root_nodes = root_nodes.filter(parent__isnull=True)
-        root_nodes = root_nodes.order_by("ordering")
-        total_nodes = root_nodes.count()    
+        root_nodes = snapshot.get_children(parent, allow_all=True)
+        total_nodes = len(root_nodes)
         return ''.join([
             node.as_navigation(node_pos=i + 1, total_nodes=total_nodes, **kwargs)
             for (i, node) in enumerate(root_nodes)
@@ -94,14 +175,10 @@ class NavigationBreadcrumbNode(NavigationTemplateNode):
         super(NavigationBreadcrumbNode, self).__init__(**kwargs)
         self.object_var = template.Variable(obj)
 
-    def render(self, context):
+    def render_navigation(self, snapshot, obj, kwargs):
         """to html"""
-        obj = self.object_var.resolve(context)
-        content_type = ContentType.objects.get_for_model(obj.__class__)
-        kwargs = self.resolve_kwargs(context)
-        tree_name = kwargs.pop('tree', 'default')
-        nav_nodes = NavNode.objects.filter(tree__name=tree_name, content_type=content_type, object_id=obj.id)
-        if nav_nodes.count() > 0:
+        nav_nodes = snapshot.get_nodes_for_object(obj)
+        if nav_nodes:
             return nav_nodes[0].as_breadcrumb(**kwargs)
         return ''
 
@@ -123,14 +200,10 @@ class NavigationChildrenNode(NavigationTemplateNode):
         super(NavigationChildrenNode, self).__init__(**kwargs)
         self.object_var = template.Variable(obj)
 
-    def render(self, context):
+    def render_navigation(self, snapshot, obj, kwargs):
         """to html"""
-        obj = self.object_var.resolve(context)
-        content_type = ContentType.objects.get_for_model(obj.__class__)
-        kwargs = self.resolve_kwargs(context)
-        tree_name = kwargs.pop('tree', 'default')
-        nav_nodes = NavNode.objects.filter(tree__name=tree_name, content_type=content_type, object_id=obj.id)
-        if nav_nodes.exists():
+        nav_nodes = snapshot.get_nodes_for_object(obj)
+        if nav_nodes:
             return nav_nodes[0].children_as_navigation(**kwargs)
         return ''
 
@@ -154,13 +227,10 @@ class NavigationSiblingsNode(NavigationTemplateNode):
         super(NavigationSiblingsNode, self).__init__(**kwargs)
         self.object_var = template.Variable(obj)
 
-    def render(self, context):
-        obj = self.object_var.resolve(context)
-        content_type = ContentType.objects.get_for_model(obj.__class__)
-        kwargs = self.resolve_kwargs(context)
-        tree_name = kwargs.pop('tree', 'default')
-        nav_nodes = NavNode.objects.filter(tree__name=tree_name, content_type=content_type, object_id=obj.id)
-        if nav_nodes.count() > 0:
+    def render_navigation(self, snapshot, obj, kwargs):
+        """to html"""
+        nav_nodes = snapshot.get_nodes_for_object(obj)
+        if nav_nodes:
             return nav_nodes[0].siblings_as_navigation(**kwargs)
         return ''
 
@@ -188,19 +258,12 @@ def render_template_node(node, template_name=""):
 class NavigationRootNode(NavigationTemplateNode):
     """Navigation"""
 
-    def render(self, context):
+    def render_navigation(self, snapshot, obj, kwargs):
         """to html"""
-        kwargs = self.resolve_kwargs(context)
-        tree_name = kwargs.pop('tree', 'default')
         template_name = kwargs.pop('template_name', DEFAULT_NAVROOT_TEMPLATE)
         parent = kwargs.pop('parent', None)
 
-        root_nodes = NavNode.objects.filter(tree__name=tree_name, in_navigation=True)
-        if parent:
-            root_nodes = root_nodes.filter(parent=parent)
-        else:
-            root_nodes = root_nodes.filter(parent__isnull=True)
-        root_nodes = root_nodes.order_by("ordering")
+        root_nodes = snapshot.get_children(parent, in_navigation=True, allow_all=True)
 
         return ''.join([render_template_node(node, template_name) for node in root_nodes])
 
@@ -13,17 +13,22 @@ from bs4 import BeautifulSoup
 
 from django import template
 from django.conf import settings
+from django.core.cache import cache
 from django.template.base import TemplateSyntaxError
 from django.template.loader import get_template
 from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 
 import floppyforms.__future__ as floppyforms
 
 from coop_cms.models import ArticleCategory, Image, Document
 from coop_cms.moves import make_context
-from coop_cms.settings import get_article_class, logger
+from coop_cms.settings import get_article_class, is_article_link_autocreate_enabled, is_cache_enabled, logger
 from coop_cms.shortcuts import get_article
-from coop_cms.utils import dehtml as do_dehtml, slugify
+from coop_cms.utils import (
+    add_cache_dependency, dehtml as do_dehtml, get_cache_version, get_model_cache_tag, get_object_cache_tag,
+    make_cache_key, slugify
+)
 
 register = template.Library()
 
@@ -47,30 +52,61 @@ class ArticleLinkNode(template.Node):
             lang = settings.LANGUAGE_CODE[:2]
         return lang
 
-    def render(self, context):
-        """to html"""
-        article_class = get_article_class()
-        
+    def get_title(self, context):
+        """the title of the article: a variable or a string"""
         try:
             variable = template.Variable(self.title)
-            title = variable.resolve(context)
+            return variable.resolve(context)
         except template.VariableDoesNotExist:
-            title = self.title.strip("'").strip('"')
-        
+            return self.title.strip("'").strip('"')
+
+    def find_article(self, title, current_lang, create=False):
+        """returns the article or None if it doesn't exist: it is created if create is True"""
+        article_class = get_article_class()
         slug = slugify(title)
         try:
             if self.lang:
-                article = get_article(slug, force_lang=self.lang)
+                return get_article(slug, force_lang=self.lang)
             else:
-                # If the language is not defined, we need to get it from the context
-                # The Django get_language api doesn't work in template-tag
-                article = get_article(slug, current_lang=self.get_language(context))
+                return get_article(slug, current_lang=current_lang)
         except article_class.DoesNotExist:
             try:
-                article = get_article(slug, all_langs=True)
+                return get_article(slug, all_langs=True)
             except article_class.DoesNotExist:
-                article = article_class.objects.create(slug=slug, title=title)
-        return article.get_absolute_url()
+                if create:
+                    return article_class.objects.create(slug=slug, title=title)
+        return None
+
+    def _get_link(self, title, current_lang):
+        """returns the url of the article and the tag of the cached values depending on it"""
+        article = self.find_article(title, current_lang, create=is_article_link_autocreate_enabled())
+        if article is None:
+            logger.warning("article_link: no article for '{0}'".format(title))
+            # the link is valid once the article is created
+            return {'url': '', 'tag': get_model_cache_tag(get_article_class())}
+        return {'url': article.get_absolute_url(), 'tag': get_object_cache_tag(article)}
+
+    def render(self, context):
+        """to html"""
+        title = self.get_title(context)
+        # If the language is not defined, we need to get it from the context
+        # The Django get_language api doesn't work in template-tag
+        current_lang = None if self.lang else self.get_language(context)
+
+        if is_cache_enabled():
+            # The url is cached until an article is modified
+            cache_key = make_cache_key(
+                'article-link', get_cache_version('articles'), title, self.lang, current_lang, get_language(),
+                settings.SITE_ID
+            )
+            link = cache.get(cache_key)
+            if link is None:
+                link = self._get_link(title, current_lang)
+                cache.set(cache_key, link)
+        else:
+            link = self._get_link(title, current_lang)
+        add_cache_dependency(link['tag'])
+        return link['url']
 
 
 @register.tag
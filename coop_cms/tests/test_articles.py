@@ -135,6 +135,57 @@ class ArticleTest(BaseArticleTest):
         response = self.client.get(article.get_absolute_url())
         self.assertEqual(200, response.status_code)
         
+    def test_create_slug_already_existing(self):
+        article_class = get_article_class()
+        articles = [article_class.objects.create(title="Agenda", content="a") for i in range(3)]
+        self.assertEqual(['agenda', 'agenda2', 'agenda3'], [article.slug for article in articles])
+
+    def test_create_slug_single_query(self):
+        article_class = get_article_class()
+        for i in range(5):
+            article_class.objects.create(title="Agenda", content="a")
+        article = article_class(title="Agenda", content="a")
+        with self.assertNumQueries(1):
+            self.assertEqual(article.get_unique_slug('slug', article.title), 'agenda6')
+
+    def test_create_slug_used_slugs(self):
+        """only the slug and its variants with a numeric suffix are loaded"""
+        article_class = get_article_class()
+        for title in ("Agenda", "Agenda", "Agendas", "Agenda 2018", "Agenda-test"):
+            article_class.objects.create(title=title, content="a")
+        article = article_class(title="Agenda", content="a")
+        self.assertEqual(
+            sorted(slug for slug in article._get_used_slugs('slug', 'agenda') if slug),
+            ['agenda', 'agenda2']
+        )
+        self.assertEqual(article.get_unique_slug('slug', article.title), 'agenda3')
+
+    def test_create_slug_truncated(self):
+        """the slug is truncated for adding the suffix"""
+        article_class = get_article_class()
+        title = "a" * 100
+        articles = [article_class.objects.create(title=title, content="a") for i in range(3)]
+        self.assertEqual(['a' * 100, 'a' * 99 + '2', 'a' * 99 + '3'], [article.slug for article in articles])
+
+    def test_create_slug_concurrent(self):
+        """the slug is generated again if used by another article saved at the same time"""
+        article_class = get_article_class()
+        article_class.objects.create(title="Agenda", content="a")
+
+        article = article_class(title="Agenda", content="a")
+        get_used_slugs = article._get_used_slugs
+        calls = []
+
+        def get_used_slugs_late(slug_field, origin_slug):
+            """the other article is not seen the 1st time"""
+            calls.append(origin_slug)
+            return set() if len(calls) == 1 else get_used_slugs(slug_field, origin_slug)
+
+        article._get_used_slugs = get_used_slugs_late
+        article.save()
+        self.assertEqual(article.slug, 'agenda2')
+        self.assertEqual(article_class.objects.filter(slug__startswith='agenda').count(), 2)
+
     def test_edit_article(self):
         article = get_article_class().objects.create(title="test", publication=BaseArticle.PUBLISHED)
         
@@ -2,14 +2,26 @@
 
 from __future__ import unicode_literals
 
+import gzip
+from io import BytesIO, StringIO
+
 from django.conf import settings
+from django.core import management
+from django.core.cache import cache
 from django.test.utils import override_settings
 
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
 
-from coop_cms.models import BaseArticle
-from coop_cms.settings import get_article_class
-from coop_cms.tests import BaseArticleTest
+from coop_cms.management.commands.warm_cms_cache import get_percentile
+from coop_cms.models import BaseArticle, Fragment, FragmentType, NavNode
+from coop_cms.settings import get_article_class, get_navtree_class
+from coop_cms.shortcuts import get_article
+from coop_cms.tests import BaseArticleTest, BaseTestCase
+from coop_cms.utils import (
+    acquire_cache_lock, add_cache_dependency, bump_cache_version, get_tagged_cache, release_cache_lock,
+    set_tagged_cache, start_cache_dependencies, stop_cache_dependencies
+)
 
 
 @override_settings(
@@ -46,7 +58,7 @@ class ArticleTest(BaseArticleTest):
         article.save()
         response = self.client.get(article.get_absolute_url())
         self.assertEqual(200, response.status_code)
-        self.assertContains(response, "Hello")
+        self.assertContains(response, "Bye")
 
     def test_logged_as_non_staff(self):
         """show page if permission required and authenticated"""
@@ -61,7 +73,7 @@ class ArticleTest(BaseArticleTest):
         article.save()
         response = self.client.get(article.get_absolute_url())
         self.assertEqual(200, response.status_code)
-        self.assertContains(response, "Hello")
+        self.assertContains(response, "Bye")
 
     def test_logged_as_staff(self):
         """show page if permission required and authenticated"""
@@ -107,3 +119,332 @@ class ArticleTest(BaseArticleTest):
         self.assertEqual(200, response.status_code)
         self.assertContains(response, data['content'])
 
+
+
+@override_settings(
+    COOP_CMS_CACHE=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    COOP_CMS_ARTICLE_TEMPLATES=(('test/article_with_fragments.html', 'Article with fragments'),)
+)
+class PageCacheDependenciesTest(BaseTestCase):
+    """the cached page is invalidated when an object used for rendering it is modified"""
+
+    def setUp(self):
+        super(PageCacheDependenciesTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(PageCacheDependenciesTest, self).tearDown()
+
+    def _get_article(self):
+        article = get_article_class().objects.create(
+            title="test", publication=BaseArticle.PUBLISHED, content="Hello",
+            template='test/article_with_fragments.html'
+        )
+        response = self.client.get(article.get_absolute_url())
+        self.assertEqual(200, response.status_code)
+        return article
+
+    def test_cached_page(self):
+        fragment_type = FragmentType.objects.create(name="parts")
+        fragment = Fragment.objects.create(type=fragment_type, content="Azerty")
+        article = self._get_article()
+        # modified without signal: the cached page is returned
+        Fragment.objects.filter(id=fragment.id).update(content="Qsdfgh")
+        self.assertContains(self.client.get(article.get_absolute_url()), "Azerty")
+
+    def test_fragment_changed(self):
+        fragment_type = FragmentType.objects.create(name="parts")
+        fragment = Fragment.objects.create(type=fragment_type, content="Azerty")
+        article = self._get_article()
+        self.assertContains(self.client.get(article.get_absolute_url()), "Azerty")
+
+        fragment.content = "Qsdfgh"
+        fragment.save()
+        response = self.client.get(article.get_absolute_url())
+        self.assertNotContains(response, "Azerty")
+        self.assertContains(response, "Qsdfgh")
+
+    def test_fragment_added(self):
+        article = self._get_article()
+        fragment_type = FragmentType.objects.get(name="parts")
+        Fragment.objects.create(type=fragment_type, content="Azerty")
+        self.assertContains(self.client.get(article.get_absolute_url()), "Azerty")
+
+    def test_navigation_changed(self):
+        article = self._get_article()
+        other_article = get_article_class().objects.create(title="Wxcvbn", publication=BaseArticle.PUBLISHED)
+        tree = get_navtree_class().objects.get_or_create(name='default')[0]
+        NavNode.objects.create(tree=tree, label="Wxcvbn", content_object=other_article, parent=None, ordering=1)
+        self.assertContains(self.client.get(article.get_absolute_url()), "Wxcvbn")
+
+    def test_article_changed(self):
+        article = self._get_article()
+        article.title = "Poiuyt"
+        article.save()
+        self.assertContains(self.client.get(article.get_absolute_url()), "Poiuyt")
+
+    def test_tag_changed_while_recording(self):
+        """the version stored is the one read when the tag is added"""
+        start_cache_dependencies()
+        add_cache_dependency('test-tag')
+        bump_cache_version('test-tag')
+        add_cache_dependency('test-tag')
+        versions = stop_cache_dependencies()
+        set_tagged_cache('test-key', 'value', versions)
+        self.assertEqual(get_tagged_cache('test-key'), None)
+        set_tagged_cache('test-key', 'value', ['test-tag'])
+        self.assertEqual(get_tagged_cache('test-key'), 'value')
+
+    def test_other_article_changed(self):
+        article = self._get_article()
+        get_article_class().objects.filter(id=article.id).update(content="Poiuyt")
+        other_article = get_article_class().objects.create(title="other", publication=BaseArticle.PUBLISHED)
+        other_article.title = "Qsdfgh"
+        other_article.save()
+        self.assertNotContains(self.client.get(article.get_absolute_url()), "Poiuyt")
+
+
+@override_settings(
+    COOP_CMS_CACHE=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    COOP_CMS_ARTICLE_TEMPLATES=(('test/article_with_fragments.html', 'Article with fragments'),)
+)
+class PageCacheResponseTest(BaseArticleTest):
+    """the whole response is cached for every visitor class"""
+
+    def setUp(self):
+        super(PageCacheResponseTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(PageCacheResponseTest, self).tearDown()
+
+    def _get_article(self):
+        article = get_article_class().objects.create(
+            title="test", publication=BaseArticle.PUBLISHED, content="Hello",
+            template='test/article_with_fragments.html'
+        )
+        response = self.client.get(article.get_absolute_url())
+        self.assertEqual(200, response.status_code)
+        # modified without signal: the cached page is returned
+        get_article_class().objects.filter(id=article.id).update(content="Bye")
+        return article
+
+    def _get_cache_key(self, article, visitor_class):
+        class_name = '{0}.{1}'.format(article.__class__.__module__, article.__class__.__name__)
+        return '{0}-{1}-{2}-{3}-{4}'.format(settings.SITE_ID, 'en', class_name, article.id, visitor_class)
+
+    def test_headers(self):
+        article = self._get_article()
+        response = self.client.get(article.get_absolute_url())
+        self.assertContains(response, "Hello")
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+    def test_authenticated(self):
+        article = self._get_article()
+        self._log_as_non_editor()
+        response = self.client.get(article.get_absolute_url())
+        self.assertContains(response, "Bye")
+        self.assertTrue(cache.get(self._get_cache_key(article, 'authenticated')))
+
+    @override_settings(COOP_CMS_CACHE_GZIP=True)
+    def test_gzip(self):
+        article = self._get_article()
+        response = self.client.get(article.get_absolute_url(), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue("Hello" in gzip.GzipFile(fileobj=BytesIO(response.content)).read().decode('utf-8'))
+
+        response = self.client.get(article.get_absolute_url())
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertContains(response, "Hello")
+
+    def test_stale_while_revalidate(self):
+        article = self._get_article()
+        Fragment.objects.create(type=FragmentType.objects.get(name="parts"), content="Azerty")
+        # Another request is rendering the page: the stale page is sent
+        cache_key = self._get_cache_key(article, 'anonymous')
+        self.assertTrue(acquire_cache_lock(cache_key, 30))
+        response = self.client.get(article.get_absolute_url())
+        self.assertContains(response, "Hello")
+        self.assertNotContains(response, "Azerty")
+
+        release_cache_lock(cache_key)
+        response = self.client.get(article.get_absolute_url())
+        self.assertContains(response, "Bye")
+        self.assertContains(response, "Azerty")
+
+
+@override_settings(
+    COOP_CMS_CONDITIONAL_GET=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    COOP_CMS_ARTICLE_TEMPLATES=(('test/article_with_fragments.html', 'Article with fragments'),)
+)
+class ConditionalGetTest(BaseArticleTest):
+    """the page is not sent again if not modified"""
+
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(ConditionalGetTest, self).tearDown()
+
+    def _get_article(self):
+        article = get_article_class().objects.create(
+            title="test", publication=BaseArticle.PUBLISHED, content="Hello",
+            template='test/article_with_fragments.html'
+        )
+        response = self.client.get(article.get_absolute_url())
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.has_header('Last-Modified'))
+        return article, response['ETag']
+
+    def test_not_modified(self):
+        article, etag = self._get_article()
+        response = self.client.get(article.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.content)
+
+    def test_not_modified_since(self):
+        article, etag = self._get_article()
+        response = self.client.get(article.get_absolute_url())
+        response = self.client.get(
+            article.get_absolute_url(), HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(304, response.status_code)
+
+    def test_article_modified(self):
+        article, etag = self._get_article()
+        article.content = "Bye"
+        article.save()
+        response = self.client.get(article.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, "Bye")
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_fragment_modified(self):
+        article, etag = self._get_article()
+        Fragment.objects.create(type=FragmentType.objects.get(name="parts"), content="Azerty")
+        response = self.client.get(article.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, "Azerty")
+
+    @override_settings(
+        COOP_CMS_CACHE=True, COOP_CMS_ARTICLE_LINK_AUTOCREATE=False,
+        COOP_CMS_ARTICLE_TEMPLATES=(('test/article_with_link.html', 'Article with link'),)
+    )
+    def test_recorded_tag_modified(self):
+        """the tags recorded when rendering the cached page are checked: the other article is not a fixed tag"""
+        other_article = get_article_class().objects.create(
+            title="Other", slug="other", publication=BaseArticle.PUBLISHED
+        )
+        article = get_article_class().objects.create(
+            title="test", publication=BaseArticle.PUBLISHED, content="Hello", template='test/article_with_link.html'
+        )
+        link_html = '<div class="article-link">{0}</div>'.format(other_article.get_absolute_url())
+        response = self.client.get(article.get_absolute_url())
+        self.assertContains(response, link_html)
+        etag = response['ETag']
+        self.assertEqual(304, self.client.get(article.get_absolute_url(), HTTP_IF_NONE_MATCH=etag).status_code)
+
+        other_article.delete()
+        response = self.client.get(article.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotContains(response, link_html)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_visitor_changed(self):
+        article, etag = self._get_article()
+        self._log_as_non_editor()
+        response = self.client.get(article.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+    @override_settings(COOP_CMS_CONDITIONAL_GET=False)
+    def test_disabled(self):
+        article = get_article_class().objects.create(title="test", publication=BaseArticle.PUBLISHED)
+        response = self.client.get(article.get_absolute_url())
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(
+    COOP_CMS_CACHE=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ArticleSlugCacheTest(BaseTestCase):
+    """the id of the article is cached for a slug"""
+
+    def setUp(self):
+        super(ArticleSlugCacheTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(ArticleSlugCacheTest, self).tearDown()
+
+    def test_get_article_cached(self):
+        article = get_article_class().objects.create(title="test", publication=BaseArticle.PUBLISHED)
+        article.sites.add(Site.objects.get_current())
+        self.assertEqual(get_article("test", sites=settings.SITE_ID), article)
+        # the article is get by id
+        with self.assertNumQueries(1):
+            self.assertEqual(get_article("test", sites=settings.SITE_ID), article)
+
+    def test_get_article_slug_changed(self):
+        article = get_article_class().objects.create(title="test", publication=BaseArticle.PUBLISHED)
+        self.assertEqual(get_article("test"), article)
+        article.slug = "new-test"
+        article.save()
+        self.assertRaises(get_article_class().DoesNotExist, get_article, "test")
+        self.assertEqual(get_article("new-test"), article)
+
+    def test_get_article_created(self):
+        self.assertRaises(get_article_class().DoesNotExist, get_article, "test")
+        article = get_article_class().objects.create(title="test", publication=BaseArticle.PUBLISHED)
+        self.assertEqual(get_article("test"), article)
+
+    def test_get_article_sites_changed(self):
+        article = get_article_class().objects.create(title="test", publication=BaseArticle.PUBLISHED)
+        article.sites.add(Site.objects.get_current())
+        self.assertEqual(get_article("test", sites=settings.SITE_ID), article)
+        article.sites.clear()
+        self.assertRaises(get_article_class().DoesNotExist, get_article, "test", sites=settings.SITE_ID)
+
+
+@override_settings(
+    COOP_CMS_CACHE=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    COOP_CMS_ARTICLE_TEMPLATES=(('test/article_with_fragments.html', 'Article with fragments'),)
+)
+class WarmCacheTest(BaseTestCase):
+    """the pages are rendered by the warm_cms_cache command"""
+
+    def setUp(self):
+        super(WarmCacheTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(WarmCacheTest, self).tearDown()
+
+    def test_percentile(self):
+        self.assertEqual(get_percentile([], 50), 0)
+        self.assertEqual(get_percentile([1], 99), 1)
+        values = list(range(1, 101))
+        self.assertEqual(get_percentile(values, 50), 50)
+        self.assertEqual(get_percentile(values, 90), 90)
+        self.assertEqual(get_percentile(values, 99), 99)
+        self.assertEqual(get_percentile(values, 100), 100)
+
+    def test_warm_cache(self):
+        article = get_article_class().objects.create(
+            title="test", publication=BaseArticle.PUBLISHED, content="Hello",
+            template='test/article_with_fragments.html'
+        )
+        output = StringIO()
+        management.call_command('warm_cms_cache', workers=1, host='testserver', stdout=output)
+        self.assertTrue('0 errors' in output.getvalue())
+        self.assertTrue('p99' in output.getvalue())
+
+        # modified without signal: the cached page is returned
+        get_article_class().objects.filter(id=article.id).update(content="Bye")
+        self.assertContains(self.client.get(article.get_absolute_url()), "Hello")
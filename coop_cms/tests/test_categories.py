@@ -8,6 +8,7 @@ try:
     from django.urls import reverse
 except:
     from django.core.urlresolvers import reverse
+from django.core.cache import cache
 from django.template import Template, Context
 from django.test.utils import override_settings
 
@@ -16,6 +17,7 @@ from model_mommy import mommy
 from coop_cms.models import BaseArticle, ArticleCategory
 from coop_cms.settings import get_article_class
 from coop_cms.tests import BaseTestCase
+from coop_cms.views.articles import ArticlesByCategoryView
 
 
 @override_settings(COOP_CMS_ARTICLES_CATEGORY_PAGINATION=10)
@@ -228,6 +230,188 @@ class ArticlesByCategoryTest(BaseTestCase):
             self.assertContains(response, "AZERTY-{0}-UIOP".format(i))
         for i in ids[:5]:
             self.assertNotContains(response, "AZERTY-{0}-UIOP".format(i))
+
+
+@override_settings(
+    COOP_CMS_ARTICLES_CATEGORY_PAGINATION=10, COOP_CMS_CACHE=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ArticlesByCategoryCountTest(BaseTestCase):
+    """the number of articles of a category is cached"""
+
+    def setUp(self):
+        super(ArticlesByCategoryCountTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(ArticlesByCategoryCountTest, self).tearDown()
+
+    def test_count_cached(self):
+        cat = mommy.make(ArticleCategory)
+        mommy.make(get_article_class(), category=cat, title="AZERTYUIOP", publication=BaseArticle.PUBLISHED)
+        url = reverse('coop_cms_articles_category', args=[cat.slug])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        view = ArticlesByCategoryView()
+        with self.assertNumQueries(0):
+            self.assertEqual(view.get_articles_count(cat), 1)
+
+    def test_count_invalidated(self):
+        cat = mommy.make(ArticleCategory)
+        url = reverse('coop_cms_articles_category', args=[cat.slug])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        mommy.make(get_article_class(), category=cat, title="AZERTYUIOP", publication=BaseArticle.PUBLISHED)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "AZERTYUIOP")
+
+    @override_settings(COOP_CMS_CACHE=False)
+    def test_count_cache_disabled(self):
+        cat = mommy.make(ArticleCategory)
+        article = mommy.make(get_article_class(), category=cat, title="AZERTYUIOP", publication=BaseArticle.DRAFT)
+        url = reverse('coop_cms_articles_category', args=[cat.slug])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        # published without signal: not cached
+        get_article_class().objects.filter(id=article.id).update(publication=BaseArticle.PUBLISHED)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "AZERTYUIOP")
+
+
+@override_settings(COOP_CMS_ARTICLES_CATEGORY_PAGINATION=10, COOP_CMS_ARTICLES_CATEGORY_KEYSET_PAGINATION=True)
+class ArticlesByCategoryKeysetTest(BaseTestCase):
+    """the next articles are given by the last article of the page"""
+
+    def _make_articles(self):
+        cat = mommy.make(ArticleCategory)
+        for i in range(25):
+            mommy.make(
+                get_article_class(), category=cat, publication_date=datetime(2014, 3, i // 2 + 1),
+                title="AZERTY-{0}-UIOP".format(i), publication=BaseArticle.PUBLISHED
+            )
+        return reverse('coop_cms_articles_category', args=[cat.slug])
+
+    def _get_titles(self, response):
+        return [
+            "AZERTY-{0}-UIOP".format(i) for i in range(25)
+            if response.content.decode('utf-8').find("AZERTY-{0}-UIOP".format(i)) >= 0
+        ]
+
+    def test_view_pages(self):
+        url = self._make_articles()
+        titles = []
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        while response.context['next_cursor']:
+            titles.extend(self._get_titles(response))
+            response = self.client.get(url, data={'after': response.context['next_cursor']})
+            self.assertEqual(response.status_code, 200)
+        titles.extend(self._get_titles(response))
+        self.assertEqual(sorted(titles), sorted(["AZERTY-{0}-UIOP".format(i) for i in range(25)]))
+
+        # same date: ordered by id
+        response = self.client.get(url)
+        self.assertEqual(
+            [article.title for article in response.context['articles'][:2]], ["AZERTY-24-UIOP", "AZERTY-23-UIOP"]
+        )
+
+    def test_load_more(self):
+        url = self._make_articles()
+        response = self.client.get(url)
+        response = self.client.get(
+            url, data={'after': response.context['next_cursor']}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "coop_cms/_articles_category_items.html")
+        self.assertTemplateNotUsed(response, "coop_cms/articles_category.html")
+        self.assertEqual(len(response.context['articles']), 10)
+        self.assertContains(response, "coop-cms-load-more")
+
+    def test_invalid_cursor(self):
+        url = self._make_articles()
+        response = self.client.get(url, data={'after': 'abcd'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ArticlesInCategoryTest(BaseTestCase):
+    """previous and next articles of a category"""
+
+    def setUp(self):
+        super(ArticlesInCategoryTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(ArticlesInCategoryTest, self).tearDown()
+
+    def _make_article(self, category, day, publication=BaseArticle.PUBLISHED):
+        return mommy.make(
+            get_article_class(), category=category, publication_date=datetime(2014, 3, day), publication=publication,
+            title="Article {0}".format(day)
+        )
+
+    def test_neighbours(self):
+        cat = mommy.make(ArticleCategory)
+        art1 = self._make_article(cat, 1)
+        art2 = self._make_article(cat, 2)
+        art3 = self._make_article(cat, 2)
+        art4 = self._make_article(cat, 3)
+        self._make_article(cat, 4, BaseArticle.DRAFT)
+        self._make_article(mommy.make(ArticleCategory), 4)
+
+        self.assertEqual(art1.previous_in_category(), None)
+        self.assertEqual(art1.next_in_category(), art2)
+        # same publication date: skipped
+        self.assertEqual(art2.previous_in_category(), art1)
+        self.assertEqual(art2.next_in_category(), art4)
+        self.assertEqual(art3.previous_in_category(), art1)
+        self.assertEqual(art4.previous_in_category(), art3)
+        self.assertEqual(art4.next_in_category(), None)
+
+    @override_settings(COOP_CMS_CACHE=True)
+    def test_neighbours_cached(self):
+        cat = mommy.make(ArticleCategory)
+        art1 = self._make_article(cat, 1)
+        art2 = self._make_article(cat, 2)
+        art3 = self._make_article(cat, 3)
+
+        # one query for the positions in the category, one for the articles
+        with self.assertNumQueries(2):
+            self.assertEqual(art2.previous_in_category(), art1)
+            self.assertEqual(art2.next_in_category(), art3)
+
+        # only the ids are cached: the articles are loaded together
+        article = get_article_class().objects.get(id=art2.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(article.previous_in_category(), art1)
+            self.assertEqual(article.next_in_category(), art3)
+
+        # a new article is taken into account
+        art4 = mommy.make(
+            get_article_class(), category=cat, publication_date=datetime(2014, 3, 2, 12),
+            publication=BaseArticle.PUBLISHED, title="Article"
+        )
+        article = get_article_class().objects.get(id=art2.id)
+        self.assertEqual(article.previous_in_category(), art1)
+        self.assertEqual(article.next_in_category(), art4)
+
+    def test_neighbours_cache_disabled(self):
+        cat = mommy.make(ArticleCategory)
+        art1 = self._make_article(cat, 1)
+        art2 = self._make_article(cat, 2)
+        self.assertEqual(art1.next_in_category(), art2)
+
+        # modified without signal: not cached
+        art3 = self._make_article(cat, 1)
+        get_article_class().objects.filter(id=art3.id).update(publication_date=datetime(2014, 3, 1, 12))
+        article = get_article_class().objects.get(id=art1.id)
+        # the category, the positions in the category and the articles
+        with self.assertNumQueries(3):
+            self.assertEqual(article.next_in_category(), art3)
         
         
 class CoopCategoryTemplateTagTest(BaseTestCase):
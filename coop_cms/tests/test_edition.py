@@ -2,13 +2,17 @@
 
 from __future__ import unicode_literals
 
+from django import forms
+from django.core.cache import cache
+from django.db import connection
 from django.template import Template, Context
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 
 from model_mommy import mommy
 
 from coop_cms.models import PieceOfHtml
 from coop_cms.settings import get_article_class
+from coop_cms.templatetags.coop_edition import _get_template_from_string, FormWrapper, PieceOfHtmlEditNode
 from coop_cms.tests import BaseTestCase, BeautifulSoup, BaseArticleTest
 
 
@@ -144,6 +148,82 @@ class PieceOfHtmlTagsTest(BaseTestCase):
         PieceOfHtml.objects.get(div_id="test", extra_id="1")
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PiecesOfHtmlBatchTest(BaseTestCase):
+    """the pieces of html of a template are loaded together"""
+
+    def setUp(self):
+        super(PiecesOfHtmlBatchTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(PiecesOfHtmlBatchTest, self).tearDown()
+
+    def _render(self, tpl, **kwargs):
+        context = {"inline_html_edit": False}
+        context.update(kwargs)
+        return tpl.render(Context(context))
+
+    @override_settings(COOP_CMS_CACHE=True)
+    def test_single_query(self):
+        mommy.make(PieceOfHtml, div_id="a", content="A")
+        mommy.make(PieceOfHtml, div_id="b", content="B")
+        mommy.make(PieceOfHtml, div_id="b", extra_id="1", content="B1")
+        tpl = Template(
+            '{% load coop_edition %}{% coop_piece_of_html "a" %}{% coop_piece_of_html "b" %}'
+            '{% coop_piece_of_html "b" extra_id=1 %}'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            html = self._render(tpl)
+        self.assertEqual(html, "ABB1")
+        self.assertEqual(len(queries), 1)
+
+        # cached
+        with CaptureQueriesContext(connection) as queries:
+            html = self._render(tpl)
+        self.assertEqual(html, "ABB1")
+        self.assertEqual(len(queries), 0)
+
+    def test_cache_disabled(self):
+        mommy.make(PieceOfHtml, div_id="a", content="A")
+        tpl = Template('{% load coop_edition %}{% coop_piece_of_html "a" %}')
+        self.assertEqual(self._render(tpl), "A")
+        # modified without signal: not cached
+        PieceOfHtml.objects.filter(div_id="a").update(content="Z")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._render(tpl), "Z")
+        self.assertEqual(len(queries), 1)
+
+    @override_settings(COOP_CMS_CACHE=True)
+    def test_cache_content_only(self):
+        """only the contents of the pieces are stored in the cache"""
+        mommy.make(PieceOfHtml, div_id="a", content="A")
+        tpl = Template('{% load coop_edition %}{% coop_piece_of_html "a" %}')
+        self.assertEqual(self._render(tpl), "A")
+        batch = tpl.nodelist.get_nodes_by_type(PieceOfHtmlEditNode)[0]._batch
+        self.assertEqual(cache.get(batch._get_cache_key()), {("a", ""): "A"})
+
+    @override_settings(COOP_CMS_CACHE=True)
+    def test_invalidated_on_save(self):
+        piece = mommy.make(PieceOfHtml, div_id="a", content="A")
+        tpl = Template('{% load coop_edition %}{% coop_piece_of_html "a" %}{% coop_piece_of_html "c" %}')
+        self.assertEqual(self._render(tpl), "A")
+
+        # the missing piece has been created
+        self.assertEqual(PieceOfHtml.objects.filter(div_id="c").count(), 1)
+
+        piece.content = "Z"
+        piece.save()
+        self.assertEqual(self._render(tpl), "Z")
+
+    def test_variable(self):
+        mommy.make(PieceOfHtml, div_id="a", content="A")
+        mommy.make(PieceOfHtml, div_id="b", content="B")
+        tpl = Template('{% load coop_edition %}{% coop_piece_of_html "a" %}{% coop_piece_of_html name %}')
+        self.assertEqual(self._render(tpl, name="b"), "AB")
+
+
 @override_settings(COOP_CMS_ARTICLE_TEMPLATES=(('test/article_with_blocks.html', 'Article with blocks'),))
 class BlockInheritanceTest(BaseArticleTest):
     """test using block templatetag inside the cms_edit template tag"""
@@ -199,3 +279,37 @@ class BlockInheritanceTest(BaseArticleTest):
         self.assertContains(response, "*** HELLO FROM PARENT ***")
         self.assertContains(response, "*** HELLO FROM BLOCK ***")
 
+
+
+class EditionTemplatesTest(BaseTestCase):
+    """the templates of the edition tags are compiled once: the html is the same as before"""
+
+    class _Form(forms.Form):
+        title = forms.CharField(max_length=5)
+        content = forms.CharField(widget=forms.Textarea)
+
+        class Media:
+            js = ('test/"edition".js', )
+            css = {'all': ('test/edition.css', )}
+
+    def test_compiled_once(self):
+        template_ = _get_template_from_string('{{ test }}')
+        self.assertTrue(template_ is _get_template_from_string('{{ test }}'))
+        self.assertEqual(template_.render(Context({'test': 'Hello'})), 'Hello')
+
+    def test_form_wrapper(self):
+        form = self._Form(data={'title': 'Too long', 'content': ''})
+        wrapper = FormWrapper(form, None)
+        for field in ('title', 'content'):
+            template_ = Template("""
+                    {%% with form.%s.errors as errs %%}
+                    {%% include "coop_cms/_form_error.html" %%}{%% endwith %%}{{form.%s}}
+                """ % (field, field))
+            self.assertEqual(wrapper[field], template_.render(Context({'form': form})))
+
+    def test_cms_form_media(self):
+        form = self._Form()
+        expected = Template('{{ form.media }}').render(Context({'form': form})).replace("&quot;", '"')
+        tpl = Template('{% load coop_edition %}{% cms_form_media %}')
+        self.assertEqual(tpl.render(Context({'form': form})), expected)
+        self.assertEqual(tpl.render(Context({})), '')
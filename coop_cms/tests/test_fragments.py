@@ -11,15 +11,21 @@ try:
     from django.urls import reverse
 except:
     from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.db import connection
 from django.template import Template, Context
+from django.test.utils import CaptureQueriesContext, override_settings
 
 from model_mommy import mommy
 from colorbox.utils import assert_popup_refresh
 
 from coop_cms.forms import ArticleForm
-from coop_cms.models import BaseArticle, Fragment, FragmentType, FragmentFilter
+from coop_cms.models import (
+    BaseArticle, Fragment, FragmentType, FragmentFilter, get_fragment_filter_id, get_fragment_type_id
+)
 from coop_cms.settings import get_article_class
 from coop_cms.tests import BaseTestCase, BeautifulSoup
+from coop_cms.utils import bump_cache_version
 
 
 class BaseFragmentTest(BaseTestCase):
@@ -586,6 +592,84 @@ class FragmentsTest(BaseFragmentTest):
         self.assertEqual(3, len(soup.select('.panel'))) # 1 extra panel if_cms_edition and fragment index > 0
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FragmentsQueriesTest(BaseTestCase):
+    """the fragments of a template are loaded together"""
+
+    def setUp(self):
+        super(FragmentsQueriesTest, self).setUp()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(FragmentsQueriesTest, self).tearDown()
+
+    def _make_fragments(self):
+        fragment_type1 = mommy.make(FragmentType, name="parts")
+        fragment_type2 = mommy.make(FragmentType, name="links")
+        fragment_filter = mommy.make(FragmentFilter, extra_id="1")
+        mommy.make(Fragment, type=fragment_type1, content="A", filter=None)
+        mommy.make(Fragment, type=fragment_type1, content="B", filter=fragment_filter)
+        mommy.make(Fragment, type=fragment_type2, content="C", filter=None)
+        return Template(
+            '{% load coop_edition %}{% coop_fragments "parts" %}|{% coop_fragments "parts" "1" %}|'
+            '{% coop_fragments "links" %}'
+        )
+
+    def _get_contents(self, html):
+        return [[tag.text for tag in BeautifulSoup(part).select('.coop-fragment')] for part in html.split('|')]
+
+    def test_single_query(self):
+        tpl = self._make_fragments()
+        tpl.render(Context({}))
+        with CaptureQueriesContext(connection) as queries:
+            html = tpl.render(Context({}))
+        self.assertEqual(self._get_contents(html), [["A", "B"], ["B"], ["C"]])
+        self.assertEqual(len(queries), 1)
+
+    def test_no_write(self):
+        tpl = Template('{% load coop_edition %}{% coop_fragments "parts" "1" %}')
+        tpl.render(Context({}))
+        self.assertEqual(FragmentType.objects.filter(name="parts").count(), 1)
+        self.assertEqual(FragmentFilter.objects.filter(extra_id="1").count(), 1)
+        with CaptureQueriesContext(connection) as queries:
+            tpl.render(Context({}))
+        self.assertEqual(len(queries), 1)
+
+    @override_settings(COOP_CMS_CACHE=True)
+    def test_cache(self):
+        tpl = self._make_fragments()
+        self.assertEqual(self._get_contents(tpl.render(Context({}))), [["A", "B"], ["B"], ["C"]])
+        with CaptureQueriesContext(connection) as queries:
+            html = tpl.render(Context({}))
+        self.assertEqual(self._get_contents(html), [["A", "B"], ["B"], ["C"]])
+        self.assertEqual(len(queries), 0)
+
+        fragment = Fragment.objects.get(content="C")
+        fragment.content = "D"
+        fragment.save()
+        self.assertEqual(self._get_contents(tpl.render(Context({}))), [["A", "B"], ["B"], ["D"]])
+
+    def test_ids_version(self):
+        """the ids are get again when a fragment type or filter is modified by another process"""
+        mommy.make(FragmentType, name="parts")
+        mommy.make(FragmentFilter, extra_id="1")
+        fragment_type_id = get_fragment_type_id("parts")
+        fragment_filter_id = get_fragment_filter_id("1")
+        # modified without signal: the cached ids are used
+        FragmentType.objects.filter(id=fragment_type_id).update(name="other")
+        FragmentFilter.objects.filter(id=fragment_filter_id).update(extra_id="2")
+        self.assertEqual(get_fragment_type_id("parts"), fragment_type_id)
+        self.assertEqual(get_fragment_filter_id("1"), fragment_filter_id)
+
+        # the version is shared by all the processes
+        bump_cache_version('fragment-ids')
+        self.assertNotEqual(get_fragment_type_id("parts"), fragment_type_id)
+        self.assertNotEqual(get_fragment_filter_id("1"), fragment_filter_id)
+        self.assertEqual(FragmentType.objects.filter(name="parts").count(), 1)
+        self.assertEqual(FragmentFilter.objects.filter(extra_id="1").count(), 1)
+
+
 class FragmentsInArticleTest(BaseFragmentTest):
     """Articles related tests"""
 
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import os.path
+import shutil
+import tempfile
+
+from django.core import management
+from django.core.cache import cache
+from django.test.utils import override_settings
+try:
+    from django.urls import reverse
+except:
+    from django.core.urlresolvers import reverse
+
+from model_mommy import mommy
+
+from coop_cms.management.commands.freeze_cms import get_file_path, MANIFEST_NAME
+from coop_cms.models import ArticleCategory, BaseArticle, Fragment, FragmentType
+from coop_cms.settings import get_article_class
+from coop_cms.site_urls import get_site_urls
+from coop_cms.tests import BaseTestCase
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    COOP_CMS_ARTICLE_TEMPLATES=(('test/article_with_fragments.html', 'Article with fragments'),)
+)
+class FreezeTest(BaseTestCase):
+    """render the site as static files"""
+
+    def setUp(self):
+        super(FreezeTest, self).setUp()
+        cache.clear()
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+        cache.clear()
+        super(FreezeTest, self).tearDown()
+
+    def _freeze(self, **kwargs):
+        management.call_command(
+            'freeze_cms', self.output_dir, processes=1, host='testserver', verbosity=0, **kwargs
+        )
+
+    def _read_page(self, url):
+        with open(get_file_path(self.output_dir, url)) as page_file:
+            return page_file.read()
+
+    def _make_article(self, title, **kwargs):
+        return get_article_class().objects.create(
+            title=title, content="Hello", publication=BaseArticle.PUBLISHED,
+            template='test/article_with_fragments.html', **kwargs
+        )
+
+    def test_file_path(self):
+        self.assertEqual(get_file_path('/out', '/'), '/out/index.html')
+        self.assertEqual(get_file_path('/out', '/en/test/'), '/out/en/test/index.html')
+        self.assertEqual(get_file_path('/out', '/sitemap.xml'), '/out/sitemap.xml')
+        self.assertEqual(get_file_path('/out', '/rss'), '/out/rss/index.html')
+
+    def test_site_urls(self):
+        category = mommy.make(ArticleCategory)
+        article = self._make_article("Abcd", category=category)
+        private_article = self._make_article("Efgh", login_required=True)
+        draft = get_article_class().objects.create(title="Ijkl", publication=BaseArticle.DRAFT)
+        empty_category = mommy.make(ArticleCategory)
+        urls = [url for (language, url) in get_site_urls()]
+        self.assertTrue(reverse('coop_cms_homepage') in urls)
+        self.assertTrue(reverse('coop_cms_sitemap') in urls)
+        self.assertTrue(article.get_absolute_url() in urls)
+        self.assertTrue(category.get_absolute_url() in urls)
+        self.assertFalse(private_article.get_absolute_url() in urls)
+        self.assertFalse(draft.get_absolute_url() in urls)
+        self.assertFalse(empty_category.get_absolute_url() in urls)
+
+    @override_settings(COOP_CMS_SITE_EXTRA_URLS=['/rss/'])
+    def test_site_extra_urls(self):
+        self.assertTrue('/rss/' in [url for (language, url) in get_site_urls()])
+
+    def test_freeze(self):
+        category = mommy.make(ArticleCategory)
+        article = self._make_article("Abcd", category=category)
+        draft = get_article_class().objects.create(title="Ijkl", publication=BaseArticle.DRAFT)
+        self._freeze()
+
+        self.assertTrue("Hello" in self._read_page(article.get_absolute_url()))
+        self.assertTrue("Abcd" in self._read_page(category.get_absolute_url()))
+        self.assertTrue(os.path.exists(get_file_path(self.output_dir, reverse('coop_cms_sitemap'))))
+        self.assertFalse(os.path.exists(get_file_path(self.output_dir, draft.get_absolute_url())))
+        with open(os.path.join(self.output_dir, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertTrue(article.get_absolute_url() in manifest)
+        self.assertEqual([], [name for name in os.listdir(self.output_dir) if name.startswith('.tmp-')])
+
+    def test_freeze_incremental(self):
+        article1 = self._make_article("Abcd")
+        article2 = self._make_article("Efgh")
+        self._freeze()
+
+        # modified without signals: not rendered again
+        get_article_class().objects.filter(id=article1.id).update(content="Bye")
+        article2.content = "Bye"
+        article2.save()
+        self._freeze(incremental=True)
+        self.assertTrue("Hello" in self._read_page(article1.get_absolute_url()))
+        self.assertTrue("Bye" in self._read_page(article2.get_absolute_url()))
+
+        # a fragment is used by every article
+        Fragment.objects.create(type=FragmentType.objects.get(name="parts"), content="Azerty")
+        self._freeze(incremental=True)
+        self.assertTrue("Bye" in self._read_page(article1.get_absolute_url()))
+        self.assertTrue("Azerty" in self._read_page(article1.get_absolute_url()))
+
+    def test_freeze_error(self):
+        """the page of the last run is kept if it can not be rendered"""
+        article = self._make_article("Abcd")
+        self._freeze()
+
+        get_article_class().objects.filter(id=article.id).update(
+            content="Bye", template='test/does_not_exist.html'
+        )
+        self._freeze()
+        self.assertTrue("Hello" in self._read_page(article.get_absolute_url()))
+        with open(os.path.join(self.output_dir, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertTrue(article.get_absolute_url() in manifest)
+
+        # rendered again once fixed
+        get_article_class().objects.filter(id=article.id).update(template='test/article_with_fragments.html')
+        self._freeze()
+        self.assertTrue("Bye" in self._read_page(article.get_absolute_url()))
+
+    def test_freeze_unpublished(self):
+        article = self._make_article("Abcd")
+        self._freeze()
+        self.assertTrue(os.path.exists(get_file_path(self.output_dir, article.get_absolute_url())))
+
+        article.publication = BaseArticle.DRAFT
+        article.save()
+        self._freeze(incremental=True)
+        self.assertFalse(os.path.exists(get_file_path(self.output_dir, article.get_absolute_url())))
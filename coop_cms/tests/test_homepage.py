@@ -17,10 +17,11 @@ from model_mommy import mommy
 from colorbox.utils import assert_popup_redirects
 
 from coop_cms.context_processors import homepage_url
-from coop_cms.models import BaseArticle, SiteSettings
+from coop_cms.models import BaseArticle, get_homepage_article, SiteSettings
 from coop_cms.settings import get_article_class
 from coop_cms.shortcuts import get_headlines
 from coop_cms.tests import BaseTestCase, UserBaseTestCase, BeautifulSoup
+from coop_cms.utils import RequestManager
 
 
 @override_settings(COOP_CMS_NO_HOMEPAGE=False)
@@ -663,3 +664,45 @@ class HomepageDirectTest(UserBaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, article.title)
         self.assertContains(response, article.content)
+
+
+@override_settings(COOP_CMS_NO_HOMEPAGE=False, COOP_CMS_HOMEPAGE_NO_REDIRECTION=True)
+class SiteSettingsTest(BaseTestCase):
+    """Site settings are loaded once by request"""
+
+    def setUp(self):
+        super(SiteSettingsTest, self).setUp()
+        request = RequestFactory().get('/')
+        RequestManager().set_request(request)
+
+    def tearDown(self):
+        RequestManager().clean()
+        super(SiteSettingsTest, self).tearDown()
+
+    def test_is_homepage_no_site_settings(self):
+        article = get_article_class().objects.create(title="test", publication=BaseArticle.PUBLISHED)
+        self.assertFalse(article.is_homepage)
+        self.assertEqual(SiteSettings.objects.count(), 0)
+
+    def test_site_settings_loaded_once(self):
+        site = Site.objects.get(id=settings.SITE_ID)
+        article1 = get_article_class().objects.create(title="python", publication=BaseArticle.PUBLISHED)
+        article2 = get_article_class().objects.create(title="django", publication=BaseArticle.PUBLISHED)
+        SiteSettings.objects.create(site=site, homepage_article=article1.slug)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(article1.get_absolute_url(), reverse('coop_cms_homepage'))
+            self.assertEqual(article2.get_absolute_url(), reverse('coop_cms_view_article', args=[article2.slug]))
+            self.assertEqual(get_homepage_article(), article1.slug)
+
+    def test_site_settings_saved(self):
+        site = Site.objects.get(id=settings.SITE_ID)
+        article1 = get_article_class().objects.create(title="python", publication=BaseArticle.PUBLISHED)
+        article2 = get_article_class().objects.create(title="django", publication=BaseArticle.PUBLISHED)
+        site_settings = SiteSettings.objects.create(site=site, homepage_article=article1.slug)
+        self.assertTrue(article1.is_homepage)
+
+        site_settings.homepage_article = article2.slug
+        site_settings.save()
+        self.assertFalse(article1.is_homepage)
+        self.assertTrue(article2.is_homepage)
@@ -2,23 +2,32 @@
 
 from __future__ import unicode_literals
 
+import json
+
 from django.conf import settings
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core import management
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
 try:
     from django.urls import reverse
 except:
     from django.core.urlresolvers import reverse
 from django.template import Template, Context
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
 
 from model_mommy import mommy
 
-from coop_cms.models import Link, NavNode, NavType, BaseArticle
+from coop_cms.models import compact_nodes_ordering, Link, NavNode, NavTreeSnapshot, NavType, BaseArticle
 from coop_cms.moves import get_response_json
 from coop_cms.settings import get_article_class, get_navtree_class
 from coop_cms.tests import BaseTestCase, BeautifulSoup
-from coop_cms.utils import get_model_app, get_model_name
+from coop_cms.utils import get_cache_version, get_model_app, get_model_name
+from coop_cms.views.navigation import get_navnode_children, get_suggest_list
 
 
 def _create_link(url, title=""):
@@ -325,6 +334,48 @@ class NavigationTest(BaseTestCase):
             self.assertTrue(node in nodes)
             self.assertTrue(i+1, node.ordering)
 
+    def test_delete_node_compact_ordering(self):
+        urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
+        links = [_create_link(url=url) for url in urls]
+
+        nodes = []
+        for i, link in enumerate(links):
+            nodes.append(
+                NavNode.objects.create(tree=self.tree, label=link.url, content_object=link, ordering=i+1, parent=None)
+            )
+
+        self._log_as_editor()
+
+        data = {
+            'msg_id': 'remove_navnode',
+            'node_ids': nodes[1].id,
+        }
+        response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        result = get_response_json(response)
+        self.assertEqual(result['status'], 'success')
+
+        nodes_after = NavNode.objects.all().order_by('ordering')
+        self.assertEqual([nodes[0].id, nodes[2].id, nodes[3].id], [node.id for node in nodes_after])
+        self.assertEqual([1, 2, 3], [node.ordering for node in nodes_after])
+
+    def test_compact_nodes_ordering(self):
+        urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
+        links = [_create_link(url=url) for url in urls]
+        orderings = (5, 2, 9, 2)
+        nodes = [
+            NavNode.objects.create(tree=self.tree, label=link.url, content_object=link, ordering=ordering, parent=None)
+            for (link, ordering) in zip(links, orderings)
+        ]
+        child = NavNode.objects.create(tree=self.tree, label="child", ordering=7, parent=nodes[0])
+
+        with self.assertNumQueries(2):
+            compact_nodes_ordering(self.tree, None)
+
+        nodes = [NavNode.objects.get(id=node.id) for node in nodes]
+        self.assertEqual([3, 1, 4, 2], [node.ordering for node in nodes])
+        self.assertEqual(NavNode.objects.get(id=child.id).ordering, 7)
+
     def test_delete_node_and_children(self):
         urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
         links = [_create_link(url=url) for url in urls]
@@ -359,6 +410,194 @@ class NavigationTest(BaseTestCase):
             self.assertTrue(node in nodes)
             self.assertTrue(i + 1, node.ordering)
 
+    def test_batch_operations(self):
+        urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr")
+        links = [_create_link(url=url) for url in urls]
+
+        nodes = []
+        for i, link in enumerate(links):
+            nodes.append(NavNode.objects.create(
+                tree=self.tree, label=link.url, content_object=link, ordering=i+1, parent=None)
+            )
+
+        self._log_as_editor()
+
+        operations = [
+            {'msg_id': 'rename_navnode', 'node_id': nodes[0].id, 'name': 'Google'},
+            {'msg_id': 'move_navnode', 'node_id': nodes[2].id, 'ref_id': nodes[0].id, 'ref_pos': 'before'},
+            {'msg_id': 'move_navnode', 'node_id': nodes[1].id, 'parent_id': nodes[0].id, 'ref_pos': 'inside'},
+            {'msg_id': 'navnode_in_navigation', 'node_id': nodes[1].id},
+        ]
+        data = {
+            'msg_id': 'batch_navnodes',
+            'operations': json.dumps(operations),
+        }
+        response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        result = get_response_json(response)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(
+            [operation['msg_id'] for operation in operations],
+            [operation_result['msg_id'] for operation_result in result['results']]
+        )
+        self.assertEqual(result['results'][3]['icon'], 'out_nav')
+
+        nodes = [NavNode.objects.get(id=node.id) for node in nodes]
+        self.assertEqual(nodes[0].label, 'Google')
+        self.assertEqual([2, 1, 1], [node.ordering for node in nodes])
+        self.assertEqual([None, nodes[0].id, None], [node.parent_id for node in nodes])
+        self.assertEqual([True, False, True], [node.in_navigation for node in nodes])
+
+    def test_batch_operations_error(self):
+        urls = ("http://www.google.fr", "http://www.python.org")
+        links = [_create_link(url=url) for url in urls]
+
+        nodes = []
+        for i, link in enumerate(links):
+            nodes.append(NavNode.objects.create(
+                tree=self.tree, label=link.url, content_object=link, ordering=i+1, parent=None)
+            )
+
+        self._log_as_editor()
+
+        operations = [
+            {'msg_id': 'rename_navnode', 'node_id': nodes[0].id, 'name': 'Google'},
+            {'msg_id': 'remove_navnode', 'node_ids': nodes[1].id},
+            {'msg_id': 'rename_navnode', 'node_id': nodes[1].id, 'name': 'Python'},
+        ]
+        data = {
+            'msg_id': 'batch_navnodes',
+            'operations': json.dumps(operations),
+        }
+        response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        result = get_response_json(response)
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(result['index'], 2)
+
+        # nothing has been done
+        nodes_after = NavNode.objects.all().order_by('ordering')
+        self.assertEqual([node.id for node in nodes], [node.id for node in nodes_after])
+        self.assertEqual([link.url for link in links], [node.label for node in nodes_after])
+
+    def test_batch_operations_missing_field(self):
+        link = _create_link(url="http://www.google.fr")
+        node = NavNode.objects.create(tree=self.tree, label=link.url, content_object=link, ordering=1, parent=None)
+
+        self._log_as_editor()
+
+        operations = [
+            {'msg_id': 'rename_navnode', 'node_id': node.id, 'name': 'Google'},
+            {'msg_id': 'navnode_in_navigation'},
+        ]
+        data = {
+            'msg_id': 'batch_navnodes',
+            'operations': json.dumps(operations),
+        }
+        response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        result = get_response_json(response)
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(result['index'], 1)
+        self.assertEqual(result['field'], 'node_id')
+        self.assertEqual(NavNode.objects.get(id=node.id).label, link.url)
+
+    def test_batch_operations_invalid_operation(self):
+        self._log_as_editor()
+
+        for operations in ([['rename_navnode']], [{'msg_id': 'view_navnode', 'node_id': 1}]):
+            data = {
+                'msg_id': 'batch_navnodes',
+                'operations': json.dumps(operations),
+            }
+            response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(response.status_code, 400)
+            result = get_response_json(response)
+            self.assertEqual(result['status'], 'error')
+            self.assertEqual(result['index'], 0)
+
+    def test_batch_operations_not_allowed(self):
+        link = _create_link(url="http://www.google.fr")
+        node = NavNode.objects.create(tree=self.tree, label=link.url, content_object=link, ordering=1, parent=None)
+
+        self._log_as_staff()
+
+        operations = [
+            {'msg_id': 'rename_navnode', 'node_id': node.id, 'name': 'Google'},
+        ]
+        data = {
+            'msg_id': 'batch_navnodes',
+            'operations': json.dumps(operations),
+        }
+        response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        result = get_response_json(response)
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(NavNode.objects.get(id=node.id).label, link.url)
+
+    def test_get_navnode_children(self):
+        urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
+        links = [_create_link(url=url) for url in urls]
+
+        root1 = NavNode.objects.create(
+            tree=self.tree, label=links[0].url, content_object=links[0], ordering=1, parent=None
+        )
+        root2 = NavNode.objects.create(tree=self.tree, label="empty", ordering=2, parent=None)
+        child1 = NavNode.objects.create(
+            tree=self.tree, label=links[1].url, content_object=links[1], ordering=1, parent=root2
+        )
+        child2 = NavNode.objects.create(
+            tree=self.tree, label=links[2].url, content_object=links[2], ordering=2, parent=root2,
+            in_navigation=False
+        )
+        NavNode.objects.create(tree=self.tree, label=links[3].url, content_object=links[3], ordering=1, parent=child2)
+
+        self._log_as_editor()
+
+        data = {
+            'msg_id': 'get_navnode_children',
+        }
+        response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        result = get_response_json(response)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(
+            ['node_{0}'.format(root1.id), 'node_{0}'.format(root2.id)],
+            [node['attr']['id'] for node in result['nodes']]
+        )
+        self.assertEqual(['in_nav', 'in_nav'], [node['attr']['rel'] for node in result['nodes']])
+        self.assertEqual([0, 2], [node['metadata']['children_count'] for node in result['nodes']])
+        self.assertEqual(None, result['nodes'][0].get('state'))
+        self.assertEqual('closed', result['nodes'][1]['state'])
+        self.assertEqual(links[0].url, result['nodes'][0]['data']['attr']['href'])
+
+        data = {
+            'msg_id': 'get_navnode_children',
+            'parent_id': root2.id,
+        }
+        response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        result = get_response_json(response)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(
+            ['node_{0}'.format(child1.id), 'node_{0}'.format(child2.id)],
+            [node['attr']['id'] for node in result['nodes']]
+        )
+        self.assertEqual(['in_nav', 'out_nav'], [node['attr']['rel'] for node in result['nodes']])
+        self.assertEqual([0, 1], [node['metadata']['children_count'] for node in result['nodes']])
+
+    def test_get_navnode_children_number_of_queries(self):
+        urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
+        for i, url in enumerate(urls):
+            link = _create_link(url=url)
+            NavNode.objects.create(tree=self.tree, label=link.url, content_object=link, ordering=i + 1, parent=None)
+
+        request = RequestFactory().post(self.srv_url, data={})
+        # nodes, links and sites of links
+        with self.assertNumQueries(3):
+            result = get_navnode_children(request, self.tree)
+        self.assertEqual(len(urls), len(result['nodes']))
+
     def test_rename_node(self):
         urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
         links = [_create_link(url=url) for url in urls]
@@ -469,6 +708,75 @@ class NavigationTest(BaseTestCase):
         self.assertEqual(result['status'], 'success')
         self.assertEqual(len(result['suggestions']), 3) #2 + noeud vide
 
+    @override_settings(COOP_CMS_NAVIGATION_SUGGESTIONS_LIMIT=2)
+    def test_get_suggest_list_limit(self):
+        urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
+        links = [_create_link(url=url, title=url) for url in urls]
+
+        self._log_as_editor()
+
+        data = {
+            'msg_id': 'get_suggest_list',
+            'term': '.fr'
+        }
+        response = self.client.post(self.srv_url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        result = get_response_json(response)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(len(result['suggestions']), 3) #2 + noeud vide
+        # the first ones in the order of the search field
+        self.assertEqual(
+            [suggestion['label'] for suggestion in result['suggestions'][:-1]],
+            ["http://www.apidev.fr", "http://www.google.fr"]
+        )
+
+    @override_settings(COOP_CMS_NAVIGATION_SUGGESTIONS_LIMIT=2)
+    def test_get_suggest_list_limit_no_search_field(self):
+        nav_type = NavType.objects.get(content_type=self.url_ct)
+        nav_type.search_field = ''
+        nav_type.label_rule = NavType.LABEL_USE_UNICODE
+        nav_type.save()
+        urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
+        links = [_create_link(url=url, title=url) for url in urls]
+
+        request = RequestFactory().post(self.srv_url, data={'term': '.fr'})
+        result = get_suggest_list(request, self.tree)
+        # the first ones in the order of creation
+        self.assertEqual(
+            [suggestion['value'] for suggestion in result['suggestions'][:-1]], [links[0].id, links[2].id]
+        )
+
+    def test_get_suggest_list_get_label_with_search_field(self):
+        nav_type = NavType.objects.get(content_type=self.url_ct)
+        nav_type.search_field = 'url'
+        nav_type.label_rule = NavType.LABEL_USE_GET_LABEL
+        nav_type.save()
+        urls = ("http://www.google.fr", "http://www.python.org")
+        links = [_create_link(url=url, title=url) for url in urls]
+
+        # the term is searched in the label : not in the search field
+        request = RequestFactory().post(self.srv_url, data={'term': 'http'})
+        result = get_suggest_list(request, self.tree)
+        self.assertEqual(len(result['suggestions']), 1)  # noeud vide
+
+        request = RequestFactory().post(self.srv_url, data={'term': 'www.python'})
+        result = get_suggest_list(request, self.tree)
+        self.assertEqual([suggestion['value'] for suggestion in result['suggestions'][:-1]], [links[1].id])
+
+    def test_get_suggest_list_number_of_queries(self):
+        urls = ("http://www.google.fr", "http://www.python.org", "http://www.quinode.fr", "http://www.apidev.fr")
+        links = [_create_link(url=url, title=url) for url in urls]
+        NavNode.objects.create(tree=self.tree, label=links[0].url, content_object=links[0], ordering=1, parent=None)
+
+        request = RequestFactory().post(self.srv_url, data={'term': '.fr'})
+        # tree types, all types, links not in navigation
+        with self.assertNumQueries(3):
+            result = get_suggest_list(request, self.tree)
+        self.assertEqual(
+            sorted([suggestion['label'] for suggestion in result['suggestions'][:-1]]),
+            sorted([links[2].url, links[3].url])
+        )
+
     def test_get_suggest_empty_node(self):
         self._log_as_editor()
 
@@ -1230,6 +1538,98 @@ class TemplateTagsTest(BaseTestCase):
         self.assertTrue(html.find(self.nodes[4].get_absolute_url()) < 0)
         self.assertTrue(html.find(self.nodes[5].get_absolute_url()) < 0)
 
+    def test_navigation_missing_tree(self):
+        """the tree is not created when rendering: the navigation is empty"""
+        tpl = Template('{% load coop_navigation %}{% navigation_as_nested_ul tree=missing %}')
+        context = Context({})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(tpl.render(context), '')
+        self.assertEqual([], [query for query in queries if not query['sql'].startswith('SELECT')])
+        self.assertEqual(get_navtree_class().objects.filter(name='missing').count(), 0)
+        self.assertEqual(context.get('coop_cms_navtrees'), None)
+
+        # The tree is found once created
+        tree = get_navtree_class().objects.create(name='missing')
+        link = _create_link(url='http://www.missing.fr')
+        NavNode.objects.create(tree=tree, label=link.url, content_object=link, ordering=1, parent=None)
+        context = Context({})
+        self.assertTrue(tpl.render(context).find(link.url) >= 0)
+        self.assertEqual([navtree.id for navtree in context.get('coop_cms_navtrees')], [tree.id])
+
+    def test_navigation_tree_id_cached(self):
+        """the tree is not get again"""
+        tpl = Template('{% load coop_navigation %}{%navigation_as_nested_ul%}')
+        tpl.render(Context({}))
+        # nodes, links and sites of links
+        with self.assertNumQueries(3):
+            tpl.render(Context({}))
+
+    def test_navigation_tree_renamed(self):
+        """the tree is get again if renamed"""
+        tpl = Template('{% load coop_navigation %}{% navigation_as_nested_ul tree=menu %}')
+        self.assertEqual(tpl.render(Context({})), '')
+        self.tree.name = 'menu'
+        self.tree.save()
+        self.assertTrue(tpl.render(Context({})).find(self.nodes[0].content_object.url) >= 0)
+
+    def test_create_navtrees(self):
+        """the trees of the navigation tags of the templates are created by a command"""
+        navtree_class = get_navtree_class()
+        navtree_class.objects.all().delete()
+        management.call_command('create_navtrees', verbosity=0)
+        self.assertEqual(navtree_class.objects.filter(name='default').count(), 1)
+        self.assertEqual(navtree_class.objects.filter(name='li_nav_node_menu').count(), 1)
+
+        count = navtree_class.objects.count()
+        management.call_command('create_navtrees', verbosity=0)
+        self.assertEqual(navtree_class.objects.count(), count)
+
+    def test_snapshot_single_query(self):
+        """all the nodes of the tree are loaded with a single query"""
+        # nodes, links and sites of links
+        with self.assertNumQueries(3):
+            snapshot = NavTreeSnapshot(self.tree)
+            root_nodes = snapshot.get_children(None, allow_all=True)
+            children = snapshot.get_children(root_nodes[2], allow_all=True)
+            grand_children = children[0].get_children(allow_all=True)
+            self.assertEqual([node.id for node in root_nodes], [node.id for node in self.nodes[:3]])
+            self.assertEqual([node.id for node in children], [self.nodes[3].id])
+            self.assertEqual([node.id for node in grand_children], [node.id for node in self.nodes[4:]])
+            self.assertEqual(grand_children[0].parent.parent.id, self.nodes[2].id)
+
+    def test_snapshot_content_objects(self):
+        """content objects and their sites are loaded with a single query by model"""
+        snapshot = NavTreeSnapshot(self.tree)
+        with self.assertNumQueries(0):
+            for node in snapshot.get_nodes():
+                self.assertEqual(node.content_object.url, node.label)
+                self.assertTrue(node.is_accessible())
+
+    def test_navigation_number_of_queries(self):
+        """the number of queries doesn't depend on the number of nodes"""
+        tpl = Template('{% load coop_navigation %}{%navigation_as_nested_ul%}')
+        # tree, nodes, links and sites of links
+        with self.assertNumQueries(4):
+            html = tpl.render(Context({}))
+        for node in self.nodes:
+            self.assertTrue(html.find(node.content_object.url) >= 0)
+
+    def test_snapshot_siblings(self):
+        """siblings are read from the snapshot"""
+        self.nodes[1].in_navigation = False
+        self.nodes[1].save()
+        snapshot = NavTreeSnapshot(self.tree.name)
+        node = snapshot.get_node(self.nodes[0].id)
+        siblings = node.get_siblings(in_navigation=True)
+        self.assertEqual([sibling.id for sibling in siblings], [self.nodes[0].id, self.nodes[2].id])
+
+    def test_snapshot_nodes_for_object(self):
+        """find the nodes of an object"""
+        snapshot = NavTreeSnapshot(self.tree)
+        nodes = snapshot.get_nodes_for_object(self.nodes[4].content_object)
+        self.assertEqual([node.id for node in nodes], [self.nodes[4].id])
+        self.assertEqual(snapshot.get_nodes_for_object(_create_link(url='http://www.tata.fr')), [])
+
 
 class NavigationTreeBaseTest(BaseTestCase):
     """Base class for navigation tree"""
@@ -1512,3 +1912,253 @@ class NavigationLiNodeTest(NavigationTreeBaseTest):
         li_node = li_nodes[0]
         # image name is the slug of the label
         self.assertEqual(li_node['href'], article1.get_absolute_url())
+
+
+class NavNodePathTest(BaseTestCase):
+    """the path of ancestors is stored in every node"""
+
+    def setUp(self):
+        super(NavNodePathTest, self).setUp()
+        self.tree = get_navtree_class().objects.create()
+        self.root = NavNode.objects.create(tree=self.tree, label="root", ordering=1, parent=None)
+        self.child = NavNode.objects.create(tree=self.tree, label="child", ordering=1, parent=self.root)
+        self.grand_child = NavNode.objects.create(tree=self.tree, label="grand-child", ordering=1, parent=self.child)
+        self.other_root = NavNode.objects.create(tree=self.tree, label="other", ordering=2, parent=None)
+
+    def test_path(self):
+        """path contains the ids of the ancestors"""
+        self.assertEqual(self.root.path, '/')
+        self.assertEqual(self.child.path, '/{0}/'.format(self.root.id))
+        self.assertEqual(self.grand_child.path, '/{0}/{1}/'.format(self.root.id, self.child.id))
+        self.assertEqual(self.grand_child.get_depth(), 2)
+
+    def test_ancestors(self):
+        """ancestors are loaded with a single query"""
+        grand_child = NavNode.objects.get(id=self.grand_child.id)
+        with self.assertNumQueries(1):
+            ancestors = grand_child.get_ancestors()
+        self.assertEqual(ancestors, [self.root, self.child])
+        self.assertEqual(self.root.get_ancestors(), [])
+
+    def test_descendants(self):
+        """descendants are loaded with a single query"""
+        with self.assertNumQueries(1):
+            descendants = list(self.root.get_descendants().order_by('id'))
+        self.assertEqual(descendants, [self.child, self.grand_child])
+        with self.assertNumQueries(1):
+            progeny = self.root.get_progeny()
+        self.assertEqual(progeny, [(self.root, 0), (self.child, 1), (self.grand_child, 2)])
+
+    def test_move_update_descendants(self):
+        """the path of the descendants is updated when a node moves"""
+        child = NavNode.objects.get(id=self.child.id)
+        child.parent = self.other_root
+        child.save()
+        grand_child = NavNode.objects.get(id=self.grand_child.id)
+        self.assertEqual(grand_child.path, '/{0}/{1}/'.format(self.other_root.id, self.child.id))
+        self.assertEqual(list(self.root.get_descendants()), [])
+
+    def test_move_to_root_update_descendants(self):
+        """the path of the descendants is updated when a node becomes a root node"""
+        child = NavNode.objects.get(id=self.child.id)
+        child.parent = None
+        child.save()
+        grand_child = NavNode.objects.get(id=self.grand_child.id)
+        self.assertEqual(grand_child.path, '/{0}/'.format(self.child.id))
+
+    def test_check_cycles(self):
+        """a node can not be moved under its own descendants"""
+        self.assertRaises(ValidationError, self.root.check_new_navigation_parent, self.grand_child.id)
+        self.assertRaises(ValidationError, self.root.check_new_navigation_parent, self.root.id)
+        self.root.check_new_navigation_parent(self.other_root.id)
+
+
+@override_settings(
+    COOP_CMS_NAVIGATION_CACHE=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class NavigationCacheTest(NavigationTreeBaseTest):
+    """The html of the navigation is cached"""
+
+    def setUp(self):
+        super(NavigationCacheTest, self).setUp()
+        cache.clear()
+        self.articles = []
+        self.nodes = []
+        for title in ('test1', 'test2'):
+            article = mommy.make(get_article_class(), title=title, publication=BaseArticle.PUBLISHED)
+            article.sites.add(Site.objects.get_current())
+            article.save()
+            self.articles.append(article)
+            self.nodes.append(
+                NavNode.objects.create(tree=self.default_tree, label=title, content_object=article, parent=None)
+            )
+
+    def tearDown(self):
+        cache.clear()
+        super(NavigationCacheTest, self).tearDown()
+
+    def test_render_cached(self):
+        """the tree is not loaded again"""
+        tpl = Template('{% load coop_navigation %}{%navigation_as_nested_ul%}')
+        html = tpl.render(Context({}))
+        with self.assertNumQueries(0):
+            self.assertEqual(tpl.render(Context({})), html)
+
+    def test_node_saved(self):
+        """the cache is invalidated when a node is modified"""
+        tpl = Template('{% load coop_navigation %}{%navigation_as_nested_ul%}')
+        html = tpl.render(Context({}))
+        self.assertTrue(html.find('test2') >= 0)
+        self.nodes[1].in_navigation = False
+        self.nodes[1].save()
+        html = tpl.render(Context({}))
+        self.assertTrue(html.find('test1') >= 0)
+        self.assertTrue(html.find('test2') < 0)
+
+    def test_content_object_saved(self):
+        """the cache is invalidated when an object of the navigation is modified"""
+        tpl = Template('{% load coop_navigation %}{%navigation_as_nested_ul%}')
+        tpl.render(Context({}))
+        self.articles[1].publication = BaseArticle.ARCHIVED
+        self.articles[1].save()
+        html = tpl.render(Context({}))
+        self.assertTrue(html.find(self.articles[0].get_absolute_url()) >= 0)
+        self.assertTrue(html.find(self.articles[1].get_absolute_url()) < 0)
+
+    def test_content_object_sites_changed(self):
+        """the cache is invalidated when an object of the navigation is removed from the site"""
+        tpl = Template('{% load coop_navigation %}{%navigation_as_nested_ul%}')
+        tpl.render(Context({}))
+        self.articles[1].sites.remove(Site.objects.get_current())
+        html = tpl.render(Context({}))
+        self.assertTrue(html.find(self.articles[0].get_absolute_url()) >= 0)
+        self.assertTrue(html.find(self.articles[1].get_absolute_url()) < 0)
+
+    def test_not_navigable_object_saved(self):
+        """the objects whose type is not navigable don't change the navigation"""
+        NavType.objects.filter(content_type=ContentType.objects.get_for_model(get_article_class())).delete()
+        version = get_cache_version('navigation')
+        self.articles[0].save()
+        self.assertEqual(version, get_cache_version('navigation'))
+
+    @override_settings(COOP_CMS_NAVIGATION_CACHE=False)
+    def test_cache_disabled(self):
+        """the navigation version is not changed when an object is saved if no cache depends on it"""
+        version = get_cache_version('navigation')
+        with CaptureQueriesContext(connection) as queries:
+            self.articles[0].save()
+        self.assertEqual([], [query for query in queries if 'coop_cms_navnode' in query['sql']])
+        self.assertEqual(version, get_cache_version('navigation'))
+
+    def test_active_node(self):
+        """the active node is set for the current page even if the html is cached"""
+        for article in self.articles:
+            response = self.client.get(article.get_absolute_url())
+            self.assertEqual(200, response.status_code)
+            soup = BeautifulSoup(response.content)
+            li_nodes = soup.select('ul.nav li a')
+            self.assertEqual(2, len(li_nodes))
+            li_nodes = soup.select('ul.nav li.active-node a')
+            self.assertEqual(1, len(li_nodes))
+            self.assertEqual(li_nodes[0]['href'], article.get_absolute_url())
+
+
+class NavigationJsonTest(BaseTestCase):
+    """The navigation as json"""
+
+    def setUp(self):
+        super(NavigationJsonTest, self).setUp()
+        self.tree = get_navtree_class().objects.create(name="menu")
+        link1 = _create_link(url='http://www.google.fr')
+        link2 = _create_link(url='/python/')
+        self.root = NavNode.objects.create(tree=self.tree, label="Google", content_object=link1, parent=None)
+        self.child = NavNode.objects.create(
+            tree=self.tree, label="Python", content_object=link2, parent=self.root, ordering=1
+        )
+        article = mommy.make(get_article_class(), title="draft", publication=BaseArticle.DRAFT)
+        article.sites.add(Site.objects.get_current())
+        self.draft = NavNode.objects.create(
+            tree=self.tree, label="Draft", content_object=article, parent=self.root, ordering=2
+        )
+        NavNode.objects.create(tree=self.tree, label="Hidden", parent=None, in_navigation=False)
+        self.url = reverse('coop_cms_navigation_json', args=[self.tree.name])
+
+    def _log_as_editor(self):
+        editor = User.objects.create_user('toto', 'toto@toto.fr', 'toto')
+        tree_class = get_navtree_class()
+        can_edit_tree = Permission.objects.get(
+            content_type__app_label=get_model_app(tree_class),
+            codename='change_{0}'.format(get_model_name(tree_class))
+        )
+        editor.user_permissions.add(can_edit_tree)
+        self.assertTrue(self.client.login(username='toto', password='toto'))
+
+    def test_view_json(self):
+        """the nodes which can not be accessed are not sent to the visitors"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        result = get_response_json(response)
+        self.assertEqual(result['tree'], self.tree.name)
+        self.assertEqual(len(result['nodes']), 1)
+        root = result['nodes'][0]
+        self.assertEqual(root['label'], 'Google')
+        self.assertEqual(root['url'], 'http://www.google.fr')
+        self.assertEqual(root['external'], True)
+        self.assertEqual(root['accessible'], True)
+        self.assertEqual(['Python'], [child['label'] for child in root['children']])
+        self.assertEqual([False], [child['external'] for child in root['children']])
+        self.assertEqual([True], [child['accessible'] for child in root['children']])
+        self.assertNotContains(response, "Draft")
+        self.assertNotContains(response, self.draft.get_absolute_url())
+
+    def test_view_json_editor(self):
+        """the nodes which can not be accessed are sent to the editors of the navigation"""
+        self._log_as_editor()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        root = get_response_json(response)['nodes'][0]
+        self.assertEqual(['Python', 'Draft'], [child['label'] for child in root['children']])
+        self.assertEqual([True, False], [child['accessible'] for child in root['children']])
+
+    @override_settings(COOP_CMS_NAVIGATION_CACHE=True)
+    def test_view_json_etag_editor(self):
+        """the json of the editors is not the one of the other authenticated users"""
+        User.objects.create_user('titi', 'titi@titi.fr', 'titi')
+        self.assertTrue(self.client.login(username='titi', password='titi'))
+        response = self.client.get(self.url)
+        self.assertNotContains(response, "Draft")
+        etag = response['ETag']
+
+        self._log_as_editor()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Draft")
+
+    @override_settings(COOP_CMS_NAVIGATION_CACHE=True)
+    def test_view_json_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.child.label = "Snake"
+        self.child.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etag, response['ETag'])
+        result = get_response_json(response)
+        self.assertEqual('Snake', result['nodes'][0]['children'][0]['label'])
+
+    def test_view_json_no_etag(self):
+        """the changes of the objects are not tracked if no navigation cache is enabled"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_view_json_unknown_tree(self):
+        url = reverse('coop_cms_navigation_json', args=['unknown'])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
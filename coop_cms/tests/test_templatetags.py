@@ -10,12 +10,17 @@ from django.conf import settings
 from django.contrib.auth.models import User, Permission, AnonymousUser
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core import management
+from django.core.cache import cache
+from django.db import connection
 try:
     from django.urls import reverse
 except:
     from django.core.urlresolvers import reverse
 from django.template import Template, Context
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import translation
 
 from model_mommy import mommy
 
@@ -96,6 +101,19 @@ class CmsEditTagTest(BaseTestCase):
         self.assertContains(response, article.content)
         self.assertContains(response, self.link1.url)
 
+    def test_cms_edit_tag_context(self):
+        """the variables defined in cms_edit template tag are not kept: the page context is not modified"""
+        article = self._create_article()
+        tpl = Template(
+            '{% load coop_edition %}{% cms_edit article %}{% now "Y" as year %}'
+            '{% with title=article.title %}[{{ title }}]{% endwith %}({{ year }}){% end_cms_edit %}<{{ year }}>'
+        )
+        context = Context({'article': article})
+        html = tpl.render(context)
+        self.assertEqual(html, "[test]()<>")
+        self.assertEqual(context.get('article'), article)
+        self.assertEqual(context.get('year'), None)
+
 
 class ArticleTemplateTagsTest(BaseTestCase):
     """Tes article related tags"""
@@ -214,6 +232,56 @@ class ArticleTemplateTagsTest(BaseTestCase):
         self.assertEqual(article.slug, "test")
         self.assertEqual(getattr(article, "slug_"+cur_lang), "test_"+cur_lang)
 
+    @override_settings(COOP_CMS_ARTICLE_LINK_AUTOCREATE=False)
+    def test_link_no_autocreate(self):
+        """text article_link tag doesn't create the article"""
+        tpl = Template('{% load coop_utils %}{% article_link "test" %}')
+        html = tpl.render(Context({'request': self._request()}))
+        self.assertEqual(html, "")
+        self.assertEqual(get_article_class().objects.count(), 0)
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, COOP_CMS_CACHE=True,
+        COOP_CMS_ARTICLE_LINK_AUTOCREATE=False
+    )
+    def test_link_cache(self):
+        """text article_link tag url is cached until an article is modified"""
+        cache.clear()
+        article = get_article_class().objects.create(slug="test", title="Test")
+        tpl = Template('{% load coop_utils %}{% article_link "test" %}')
+        html = tpl.render(Context({'request': self._request()}))
+        self.assertEqual(html, article.get_absolute_url())
+
+        with CaptureQueriesContext(connection) as queries:
+            html = tpl.render(Context({'request': self._request()}))
+        self.assertEqual(html, article.get_absolute_url())
+        self.assertEqual(len(queries), 0)
+
+        article.delete()
+        html = tpl.render(Context({'request': self._request()}))
+        self.assertEqual(html, "")
+        cache.clear()
+
+    def test_create_article_links(self):
+        """the articles of the article_link tags of the templates are created by a command"""
+        article_class = get_article_class()
+        management.call_command('create_article_links', verbosity=0)
+        self.assertEqual(article_class.objects.filter(slug="terms-of-use").count(), 1)
+
+        count = article_class.objects.count()
+        management.call_command('create_article_links', verbosity=0)
+        self.assertEqual(article_class.objects.count(), count)
+
+    @override_settings(LANGUAGE_CODE='fr', COOP_CMS_ARTICLE_LINK_AUTOCREATE=False)
+    def test_create_article_links_language(self):
+        """the articles are created in the language used by the tag when rendered"""
+        management.call_command('create_article_links', verbosity=0)
+        # without request, the tag uses the 1st language
+        with translation.override(settings.LANGUAGES[0][0]):
+            article = get_article_class().objects.get(slug="terms-of-use")
+            tpl = Template('{% load coop_utils %}{% article_link "Terms of use" %}')
+            self.assertEqual(tpl.render(Context({})), article.get_absolute_url())
+
 
 class PartitionTemplateFilterTest(BaseTestCase):
     """test get_part template tags"""
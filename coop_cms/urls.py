@@ -43,6 +43,7 @@ urlpatterns = [
     url(r'^cms/new/link/$', links.new_link, name="coop_cms_new_link"),
 
     url(r'^cms/tree/(?P<tree_id>\d*)/$', navigation.process_nav_edition, name='navigation_tree'),
+    url(r'^cms/navigation/(?P<tree_name>[-\w]+)/json/$', navigation.navigation_json, name='coop_cms_navigation_json'),
 
     url(r'^cms/newsletter/new/$', newsletters.newsletter_settings, name='coop_cms_new_newsletter'),
     url(
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 """utils"""
 
+from .cache import (
+    acquire_cache_lock, add_cache_dependency, bump_cache_version, get_cache_version, get_cache_versions,
+    get_model_cache_tag, get_object_cache_tag, get_stale_tagged_cache, get_tagged_cache, get_visitor_class,
+    make_cache_key, release_cache_lock, set_tagged_cache, start_cache_dependencies, stop_cache_dependencies
+)
 from .emails import send_email, send_newsletter, strip_a_tags, avoid_line_too_long, make_links_absolute
 from .i18n import (
     activate_lang, get_language, get_url_in_language, redirect_to_language, make_locale_path, strip_locale_path
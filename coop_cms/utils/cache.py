@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""utils"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache
+
+from coop_cms.moves import is_authenticated
+
+
+def _get_version_key(name):
+    """the key of a version counter"""
+    return 'coop_cms-version-{0}'.format(name)
+
+
+def get_cache_version(name):
+    """
+    returns the current version of a group of cached values
+    The version is a timestamp in milliseconds: it can be used as Last-Modified date
+    """
+    key = _get_version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_cache_version(name):
+    """change the version of a group of cached values: all of them are invalidated"""
+    key = _get_version_key(name)
+    version = max(int(time.time() * 1000), (cache.get(key) or 0) + 1)
+    cache.set(key, version, None)
+    return version
+
+
+def get_visitor_class(request):
+    """returns anonymous, authenticated or staff: the content of a page may depend on it"""
+    user = getattr(request, 'user', None)
+    if user is None or not is_authenticated(user):
+        return 'anonymous'
+    if user.is_staff:
+        return 'staff'
+    return 'authenticated'
+
+
+def make_cache_key(prefix, *args):
+    """returns a key which is valid for every cache backend (no space, limited length)"""
+    raw_key = ':'.join(['{0}'.format(arg) for arg in args])
+    return 'coop_cms-{0}-{1}'.format(prefix, hashlib.md5(raw_key.encode('utf-8')).hexdigest())
+
+
+_dependencies = threading.local()
+
+
+def get_object_cache_tag(obj):
+    """the tag of the cached values depending on an object"""
+    return '{0}-{1}'.format(obj._meta.label_lower, obj.pk)
+
+
+def get_model_cache_tag(model):
+    """the tag of the cached values depending on any object of a model: lists of objects..."""
+    return model._meta.label_lower
+
+
+def start_cache_dependencies():
+    """record the tags of the objects used until stop_cache_dependencies is called"""
+    if not hasattr(_dependencies, 'stack'):
+        _dependencies.stack = []
+    _dependencies.stack.append({})
+
+
+def stop_cache_dependencies():
+    """returns the tags recorded since the matching start_cache_dependencies and their versions"""
+    return _dependencies.stack.pop()
+
+
+def add_cache_dependency(*tags):
+    """
+    the value being rendered depends on these tags
+    The version of a tag is read the first time it is used: a change made while rendering invalidates the value
+    """
+    stack = getattr(_dependencies, 'stack', [])
+    new_tags = [tag for tag in tags if any(tag not in recorded_tags for recorded_tags in stack)]
+    if new_tags:
+        versions = get_cache_versions(new_tags)
+        for recorded_tags in stack:
+            for tag in new_tags:
+                recorded_tags.setdefault(tag, versions[tag])
+
+
+def get_cache_versions(tags):
+    """returns the current version of every tag"""
+    keys = dict((_get_version_key(tag), tag) for tag in tags)
+    versions = dict((keys[key], version) for (key, version) in cache.get_many(list(keys.keys())).items())
+    for tag in tags:
+        if tag not in versions:
+            versions[tag] = get_cache_version(tag)
+    return versions
+
+
+def set_tagged_cache(key, value, tags, stale_timeout=0):
+    """
+    store a value which is invalidated when the version of one of the tags is changed
+    tags: the versions returned by stop_cache_dependencies or a list of tags for using their current version
+    The value is kept stale_timeout seconds more than the cache timeout: see get_stale_tagged_cache
+    """
+    timeout = cache.default_timeout
+    entry = {
+        'value': value,
+        'tags': dict(tags) if isinstance(tags, dict) else get_cache_versions(tags),
+        'expires': time.time() + timeout if timeout is not None else None,
+    }
+    cache.set(key, entry, timeout + stale_timeout if timeout is not None else None)
+
+
+def get_stale_tagged_cache(key):
+    """
+    returns the value stored by set_tagged_cache and True if it is invalidated or expired
+    returns None, True if it doesn't exist
+    """
+    entry = cache.get(key)
+    if not isinstance(entry, dict) or 'tags' not in entry:
+        return None, True
+    if entry.get('expires') is not None and entry['expires'] < time.time():
+        return entry['value'], True
+    tags = entry['tags']
+    keys = [_get_version_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for tag, key in zip(tags, keys):
+        if versions.get(key) != tags[tag]:
+            return entry['value'], True
+    return entry['value'], False
+
+
+def get_tagged_cache(key):
+    """returns a value stored by set_tagged_cache or None if it doesn't exist or is invalidated"""
+    value, is_stale = get_stale_tagged_cache(key)
+    return None if is_stale else value
+
+
+def acquire_cache_lock(key, timeout):
+    """returns True if the lock is free: only one process is allowed to refresh a value"""
+    return cache.add(make_cache_key('lock', key), 1, timeout)
+
+
+def release_cache_lock(key):
+    """free the lock"""
+    cache.delete(make_cache_key('lock', key))
@@ -6,12 +6,15 @@ from __future__ import unicode_literals
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
 
-def paginate(request, queryset, items_count):
+def paginate(request, queryset, items_count, count=None):
     try:
         page = int(request.GET.get('page', 0) or 0)
     except ValueError:
         page = 1
     paginator = Paginator(queryset, items_count)
+    if count is not None:
+        # The number of objects is already known: avoid a COUNT query
+        paginator.count = count
     try:
         page_obj = paginator.page(page or 1)
     except PageNotAnInteger:
@@ -4,17 +4,21 @@
 from __future__ import unicode_literals
 
 import json
+from datetime import datetime
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.messages.api import success as success_message
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
+from django.db.models import Q
 from django.http import HttpResponse, Http404, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
 from django.template import TemplateDoesNotExist
 from django.template.loader import get_template
 from django.views.generic.base import TemplateView
+from django.utils.timezone import make_aware, utc
 from django.utils.translation import ugettext as _
 from django.views.generic import View
 
@@ -28,10 +32,13 @@ from coop_cms.logger import logger
 from coop_cms.moves import reverse, is_authenticated
 from coop_cms.settings import (
     get_article_class, get_article_form, get_article_settings_form, get_new_article_form,
-    get_articles_category_page_size, homepage_no_redirection
+    get_articles_category_page_size, homepage_no_redirection, is_articles_category_keyset_pagination,
+    is_cache_enabled
 )
 from coop_cms.shortcuts import get_article_or_404, get_headlines, redirect_if_alias
-from coop_cms.utils import get_model_name, get_model_app, paginate
+from coop_cms.utils import (
+    add_cache_dependency, get_cache_version, get_model_cache_tag, get_model_name, get_model_app, make_cache_key, paginate
+)
 
 
 def get_article_template(article):
@@ -239,9 +246,24 @@ def update_logo(request, article_id):
         raise
 
 
+def _get_article_cursor(article):
+    """the position of an article in the list of a category: used for keyset pagination"""
+    return '{0}_{1}'.format(article.publication_date.strftime('%Y%m%d%H%M%S%f'), article.id)
+
+
+def _parse_article_cursor(cursor):
+    """returns publication date and id of the article of the cursor. Raise ValueError if invalid"""
+    date_value, article_id = cursor.split('_')
+    publication_date = datetime.strptime(date_value, '%Y%m%d%H%M%S%f')
+    if settings.USE_TZ:
+        publication_date = make_aware(publication_date, utc)
+    return publication_date, int(article_id)
+
+
 class ArticlesByCategoryView(TemplateView):
     """Show the articles of a given category"""
     category = None
+    keyset_pagination = None
 
     def get_category(self):
         """return the category"""
@@ -250,16 +272,46 @@ class ArticlesByCategoryView(TemplateView):
             self.category = get_object_or_404(models.ArticleCategory, slug=slug, sites__id=settings.SITE_ID)
         return self.category
 
+    def is_keyset_pagination(self):
+        """check if the pages are given by the last article of the previous one rather than by their number"""
+        if self.keyset_pagination is None:
+            return is_articles_category_keyset_pagination()
+        return self.keyset_pagination
+
+    def get_articles_count(self, category):
+        """number of published articles: cached until an article is modified if the cache is enabled"""
+        if not is_cache_enabled():
+            return self.get_articles(category).count()
+        cache_key = make_cache_key(
+            'category-count', get_cache_version('articles'), settings.SITE_ID, category.id
+        )
+        count = cache.get(cache_key)
+        if count is None:
+            count = self.get_articles(category).count()
+            cache.set(cache_key, count)
+        return count
+
     def get_articles(self, category):
-        """return list of articles for this category, 404 if no articles"""
-        articles = category.get_articles_qs().filter(
+        """return list of articles for this category"""
+        return category.get_articles_qs().filter(
             publication=models.BaseArticle.PUBLISHED
         ).order_by("-publication_date")
 
-        if articles.count() == 0:
-            raise Http404
-
-        return articles
+    def get_articles_after(self, articles, page_size):
+        """returns the articles following the cursor and the cursor of the next ones"""
+        articles = articles.order_by('-publication_date', '-id')
+        cursor = self.request.GET.get('after', '')
+        if cursor:
+            try:
+                publication_date, article_id = _parse_article_cursor(cursor)
+            except ValueError:
+                raise Http404
+            articles = articles.filter(
+                Q(publication_date__lt=publication_date) | Q(publication_date=publication_date, id__lt=article_id)
+            )
+        articles = list(articles[:page_size + 1])
+        next_cursor = _get_article_cursor(articles[page_size - 1]) if len(articles) > page_size else None
+        return articles[:page_size], next_cursor
 
     def get_context_data(self, **kwargs):
         """context"""
@@ -269,19 +321,35 @@ class ArticlesByCategoryView(TemplateView):
         if not self.request.user.has_perm('can_view_category', category):
             raise PermissionDenied()
 
+        # the page changes when an article is modified
+        add_cache_dependency(get_model_cache_tag(get_article_class()))
+        articles_count = self.get_articles_count(category)
+        if articles_count == 0:
+            raise Http404
+
         articles = self.get_articles(category)
+        page_size = get_articles_category_page_size(category)
 
-        page_obj = paginate(self.request, articles, get_articles_category_page_size(category))
+        if self.is_keyset_pagination():
+            page_obj = None
+            articles, next_cursor = self.get_articles_after(articles, page_size)
+        else:
+            page_obj = paginate(self.request, articles, page_size, count=articles_count)
+            articles, next_cursor = list(page_obj), None
 
         context_data.update({
             'category': category,
-            "articles": list(page_obj),
+            "articles": articles,
             'page_obj': page_obj,
+            'next_cursor': next_cursor,
         })
         return context_data
 
     def get_template_names(self):
         """template to use"""
+        if self.is_keyset_pagination() and self.request.is_ajax():
+            # load more: only the next articles
+            return ["coop_cms/_articles_category_items.html"]
         try:
             category_template = "coop_cms/categories/{0}.html".format(self.get_category().slug)
             get_template(category_template)
@@ -331,6 +399,13 @@ class ArticleView(EditableObjectView):
         """headline"""
         return get_headlines(self.object)
 
+    def get_conditional_tags(self):
+        """the headlines of the homepage change when any article is modified"""
+        tags = super(ArticleView, self).get_conditional_tags()
+        if self.object.is_homepage:
+            tags.append(get_model_cache_tag(self.model))
+        return tags
+
     def get_context_data(self):
         """context"""
         context_data = super(ArticleView, self).get_context_data()
@@ -4,7 +4,6 @@
 from __future__ import unicode_literals
 
 from django.contrib.auth.decorators import login_required
-from django.contrib.sites.models import Site
 from django.core.exceptions import PermissionDenied
 from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
@@ -12,10 +11,9 @@ from django.utils.translation import ugettext as _
 
 from colorbox.decorators import popup_redirect
 
-from coop_cms import models
 from coop_cms.moves import reverse
 from coop_cms.settings import cms_no_homepage, get_article_class, homepage_no_redirection, get_article_views
-from coop_cms.models import get_homepage_url, get_homepage_article
+from coop_cms.models import get_homepage_url, get_homepage_article, get_site_settings
 
 
 def homepage(request):
@@ -49,7 +47,7 @@ def set_homepage(request, article_id):
         raise PermissionDenied
 
     if request.method == "POST":
-        site_settings = models.SiteSettings.objects.get_or_create(site=Site.objects.get_current())[0]
+        site_settings = get_site_settings()
 
         if homepage_no_redirection():
             site_settings.homepage_url = ''
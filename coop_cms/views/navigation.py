@@ -5,21 +5,29 @@ from __future__ import unicode_literals
 
 import json
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
 from django.db.models.aggregates import Max
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ValidationError, PermissionDenied
-from django.http import HttpResponse, Http404
+from django.core.exceptions import ObjectDoesNotExist, ValidationError, PermissionDenied
+from django.http import HttpResponse, Http404, QueryDict
 from django.shortcuts import get_object_or_404
 from django.template import RequestContext
 from django.template.loader import select_template
+from django.utils import translation
 from django.utils.translation import ugettext as _
+from django.views.decorators.http import condition, require_safe
 
 from coop_cms import models
 from coop_cms.moves import make_context, reverse
-from coop_cms.settings import get_navtree_class
+from coop_cms.settings import get_navigation_suggestions_limit, get_navtree_class, is_navigation_version_enabled
 from coop_cms.logger import logger
-from coop_cms.utils import get_model_app, get_model_label, get_model_name
+from coop_cms.utils import (
+    get_cache_version, get_model_app, get_model_label, get_model_name, get_visitor_class,
+    make_cache_key
+)
 
 
 def view_navnode(request, tree):
@@ -29,6 +37,7 @@ def view_navnode(request, tree):
 
         node_id = request.POST['node_id']
         node = models.NavNode.objects.get(tree=tree, id=node_id)
+        models.prefetch_content_objects([node])
         model_name = object_label = ""
 
         # get the admin url
@@ -89,8 +98,12 @@ def remove_navnode(request, tree):
     # Keep multi node processing even if multi select is not allowed
     response = {}
     node_ids = request.POST['node_ids'].split(";")
-    for node_id in node_ids:
-        models.NavNode.objects.get(tree=tree, id=node_id).delete()
+    with transaction.atomic():
+        for node_id in node_ids:
+            node = models.NavNode.objects.get(tree=tree, id=node_id)
+            node.delete()
+            # fill the gap let by the removed node
+            models.compact_nodes_ordering(tree, node.parent_id)
     if len(node_ids) == 1:
         response['message'] = _("The node has been removed.")
     else:
@@ -107,87 +120,86 @@ def move_navnode(request, tree):
     parent_id = request.POST.get('parent_id', 0)
     ref_id = request.POST.get('ref_id', 0)
 
-    node = models.NavNode.objects.get(tree=tree, id=node_id)
+    with transaction.atomic():
+        node = models.NavNode.objects.select_for_update().get(tree=tree, id=node_id)
 
-    if parent_id:
-        sibling_nodes = models.NavNode.objects.filter(tree=tree, parent__id=parent_id)
-        parent_node = models.NavNode.objects.get(tree=tree, id=parent_id)
-    else:
-        sibling_nodes = models.NavNode.objects.filter(tree=tree, parent__isnull=True)
-        parent_node = None
-
-    if ref_id:
-        ref_node = models.NavNode.objects.get(tree=tree, id=ref_id)
-    else:
-        ref_node = None
-
-    # Update parent if changed
-    if parent_node != node.parent:
-        if node.parent:
-            ex_siblings = models.NavNode.objects.filter(tree=tree, parent=node.parent).exclude(id=node.id)
+        if parent_id:
+            sibling_nodes = models.NavNode.objects.filter(tree=tree, parent__id=parent_id)
+            parent_node = models.NavNode.objects.get(tree=tree, id=parent_id)
         else:
-            ex_siblings = models.NavNode.objects.filter(tree=tree, parent__isnull=True).exclude(id=node.id)
-
-        node.parent = parent_node
-
-        # restore ex-siblings
-        for sib_node in ex_siblings.filter(ordering__gt=node.ordering):
-            sib_node.ordering -= 1
-            sib_node.save()
-
-        # move siblings if inserted
-        if ref_node:
-            if ref_pos == "before":
-                to_be_moved = sibling_nodes.filter(ordering__gte=ref_node.ordering)
-                node.ordering = ref_node.ordering
-            elif ref_pos == "after":
-                to_be_moved = sibling_nodes.filter(ordering__gt=ref_node.ordering)
-                node.ordering = ref_node.ordering + 1
-            for ntbm in to_be_moved:
-                ntbm.ordering += 1
-                ntbm.save()
+            sibling_nodes = models.NavNode.objects.filter(tree=tree, parent__isnull=True)
+            parent_node = None
 
-        else:
-            # add at the end
-            max_ordering = sibling_nodes.aggregate(max_ordering=Max('ordering'))['max_ordering'] or 0
-            node.ordering = max_ordering + 1
+        # lock the siblings : concurrent moves in the same group are serialized
+        list(sibling_nodes.select_for_update().values_list('id', flat=True))
 
-    else:
+        if ref_id:
+            ref_node = models.NavNode.objects.get(tree=tree, id=ref_id)
+        else:
+            ref_node = None
 
-        # Update pos if changed
-        if ref_node:
-            if ref_node.ordering > node.ordering:
-                # move forward
-                to_be_moved = sibling_nodes.filter(ordering__lt=ref_node.ordering, ordering__gt=node.ordering)
-                for next_sibling_node in to_be_moved:
-                    next_sibling_node.ordering -= 1
-                    next_sibling_node.save()
+        # Update parent if changed
+        if parent_node != node.parent:
+            if parent_node:
+                node.check_new_navigation_parent(parent_node.id)
 
-                if ref_pos == "before":
-                    node.ordering = ref_node.ordering - 1
+            if node.parent:
+                ex_siblings = models.NavNode.objects.filter(tree=tree, parent=node.parent).exclude(id=node.id)
+            else:
+                ex_siblings = models.NavNode.objects.filter(tree=tree, parent__isnull=True).exclude(id=node.id)
 
-                elif ref_pos == "after":
-                    node.ordering = ref_node.ordering - 1
+            node.parent = parent_node
 
-            elif ref_node.ordering < node.ordering:
-                # move backward
-                to_be_moved = sibling_nodes.filter(ordering__gt=ref_node.ordering, ordering__lt=node.ordering)
-                for next_sibling_node in to_be_moved:
-                    next_sibling_node.ordering += 1
-                    next_sibling_node.save()
+            # restore ex-siblings
+            ex_siblings.select_for_update().filter(ordering__gt=node.ordering).update(ordering=F('ordering') - 1)
 
+            # move siblings if inserted
+            if ref_node:
                 if ref_pos == "before":
+                    to_be_moved = sibling_nodes.filter(ordering__gte=ref_node.ordering)
                     node.ordering = ref_node.ordering
-                    ref_node.ordering += 1
-                    ref_node.save()
                 elif ref_pos == "after":
+                    to_be_moved = sibling_nodes.filter(ordering__gt=ref_node.ordering)
                     node.ordering = ref_node.ordering + 1
+                to_be_moved.update(ordering=F('ordering') + 1)
+
+            else:
+                # add at the end
+                max_ordering = sibling_nodes.aggregate(max_ordering=Max('ordering'))['max_ordering'] or 0
+                node.ordering = max_ordering + 1
 
         else:
-            max_ordering = sibling_nodes.aggregate(max_ordering=Max('ordering'))['max_ordering'] or 0
-            node.ordering = max_ordering + 1
 
-    node.save()
+            # Update pos if changed
+            if ref_node:
+                if ref_node.ordering > node.ordering:
+                    # move forward
+                    to_be_moved = sibling_nodes.filter(ordering__lt=ref_node.ordering, ordering__gt=node.ordering)
+                    to_be_moved.update(ordering=F('ordering') - 1)
+
+                    if ref_pos == "before":
+                        node.ordering = ref_node.ordering - 1
+
+                    elif ref_pos == "after":
+                        node.ordering = ref_node.ordering - 1
+
+                elif ref_node.ordering < node.ordering:
+                    # move backward
+                    to_be_moved = sibling_nodes.filter(ordering__gt=ref_node.ordering, ordering__lt=node.ordering)
+                    to_be_moved.update(ordering=F('ordering') + 1)
+
+                    if ref_pos == "before":
+                        node.ordering = ref_node.ordering
+                        sibling_nodes.filter(id=ref_node.id).update(ordering=F('ordering') + 1)
+                    elif ref_pos == "after":
+                        node.ordering = ref_node.ordering + 1
+
+            else:
+                max_ordering = sibling_nodes.aggregate(max_ordering=Max('ordering'))['max_ordering'] or 0
+                node.ordering = max_ordering + 1
+
+        node.save()
+
     response['message'] = _("The node '{0}' has been moved.").format(node.label)
 
     return response
@@ -240,41 +252,49 @@ def get_suggest_list(request, tree):
     response = {}
     suggestions = []
     term = request.POST["term"]  # the 1st chars entered in the autocomplete
+    limit = get_navigation_suggestions_limit()
 
-    if tree.types.count() == 0:
-        nav_types = models.NavType.objects.all()
-    else:
-        nav_types = tree.types.all()
+    nav_types = list(tree.types.select_related('content_type'))
+    if not nav_types:
+        nav_types = models.NavType.objects.select_related('content_type')
 
     for nav_type in nav_types:
         content_type = nav_type.content_type
+        model_class = content_type.model_class()
+
+        # Suggest only objects which are not in navigation yet
+        already_in_navigation = models.NavNode.objects.filter(
+            tree=tree, content_type=content_type
+        ).values('object_id')
+        queryset = model_class.objects.exclude(id__in=already_in_navigation)
+
         if nav_type.label_rule == models.NavType.LABEL_USE_SEARCH_FIELD:
-            # Get the name of the default field for the current type (eg: Page->title, Url->url ...)
+            # The label is the search field: search in database. It can be indexed (ex: trigram index with PostgreSQL)
             lookup = {nav_type.search_field + '__icontains': term}
-            objects = content_type.model_class().objects.filter(**lookup)
-        elif nav_type.label_rule == models.NavType.LABEL_USE_GET_LABEL:
-            objects = [
-                obj for obj in content_type.model_class().objects.all() if term.lower() in obj.get_label().lower()
-            ]
+            objects = queryset.filter(**lookup).order_by(nav_type.search_field, 'pk')[:limit]
         else:
-            objects = [
-                obj for obj in content_type.model_class().objects.all() if term.lower() in '{0}'.format(obj).lower()
-            ]
-
-        already_in_navigation = [
-            node.object_id for node in models.NavNode.objects.filter(tree=tree, content_type=content_type)
-        ]
+            # The label is only known by python : the objects are read one by one until enough are found
+            if nav_type.label_rule == models.NavType.LABEL_USE_GET_LABEL:
+                get_label = lambda obj: obj.get_label()
+            else:
+                get_label = lambda obj: '{0}'.format(obj)
+            objects = []
+            for obj in queryset.order_by('pk').iterator():
+                if term.lower() in get_label(obj).lower():
+                    objects.append(obj)
+                    if len(objects) >= limit:
+                        break
 
         # Get suggestions as a list of {label: object.get_label() or unicode if no get_label, 'value':<object.id>}
+        category = get_model_label(model_class).capitalize()
+        object_type = content_type.app_label + '.' + content_type.model
         for obj in objects:
-            if obj.id not in already_in_navigation:
-                # Suggest only articles which are not in navigation yet
-                suggestions.append({
-                    'label': models.get_object_label(content_type, obj),
-                    'value': obj.id,
-                    'category': get_model_label(content_type.model_class()).capitalize(),
-                    'type': content_type.app_label + '.' + content_type.model,
-                })
+            suggestions.append({
+                'label': models.get_object_label(content_type, obj, nav_type),
+                'value': obj.id,
+                'category': category,
+                'type': object_type,
+            })
 
     # Add suggestion for an empty node
     suggestions.append({
@@ -287,6 +307,55 @@ def get_suggest_list(request, tree):
     return response
 
 
+def get_navnode_children(request, tree):
+    """one level of the tree (root nodes if no parent_id) : the admin tree is loaded lazily"""
+    response = {}
+    parent_id = request.POST.get('parent_id', 0)
+    if parent_id:
+        parent = models.NavNode.objects.get(tree=tree, id=parent_id)
+        nodes = models.NavNode.objects.filter(parent=parent)
+    else:
+        nodes = models.NavNode.objects.filter(tree=tree, parent__isnull=True)
+
+    nodes = list(
+        nodes.annotate(
+            children_count=Count('navnode'),
+            children_in_navigation_count=Count('navnode', filter=Q(navnode__in_navigation=True))
+        ).order_by('ordering', 'id')
+    )
+    models.prefetch_content_objects(nodes)
+
+    json_nodes = []
+    for node in nodes:
+        if node.content_type_id:
+            is_accessible = node.is_accessible()
+        else:
+            # an empty node is visible if it has children in navigation
+            is_accessible = node.children_in_navigation_count > 0
+        in_navigation = node.in_navigation and is_accessible
+
+        title = {'title': node.label}
+        url = node.get_absolute_url()
+        if url is not None:
+            title['attr'] = {'href': url}
+
+        json_node = {
+            'data': title,
+            'attr': {'id': 'node_{0}'.format(node.id), 'rel': "in_nav" if in_navigation else "out_nav"},
+            'metadata': {
+                'children_count': node.children_count,
+                'children_in_navigation_count': node.children_in_navigation_count,
+                'in_navigation': in_navigation,
+            },
+        }
+        if node.children_count:
+            json_node['state'] = 'closed'
+        json_nodes.append(json_node)
+
+    response['nodes'] = json_nodes
+    return response
+
+
 def navnode_in_navigation(request, tree):
     """toogle the is_visible_flag of a navnode"""
     response = {}
@@ -305,6 +374,108 @@ def navnode_in_navigation(request, tree):
     return response
 
 
+class BatchOperationRequest(object):
+    """The request given to a handler called from a batch: POST contains the args of the operation"""
+
+    def __init__(self, request, data):
+        self._request = request
+        self.POST = QueryDict(mutable=True)
+        for (key, value) in data.items():
+            if value is not None:
+                self.POST[key] = '{0}'.format(value)
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+class BatchOperationError(ValidationError):
+    """an operation of a batch can not be done: index is its position in the list"""
+
+    def __init__(self, message, index=None, field=None, status_code=200):
+        super(BatchOperationError, self).__init__(message)
+        self.index = index
+        self.field = field
+        self.status_code = status_code
+
+
+# the args of the messages which can be batched
+BATCH_REQUIRED_FIELDS = {
+    'rename_navnode': ('node_id', 'name'),
+    'remove_navnode': ('node_ids', ),
+    'move_navnode': ('node_id', 'ref_pos'),
+    'add_navnode': ('object_type', ),
+    'navnode_in_navigation': ('node_id', ),
+}
+
+
+def _check_batch_operations(operations):
+    """the operations are checked before doing any of them: raise a BatchOperationError with status 400"""
+    if not isinstance(operations, list):
+        raise BatchOperationError(_("Invalid operations"), status_code=400)
+
+    for (index, operation) in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise BatchOperationError(
+                _("Operation {0}: invalid operation").format(index + 1), index=index, status_code=400
+            )
+        msg_id = operation.get('msg_id', '')
+        if msg_id not in BATCH_REQUIRED_FIELDS:
+            raise BatchOperationError(
+                _("Operation {0}: unsupported message {1}").format(index + 1, msg_id),
+                index=index, field='msg_id', status_code=400
+            )
+        required_fields = list(BATCH_REQUIRED_FIELDS[msg_id])
+        if msg_id == 'add_navnode' and operation.get('object_type'):
+            required_fields.append('object_id')
+        for field in required_fields:
+            if field not in operation:
+                raise BatchOperationError(
+                    _("Operation {0}: {1} is missing").format(index + 1, field),
+                    index=index, field=field, status_code=400
+                )
+
+
+def batch_navnodes(request, tree):
+    """
+    Execute a list of operations in a single transaction.
+    operations is a json list of {msg_id: ..., <args of the message>}: results are returned in the same order
+    """
+    batch_functions = (
+        rename_navnode, remove_navnode, move_navnode, add_navnode, navnode_in_navigation,
+    )
+    supported_msg = dict([(fct.__name__, fct) for fct in batch_functions])
+
+    try:
+        operations = json.loads(request.POST.get('operations', ''))
+    except ValueError:
+        raise BatchOperationError(_("Invalid operations"), status_code=400)
+    _check_batch_operations(operations)
+
+    results = []
+    with transaction.atomic():
+        for (index, operation) in enumerate(operations):
+            operation = dict(operation)
+            msg_id = operation.pop('msg_id')
+            try:
+                result = supported_msg[msg_id](BatchOperationRequest(request, operation), tree)
+            except ValidationError as ex:
+                raise BatchOperationError(
+                    _("Operation {0}: {1}").format(index + 1, ' - '.join(ex.messages)), index=index
+                )
+            except ObjectDoesNotExist:
+                raise BatchOperationError(
+                    _("Operation {0}: the node doesn't exist").format(index + 1), index=index
+                )
+            result['msg_id'] = msg_id
+            result['status'] = 'success'
+            results.append(result)
+
+    return {
+        'results': results,
+        'message': _("{0} operations have been done.").format(len(results)),
+    }
+
+
 @login_required
 def process_nav_edition(request, tree_id):
     """This handle ajax request sent by the tree component"""
@@ -315,13 +486,12 @@ def process_nav_edition(request, tree_id):
             tree = get_object_or_404(tree_class, id=tree_id)
 
             # check permissions
-            perm_name = "{0}.change_{1}".format(get_model_app(tree_class), get_model_name(tree_class))
-            if not request.user.has_perm(perm_name):
+            if not _can_edit_navigation(request.user):
                 raise PermissionDenied
 
             functions = (
                 view_navnode, rename_navnode, remove_navnode, move_navnode,
-                add_navnode, get_suggest_list, navnode_in_navigation,
+                add_navnode, get_suggest_list, navnode_in_navigation, batch_navnodes, get_navnode_children,
             )
             supported_msg = {}
             # create a map between message name and handler
@@ -340,6 +510,9 @@ def process_nav_edition(request, tree_id):
             response = {'status': 'error', 'message': "Unsupported message : {0}".format(msg)}
         except PermissionDenied:
             response = {'status': 'error', 'message': "You are not allowed to add a node"}
+        except BatchOperationError as ex:
+            response = {'status': 'error', 'message': ' - '.join(ex.messages), 'index': ex.index, 'field': ex.field}
+            return HttpResponse(json.dumps(response), content_type='application/json', status=ex.status_code)
         except ValidationError as ex:
             response = {'status': 'error', 'message': ' - '.join(ex.messages)}
         except Exception as msg:
@@ -349,3 +522,53 @@ def process_nav_edition(request, tree_id):
         # return the result as json object
         return HttpResponse(json.dumps(response), content_type='application/json')
     raise Http404
+
+
+def _can_edit_navigation(user):
+    """True if the user can edit the navigation trees"""
+    tree_class = get_navtree_class()
+    return user.has_perm("{0}.change_{1}".format(get_model_app(tree_class), get_model_name(tree_class)))
+
+
+def _get_navigation_json_language(request):
+    """the language of the labels and urls: lang arg if valid or current language"""
+    lang = request.GET.get('lang', '')
+    if lang in [code for (code, name) in settings.LANGUAGES]:
+        return lang
+    return translation.get_language()
+
+
+def navigation_json_etag(request, tree_name):
+    """the json depends on the navigation version, language, site, kind of visitor and edit permission"""
+    if not is_navigation_version_enabled():
+        # the changes of the labels and urls of the objects are not tracked
+        return None
+    return make_cache_key(
+        'navigation-json', get_cache_version('navigation'), tree_name, _get_navigation_json_language(request),
+        settings.SITE_ID, get_visitor_class(request), _can_edit_navigation(request.user)
+    )
+
+
+@require_safe
+@condition(etag_func=navigation_json_etag)
+def navigation_json(request, tree_name):
+    """
+    the nodes in navigation as json: can be used for rendering the menus on client side
+    The nodes which can not be accessed (draft articles...) are only sent to the editors of the navigation
+    """
+    tree = get_object_or_404(get_navtree_class(), name=tree_name)
+    lang = _get_navigation_json_language(request)
+    allow_all = _can_edit_navigation(request.user)
+    with translation.override(lang):
+        snapshot = models.NavTreeSnapshot(tree)
+        nodes = [
+            node.as_json_dict(allow_all)
+            for node in snapshot.get_children(None, in_navigation=True, allow_all=allow_all)
+        ]
+    data = {
+        'tree': tree.name,
+        'language': lang,
+        'site': settings.SITE_ID,
+        'nodes': nodes,
+    }
+    return HttpResponse(json.dumps(data), content_type='application/json')
@@ -25,8 +25,8 @@ from coop_cms import models
 from coop_cms.generic_views import EditableObjectView
 from coop_cms.logger import logger
 from coop_cms.optionals import convert_to_pdf, make_absolute_paths, PDFResponse
-from coop_cms.settings import get_newsletter_form, get_newsletter_settings_form
-from coop_cms.utils import send_newsletter, slugify
+from coop_cms.settings import get_article_class, get_newsletter_form, get_newsletter_settings_form
+from coop_cms.utils import get_model_cache_tag, send_newsletter, slugify
 
 
 @login_required
@@ -197,6 +197,12 @@ class NewsletterView(EditableObjectView):
         """after save"""
         pass
 
+    def get_conditional_tags(self):
+        """the newsletter displays some articles"""
+        tags = super(NewsletterView, self).get_conditional_tags()
+        tags.append(get_model_cache_tag(get_article_class()))
+        return tags
+
     def get_template(self):
         """get template"""
         return self.object.get_template_name()
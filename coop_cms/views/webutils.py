@@ -21,6 +21,7 @@ from coop_cms.forms.webutils import LanguageSelectionForm
 from coop_cms.logger import logger
 from coop_cms.moves import make_context
 from coop_cms.settings import get_article_class, is_localized
+from coop_cms.shortcuts import get_article
 from coop_cms.utils import strip_locale_path, make_locale_path
 
 
@@ -48,7 +49,7 @@ def _do_change_language(request, lang_code, current_url):
             # The next should be : /en/home/
 
             # Get the article
-            next_article = article_class.objects.get(slug=path.strip('/'))
+            next_article = get_article(path.strip('/'))
 
         except article_class.DoesNotExist:
             next_article = None